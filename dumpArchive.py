@@ -0,0 +1,283 @@
+############################################################################################
+##              Seekable compressed archive of a whole dump (--archive):                  ##
+##                                                                                        ##
+##  - The plain output of mysqldump, pg_dump or pg_dumpall is split in sections at the    ##
+##    comments they write before every object (table structure, table data, view, ...);   ##
+##  - Each section is compressed in independent frames of at most blockSize bytes (gzip   ##
+##    members/zstd frames/lz4 frames, see dumpCompress), on a pool of threads;            ##
+##  - A trailing index maps every section to the offset/length of its frames, followed    ##
+##    by a fixed size footer pointing at the index;                                       ##
+##  - Extracting a table seeks straight to its sections and only decompresses them,       ##
+##    with the preamble (SET statements, \connect) needed to load them on their own.      ##
+##                                                                                        ##
+## Script calling example:                                                                ##
+##  - python dumpArchive.py -a c:\MySQLDump\DBName.dumparc --list                         ##
+##  - python dumpArchive.py -a c:\MySQLDump\DBName.dumparc --table orders -o orders.sql   ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from datetime import datetime
+import struct
+import gzip
+import json
+import sys
+import re
+import os
+from dumpCompress import blockCompressor, printSizes, blockSize, zstandard, lz4
+from dumpChecksum import HashingTee, addChecksum
+from dumpThrottle import throttleBytes
+from dumpProcess import DumpProcess
+
+## Footer: magic, offset and length of the index ##
+archiveMagic = b'DUMPARC1'
+footerFormat = '<8sQQ'
+footerSize = struct.calcsize(footerFormat)
+
+## Comments starting a new section in the dump output ##
+mysqlMarkers = ((re.compile(rb'^-- Table structure for table `(.+)`'), 'TABLE'),
+                (re.compile(rb'^-- Dumping data for table `(.+)`'), 'TABLE DATA'),
+                (re.compile(rb'^-- (?:Temporary view|Final view) structure for view `(.+)`'), 'VIEW'),
+                (re.compile(rb'^-- Dumping (events|routines) for database'), 'ROUTINES'),
+                (re.compile(rb'^/\*!40103 SET TIME_ZONE=@OLD_TIME_ZONE \*/;()'), 'EPILOGUE'))
+postgresMarker = re.compile(rb'^-- (?:Data for )?Name: (.+?); Type: (.+?); Schema: (.+?);')
+postgresConnect = re.compile(rb'^\\connect (?:-reuse-previous=on )?"?(?:dbname=\'?)?([^"\'\s]+)')
+
+## Statements naming the table of an index or a sequence, whose section names only the object itself ##
+postgresOwners = (re.compile(rb'^CREATE (?:UNIQUE )?INDEX \S+ ON (?:ONLY )?(\S+) '),
+                  re.compile(rb'^ALTER TABLE (?:ONLY )?(\S+) ALTER COLUMN \S+ ADD GENERATED '),
+                  re.compile(rb'^ALTER SEQUENCE \S+ OWNED BY (\S+)\.[^.\s]+;'))
+ownedSections = ('INDEX', 'SEQUENCE', 'SEQUENCE OWNED BY', 'SEQUENCE SET')
+
+## Name of the archive of a dump ##
+def archiveName(name):
+    return name+'.dumparc'
+
+
+## Writer of an archive: sections compressed in independent frames and a trailing index ##
+class ArchiveWriter:
+    def __init__(self,fout,codec='gzip',level=None,threads=None):
+        self.fout = fout
+        self.codec = codec
+        self.compressBlock = blockCompressor(codec,level)
+        self.threads = threads or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(max_workers=self.threads)
+        self.pending = deque()
+        self.sections = []
+        self.section = None
+        self.buffer = []
+        self.bufferSize = 0
+        self.offset = 0
+        self.rawBytes = 0
+
+    def startSection(self,name,kind,database=''):
+        self.flushFrame()
+        self.section = {'name': name, 'type': kind, 'database': database, 'frames': []}
+        self.sections.append(self.section)
+
+    def write(self,data):
+        if self.section is None:
+            self.startSection('', 'PREAMBLE')
+        self.buffer.append(data)
+        self.bufferSize += len(data)
+        self.rawBytes += len(data)
+        if self.bufferSize >= blockSize:
+            self.flushFrame()
+
+    def flushFrame(self):
+        if not self.bufferSize:
+            return
+        block = b''.join(self.buffer)
+        self.buffer = []
+        self.bufferSize = 0
+        self.pending.append((self.pool.submit(self.compressBlock, block), self.section, len(block)))
+        # Keeps at most two frames per thread in memory, written in input order
+        while len(self.pending) >= 2*self.threads:
+            self.writeFrame()
+
+    def writeFrame(self):
+        future, section, rawLength = self.pending.popleft()
+        frame = future.result()
+        self.fout.write(frame)
+        section['frames'].append([self.offset, len(frame), rawLength])
+        self.offset += len(frame)
+
+    def close(self):
+        self.flushFrame()
+        while self.pending:
+            self.writeFrame()
+        self.pool.shutdown()
+        index = gzip.compress(json.dumps({'codec': self.codec, 'createdAt': datetime.now().isoformat(),
+                                          'sections': self.sections}).encode(), mtime=0)
+        self.fout.write(index)
+        self.fout.write(struct.pack(footerFormat, archiveMagic, self.offset, len(index)))
+
+
+## Section started by a line of the dump output, if any ##
+def sectionOf(line,engine,database):
+    if not line.startswith(b'--') and not line.startswith(b'\\') and not line.startswith(b'/*'):
+        return None
+    if engine == 'mysql':
+        for marker, kind in mysqlMarkers:
+            match = marker.match(line)
+            if match:
+                return match.group(1).decode('utf8', 'replace'), kind, database
+        return None
+    match = postgresConnect.match(line)
+    if match:
+        return '', 'PREAMBLE', match.group(1).decode('utf8', 'replace')
+    match = postgresMarker.match(line)
+    if match:
+        name, kind, schema = (group.decode('utf8', 'replace') for group in match.groups())
+        return (name if schema == '-' else schema+'.'+name), kind, database
+    return None
+
+
+## Record the table owning an index or sequence section from one of its statements ##
+def recordOwner(line,section,owners):
+    if section['type'] not in ownedSections or not line.startswith((b'CREATE ', b'ALTER ')):
+        return
+    for owner in postgresOwners:
+        match = owner.match(line)
+        if match:
+            section['table'] = match.group(1).decode('utf8', 'replace').replace('"', '')
+            owners[section['name']] = section['table']
+            return
+
+
+## Stream the dump output into an archive, split in sections ##
+def streamArchive(command,path,name,engine,codec='gzip',level=None,database=''):
+    filename = archiveName(name)
+    startTime = datetime.now()
+
+    with DumpProcess(command) as process:
+        with open(path+filename,'wb') as fout:
+            tee = HashingTee(fout)
+            writer = ArchiveWriter(tee,codec,level)
+            writer.startSection('', 'PREAMBLE', database)
+            owners = {}
+            unthrottled = 0
+            for line in process:
+                section = sectionOf(line,engine,writer.section['database'])
+                if section:
+                    writer.startSection(*section)
+                elif engine == 'postgres':
+                    recordOwner(line,writer.section,owners)
+                writer.write(line)
+                # The rate limiter is called once per block, not for every line
+                unthrottled += len(line)
+                if unthrottled >= blockSize:
+                    throttleBytes(unthrottled)
+                    unthrottled = 0
+            # The sequence comes before its OWNED BY, the SEQUENCE SET after the data
+            for archived in writer.sections:
+                if archived['type'] in ownedSections and 'table' not in archived and archived['name'] in owners:
+                    archived['table'] = owners[archived['name']]
+            writer.close()
+    exitCode = process.exitCode
+
+    if exitCode == 0:
+        addChecksum(filename,tee)
+        print('{} section(s) archived in {}.'.format(len(writer.sections), filename))
+    printSizes(writer.rawBytes, tee.bytes, datetime.now()-startTime)
+    return exitCode
+
+
+## Read the index of an archive ##
+def readIndex(fin):
+    fin.seek(-footerSize, os.SEEK_END)
+    magic, indexOffset, indexLength = struct.unpack(footerFormat, fin.read(footerSize))
+    if magic != archiveMagic:
+        raise ValueError('ERROR: Not a dump archive, or a truncated one.')
+    fin.seek(indexOffset)
+    return json.loads(gzip.decompress(fin.read(indexLength)))
+
+
+## Get the function that decompresses a single frame ##
+def blockDecompressor(codec):
+    if codec == 'gzip':
+        return gzip.decompress
+    elif codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('ERROR: The zstd codec requires the zstandard package.')
+        return lambda frame: zstandard.ZstdDecompressor().decompress(frame)
+    else:
+        if lz4 is None:
+            raise RuntimeError('ERROR: The lz4 codec requires the lz4 package.')
+        return lz4.frame.decompress
+
+
+## Check if a section holds a table: its structure, data, constraints ("table constraint"), indexes and sequences ##
+def isTableSection(section,table):
+    if section['type'] in ('PREAMBLE', 'EPILOGUE'):
+        return False
+    for name in (section['name'].split(' ')[0], section.get('table')):
+        if name and (name == table or name.endswith('.'+table)):
+            return True
+    return False
+
+
+## Write the sections of a table, with the preamble and epilogue of its database ##
+def extractTable(fin,index,table,fout):
+    matched = [isTableSection(section,table) for section in index['sections']]
+    if not any(matched):
+        raise ValueError('ERROR: Table "'+table+'" not found in the archive.')
+    databases = {section['database'] for section, isMatch in zip(index['sections'], matched) if isMatch}
+    decompress = blockDecompressor(index['codec'])
+
+    rawBytes = 0
+    for section, isMatch in zip(index['sections'], matched):
+        if isMatch or (section['type'] in ('PREAMBLE', 'EPILOGUE') and section['database'] in databases):
+            for offset, length, rawLength in section['frames']:
+                fin.seek(offset)
+                fout.write(decompress(fin.read(length)))
+                rawBytes += rawLength
+    return rawBytes
+
+
+## Print the sections of an archive ##
+def listSections(index):
+    for section in index['sections']:
+        rawBytes = sum(frame[2] for frame in section['frames'])
+        print('{}\t{}\t{}\t{} frame(s)\t{:.2f} Mb'.format(section['database'], section['type'], section['name'],
+                                                       len(section['frames']), rawBytes/(1024**2)))
+
+
+## Get initial arguments ##
+def getArguments():
+    arguments = {}
+    for flag, name in (('-a', 'archive'), ('--table', 'table'), ('-o', 'output')):
+        if flag in sys.argv:
+            idx = 0
+            for entry in sys.argv:
+                if entry == flag:
+                    arguments[name] = sys.argv[idx+1]
+                    break
+                else:
+                    idx += 1
+    if '--list' in sys.argv:
+        arguments['list'] = True
+
+    if 'archive' not in arguments or not ('table' in arguments or 'list' in arguments):
+        raise ValueError('Archive (-a) and --table or --list arguments missing.')
+    return arguments
+
+
+### Main ###
+if __name__ == '__main__':
+    executionTime = datetime.now()
+    arguments = getArguments()
+
+    with open(arguments['archive'],'rb') as fin:
+        index = readIndex(fin)
+        if arguments.get('list'):
+            listSections(index)
+        elif arguments.get('output'):
+            with open(arguments['output'],'wb') as fout:
+                rawBytes = extractTable(fin,index,arguments['table'],fout)
+            print('{} extracted to {} ({:.2f} Mb).'.format(arguments['table'], arguments['output'], rawBytes/(1024**2)))
+            print('Execution time: {}'.format(datetime.now()-executionTime))
+        else:
+            extractTable(fin,index,arguments['table'],sys.stdout.buffer)
@@ -0,0 +1,424 @@
+############################################################################################
+##         Script to benchmark the dump modes on a synthetic database:                    ##
+##                                                                                        ##
+## Script calling example:                                                                ##
+##  - python dumpBenchmark.py -e mysql -h localhost -u root -ev MySQLDBPass --generate    ##
+##    --scale 0.1 --jobs 1,4 --codecs gzip,zstd --repeat 3                                ##
+##  - python dumpBenchmark.py -e postgres -h localhost -u postgres -ev postgresDBPass     ##
+##    --compare c:\dumpBenchmark\benchmark_20240101120000.json                            ##
+##                                                                                        ##
+## Arguments Explanation:                                                                 ##
+##                                                                                        ##
+##  - (-e): Engine: mysql or postgres                                                     ##
+##  - (-h): Hostname of a local/test instance, never a production server                  ##
+##  - (-p): Port (Optional)                                                               ##
+##  - (-db): Name of the benchmark database (Optional, default dumpBenchmark)             ##
+##  - (-u): Database user                                                                 ##
+##  - (-ev): Name of environment variable set with Database password for the given user   ##
+##  - (--generate): (Re)create the synthetic tables before the runs (Optional)            ##
+##  - (--scale F): Multiply the row counts of the synthetic tables by F (Optional, def. 1)##
+##  - (--seed N): Seed of the generated values, same seed same data (Optional, def. 42)   ##
+##  - (--modes M): Dump modes to run: full, tables, compressed, server (postgres only)    ##
+##    (Optional, default all of them)                                                     ##
+##  - (--jobs N,N): --jobs values of the tables/compressed/server modes (Optional, def. 1)##
+##  - (--codecs C,C): --codec values of the compressed mode (Optional, default gzip)      ##
+##  - (--repeat N): Runs of every scenario, the median is compared (Optional, default 1)  ##
+##  - (-o): Result file (Optional, default c:\dumpBenchmark\benchmark_<time>.json)        ##
+##  - (--compare FILE): Print the change of every scenario against an earlier result      ##
+##    file (Optional)                                                                     ##
+##                                                                                        ##
+##  - The synthetic schema has many tiny tables, a few huge tables, a wide table and a    ##
+##    BLOB-heavy table, filled with values drawn from a seeded generator;                 ##
+##  - Every scenario runs mysqlDump.py/postgresDump.py in a subprocess, like              ##
+##    dumpOrchestrator.py, and records MB/s and rows/s (from the run report), peak RSS    ##
+##    and CPU time of the script and the dump tools it started.                           ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from datetime import datetime, timedelta
+import subprocess
+import statistics
+import platform
+import tempfile
+import random
+import shutil
+import json
+import time
+import sys
+import os
+from dumpReport import writeReport
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+## Global Flags ##
+engine = None
+DBName = 'dumpBenchmark'
+generateFlag = False
+scale = 1.0
+seed = 42
+modes = ['full', 'tables', 'compressed', 'server']
+jobsList = [1]
+codecs = ['gzip']
+repeat = 1
+outputFile = None
+compareFile = None
+
+## Script and dump folder of each engine ##
+engineScripts = {'mysql': ('mysqlDump.py', 'c:\\MySQLDump\\'), 'postgres': ('postgresDump.py', 'c:\\pgDump\\')}
+
+## Folder of the benchmark results ##
+resultPath = 'c:\\dumpBenchmark\\'
+
+## Synthetic tables: count, rows (scaled) and columns of each shape ##
+shapes = {'tiny': {'tables': 200, 'rows': 10, 'columns': [('name', 'text'), ('value', 'int')]},
+          'huge': {'tables': 2, 'rows': 1000000, 'columns': [('customer_id', 'int'), ('amount', 'decimal'),
+                                                             ('created_at', 'datetime'), ('status', 'text')]},
+          'wide': {'tables': 1, 'rows': 100000, 'columns': [('col_'+str(idx), 'text' if idx % 2 else 'int') for idx in range(59)]},
+          'blob': {'tables': 1, 'rows': 2000, 'columns': [('name', 'text'), ('payload', 'blob')]}}
+
+## Bytes of a BLOB value, half random and half repeated so codecs have something to do ##
+blobBytes = 256*1024
+
+## Column types of each engine ##
+columnTypes = {'mysql': {'id': 'BIGINT NOT NULL PRIMARY KEY', 'int': 'INT', 'decimal': 'DECIMAL(12,2)',
+                         'datetime': 'DATETIME', 'text': 'VARCHAR(64)', 'blob': 'LONGBLOB'},
+               'postgres': {'id': 'BIGINT NOT NULL PRIMARY KEY', 'int': 'INTEGER', 'decimal': 'NUMERIC(12,2)',
+                            'datetime': 'TIMESTAMP', 'text': 'VARCHAR(64)', 'blob': 'BYTEA'}}
+
+## Rows and bytes of an INSERT batch ##
+batchRows = 1000
+batchBytes = 4*1024**2
+
+## Words of the text values ##
+words = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet']
+
+## Connect to the server, with the DBConnect of the engine script ##
+def connect(host,user,password,database):
+    if engine == 'mysql':
+        from mysqlDump import DBConnect
+    else:
+        from postgresDump import DBConnect
+    conn, cursor = DBConnect(host=host,database=database,user=user,password=password)
+    return conn, cursor
+
+
+## Create the benchmark database if it does not exist ##
+def createDatabase(host,user,password):
+    conn, cursor = connect(host,user,password,'mysql' if engine == 'mysql' else 'postgres')
+    try:
+        if engine == 'mysql':
+            cursor.execute('CREATE DATABASE IF NOT EXISTS `'+DBName+'`')
+        else:
+            # CREATE DATABASE can not run in a transaction
+            conn.autocommit = True
+            cursor.execute('SELECT 1 FROM pg_database WHERE datname = %s', (DBName,))
+            if not cursor.fetchall():
+                cursor.execute('CREATE DATABASE "'+DBName+'"')
+    finally:
+        conn.close()
+
+
+## Names of the synthetic tables of a shape ##
+def tableNames(shape):
+    return ['bench_'+shape+'_'+str(idx) for idx in range(shapes[shape]['tables'])]
+
+
+## Value of a generated column ##
+def columnValue(rng,kind):
+    if kind == 'int':
+        return rng.randrange(1000000)
+    if kind == 'decimal':
+        return round(rng.random()*10000, 2)
+    if kind == 'datetime':
+        return datetime(2020, 1, 1)+timedelta(seconds=rng.randrange(100000000))
+    if kind == 'text':
+        return rng.choice(words)+'-'+str(rng.randrange(1000000))
+    randomBytes = blobBytes//2
+    return rng.getrandbits(8*randomBytes).to_bytes(randomBytes, 'little')+b'benchmark'*((blobBytes-randomBytes)//9)
+
+
+## Insert a batch of rows ##
+def insertBatch(cursor,tableName,columns,batch):
+    names = ', '.join(['id']+[name for name, kind in columns])
+    if engine == 'mysql':
+        cursor.executemany('INSERT INTO `'+tableName+'` ('+names+') VALUES ('+', '.join(['%s']*(len(columns)+1))+')', batch)
+    else:
+        from psycopg2.extras import execute_values
+        execute_values(cursor, 'INSERT INTO "'+tableName+'" ('+names+') VALUES %s', batch, page_size=len(batch))
+
+
+## (Re)create and fill a synthetic table, the values only depend on the seed and the table ##
+def generateTable(conn,cursor,tableName,shape):
+    columns = shapes[shape]['columns']
+    rows = max(1, int(shapes[shape]['rows']*scale))
+    quote = '`' if engine == 'mysql' else '"'
+    types = columnTypes[engine]
+    cursor.execute('DROP TABLE IF EXISTS '+quote+tableName+quote)
+    cursor.execute('CREATE TABLE '+quote+tableName+quote+' (id '+types['id']+', '+
+                   ', '.join(name+' '+types[kind] for name, kind in columns)+')')
+    if shape == 'huge':
+        cursor.execute('CREATE INDEX '+tableName+'_customer ON '+quote+tableName+quote+' (customer_id)')
+
+    rng = random.Random('{}:{}'.format(seed, tableName))
+    batch = []
+    size = 0
+    for rowId in range(1, rows+1):
+        row = [rowId]+[columnValue(rng,kind) for name, kind in columns]
+        batch.append(row)
+        size += blobBytes if shape == 'blob' else 64*len(row)
+        if len(batch) >= batchRows or size >= batchBytes:
+            insertBatch(cursor,tableName,columns,batch)
+            batch = []
+            size = 0
+    if batch:
+        insertBatch(cursor,tableName,columns,batch)
+    conn.commit()
+    return rows
+
+
+## Generate the synthetic database ##
+def generateDatabase(host,user,password):
+    startTime = datetime.now()
+    createDatabase(host,user,password)
+    conn, cursor = connect(host,user,password,DBName)
+    generated = {}
+    try:
+        for shape in shapes:
+            for tableName in tableNames(shape):
+                generated[tableName] = generateTable(conn,cursor,tableName,shape)
+            print('{} {} table(s) generated.'.format(shapes[shape]['tables'], shape))
+    finally:
+        conn.close()
+    print('{} row(s) generated in {}.'.format(sum(generated.values()), datetime.now()-startTime))
+    return generated
+
+
+## Count the rows of the synthetic tables ##
+def countRows(host,user,password):
+    conn, cursor = connect(host,user,password,DBName)
+    quote = '`' if engine == 'mysql' else '"'
+    counts = {}
+    try:
+        for shape in shapes:
+            for tableName in tableNames(shape):
+                cursor.execute('SELECT COUNT(*) FROM '+quote+tableName+quote)
+                counts[tableName] = cursor.fetchall()[0][0]
+    finally:
+        conn.close()
+    return counts
+
+
+## Scenarios of the benchmark: name and arguments of the dump script ##
+def makeScenarios():
+    scenarios = []
+    for mode in modes:
+        if mode == 'full':
+            scenarios.append(('full', []))
+        elif mode == 'tables':
+            scenarios += [('tables jobs={}'.format(jobs), ['-t', '--jobs', str(jobs)]) for jobs in jobsList]
+        elif mode == 'compressed':
+            scenarios += [('compressed codec={} jobs={}'.format(codec, jobs), ['-t', '-c', '--codec', codec, '--jobs', str(jobs)])
+                          for codec in codecs for jobs in jobsList]
+        elif mode == 'server':
+            if engine != 'postgres':
+                print('The server mode is only available on postgres, skipped.')
+                continue
+            scenarios += [('server jobs={}'.format(jobs), ['-s', '-sn', DBName+'_server', '--jobs', str(jobs)]) for jobs in jobsList]
+        else:
+            raise ValueError('ERROR: Invalid mode "'+mode+'", use full, tables, compressed or server.')
+    return scenarios
+
+
+## Run a process, sampling the memory and CPU of its whole process tree ##
+def runMeasured(command,cwd,environment):
+    startTime = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, env=environment)
+    if hasattr(os, 'wait4'):
+        # The usage of a waited child includes the dump tools it waited for
+        pid, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        rssFactor = 1 if sys.platform == 'darwin' else 1024
+        return (process.returncode, time.perf_counter()-startTime,
+                usage.ru_maxrss*rssFactor, usage.ru_utime+usage.ru_stime)
+
+    peakRss = None
+    cpuSeconds = {}
+    if psutil is not None:
+        parent = psutil.Process(process.pid)
+        peakRss = 0
+        while process.poll() is None:
+            try:
+                tree = [parent]+parent.children(recursive=True)
+                rss = 0
+                for member in tree:
+                    rss += member.memory_info().rss
+                    cpuTimes = member.cpu_times()
+                    cpuSeconds[member.pid] = cpuTimes.user+cpuTimes.system
+                peakRss = max(peakRss, rss)
+            except psutil.Error:
+                # A process of the tree ended while it was sampled
+                pass
+            time.sleep(0.1)
+    process.wait()
+    return process.returncode, time.perf_counter()-startTime, peakRss, sum(cpuSeconds.values()) if psutil else None
+
+
+## Run a scenario once ##
+def runScenario(name,arguments,host,port,user,environPassword,totalRows):
+    script, dumpPath = engineScripts[engine]
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+    reportName = DBName+'_server' if '-s' in arguments else DBName
+    command = [sys.executable, script, '-h', host, '-db', DBName, '-u', user, '-ev', environPassword]+arguments
+    if port:
+        command += ['-p', str(port)]
+
+    # A report left by the previous scenario would be read if this one ends before writing its own
+    reportPath = dumpPath+reportName+'_report.json'
+    if os.path.exists(reportPath):
+        os.remove(reportPath)
+    workPath = tempfile.mkdtemp(prefix='dumpBenchmark_')
+    try:
+        exitCode, wallSeconds, peakRss, cpuSeconds = runMeasured(command,workPath,dict(os.environ, APPDATA=workPath))
+    finally:
+        shutil.rmtree(workPath, ignore_errors=True)
+
+    run = {}
+    try:
+        with open(reportPath) as fin:
+            run = json.load(fin)['run']
+    except (OSError, ValueError, KeyError):
+        print('[{}] No run report found.'.format(name))
+    # A failed run or a missing report has no throughput, summarize skips it
+    measured = exitCode == 0 and bool(run)
+    rawBytes = run.get('rawBytes') or 0
+    result = {'scenario': name, 'arguments': arguments, 'exitCode': exitCode, 'success': exitCode == 0,
+              'wallSeconds': round(wallSeconds, 3), 'rawBytes': rawBytes, 'compressedBytes': run.get('compressedBytes'),
+              'MBps': round(rawBytes/(1024**2)/max(wallSeconds, 0.001), 2) if measured else None,
+              'rowsPerSecond': round(totalRows/max(wallSeconds, 0.001)) if measured else None,
+              'peakRssBytes': peakRss, 'cpuSeconds': round(cpuSeconds, 3) if cpuSeconds is not None else None}
+    print('[{}] {} in {:.1f}s: {} MB/s, {} rows/s, peak RSS {}, CPU {}'.format(
+        name, 'OK' if result['success'] else 'FAILED (exit code {})'.format(exitCode), wallSeconds,
+        result['MBps'] if measured else 'n/a', result['rowsPerSecond'] if measured else 'n/a', '{:.1f} Mb'.format(peakRss/(1024**2)) if peakRss else 'n/a',
+        '{:.1f}s'.format(cpuSeconds) if cpuSeconds is not None else 'n/a'))
+    return result
+
+
+## Median of every measure of the runs of a scenario ##
+def summarize(runs):
+    summary = {'scenario': runs[0]['scenario'], 'runs': len(runs), 'success': all(run['success'] for run in runs)}
+    for measure in ('wallSeconds', 'MBps', 'rowsPerSecond', 'peakRssBytes', 'cpuSeconds'):
+        values = [run[measure] for run in runs if run[measure] is not None]
+        summary[measure] = statistics.median(values) if values else None
+    return summary
+
+
+## Print the change of every scenario against an earlier result file ##
+def compareResults(results,previousFile):
+    with open(previousFile) as fin:
+        previous = {summary['scenario']: summary for summary in json.load(fin)['summaries']}
+    print('Compared with {}:'.format(previousFile))
+    for summary in results['summaries']:
+        before = previous.get(summary['scenario'])
+        if not before or not before['MBps'] or not summary['MBps']:
+            print('  - {}: no earlier result'.format(summary['scenario']))
+            continue
+        print('  - {}: {} -> {} MB/s ({:+.1f}%), {} -> {} s'.format(summary['scenario'], before['MBps'], summary['MBps'],
+                                                                 (summary['MBps']/before['MBps']-1)*100,
+                                                                 before['wallSeconds'], summary['wallSeconds']))
+
+
+## Git commit of the scripts being measured ##
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+## Generate (optionally) the database and run every scenario ##
+def benchmark(host,port,user,environPassword):
+    startTime = datetime.now()
+    password = os.getenv(environPassword)
+    if generateFlag:
+        generateDatabase(host,user,password)
+    counts = countRows(host,user,password)
+    totalRows = sum(counts.values())
+
+    runs = []
+    summaries = []
+    for name, arguments in makeScenarios():
+        scenarioRuns = [runScenario(name,arguments,host,port,user,environPassword,totalRows) for idx in range(repeat)]
+        runs += scenarioRuns
+        summaries.append(summarize(scenarioRuns))
+
+    results = {'run': {'name': 'benchmark', 'engine': engine, 'database': DBName, 'startedAt': startTime.isoformat(),
+                       'finishedAt': datetime.now().isoformat(), 'commit': gitCommit(), 'platform': platform.platform(),
+                       'python': platform.python_version(), 'cpus': os.cpu_count()},
+               'dataset': {'seed': seed, 'scale': scale, 'rows': totalRows, 'tables': len(counts),
+                           'shapes': {shape: {'tables': spec['tables'], 'rows': max(1, int(spec['rows']*scale))} for shape, spec in shapes.items()}},
+               'summaries': summaries, 'units': runs}
+
+    if not outputFile and not os.path.isdir(resultPath):
+        os.mkdir(resultPath)
+    writeReport(results, outputFile or resultPath+'benchmark_'+startTime.strftime('%Y%m%d%H%M%S')+'.json')
+    if compareFile:
+        compareResults(results,compareFile)
+    return all(summary['success'] for summary in summaries)
+
+
+## Get initial arguments and set flags ##
+def getArguments():
+    arguments = {}
+    for flag, name in (('-e', 'engine'), ('-h', 'host'), ('-p', 'port'), ('-db', 'DBName'), ('-u', 'user'),
+                       ('-ev', 'environPassword'), ('--scale', 'scale'), ('--seed', 'seed'), ('--modes', 'modes'),
+                       ('--jobs', 'jobs'), ('--codecs', 'codecs'), ('--repeat', 'repeat'), ('-o', 'output'),
+                       ('--compare', 'compare')):
+        if flag in sys.argv:
+            idx = 0
+            for entry in sys.argv:
+                if entry == flag:
+                    arguments[name] = sys.argv[idx+1]
+                    break
+                else:
+                    idx += 1
+
+    global engine, DBName, generateFlag, scale, seed, modes, jobsList, codecs, repeat, outputFile, compareFile
+    engine = arguments.get('engine')
+    if engine not in engineScripts:
+        raise ValueError('Engine argument (-e) missing, use mysql or postgres.')
+    DBName = arguments.get('DBName', DBName)
+    generateFlag = '--generate' in sys.argv
+    scale = float(arguments.get('scale', scale))
+    seed = int(arguments.get('seed', seed))
+    if 'modes' in arguments:
+        modes = arguments['modes'].split(',')
+    if 'jobs' in arguments:
+        jobsList = [int(jobs) for jobs in arguments['jobs'].split(',')]
+    if 'codecs' in arguments:
+        codecs = arguments['codecs'].split(',')
+    repeat = int(arguments.get('repeat', repeat))
+    outputFile = arguments.get('output')
+    compareFile = arguments.get('compare')
+
+    if not (arguments.get('host') and arguments.get('user') and arguments.get('environPassword')):
+        raise ValueError('Host (-h), user (-u) and/or password variable (-ev) arguments missing.')
+    return arguments['host'], arguments.get('port'), arguments['user'], arguments['environPassword']
+
+
+### Main ###
+if __name__ == '__main__':
+    executionTime = datetime.now()
+    host, port, user, environPassword = getArguments()
+
+    if benchmark(host,port,user,environPassword):
+        print('Benchmark finished.')
+        print('Execution time: {}'.format(datetime.now()-executionTime))
+    else:
+        print('Some scenarios failed.')
+        print('Execution time: {}'.format(datetime.now()-executionTime))
+        sys.exit(1)
@@ -0,0 +1,170 @@
+############################################################################################
+##                   In-flight checksums of the dump files (--hash):                      ##
+##                                                                                        ##
+##  - Every file written in-process (dump pipes, compressed files, native exports) goes   ##
+##    through a HashingTee counting its bytes and hashing them while they are written,    ##
+##    so a file is never read back just to be checksummed;                                ##
+##  - Hash algorithms: sha256 (default) or xxhash (needs the xxhash package);             ##
+##  - At the end of a run the checksums are saved in <DB>_checksums.json, with the row    ##
+##    count of every table (exact when it was counted, else the catalog estimate);        ##
+##  - dumpVerify.py checks the files (and optionally the live row counts) against it.     ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from datetime import datetime
+import threading
+import hashlib
+import json
+import os
+from dumpProcess import DumpProcess
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+## Size of the blocks copied from a dump pipe ##
+blockSize = 1024**2
+
+## Hash algorithm of the run ##
+hashAlgorithm = 'sha256'
+hashAlgorithms = ('sha256', 'xxhash')
+
+## Checksums of the files written in the current run ##
+runChecksums = {}
+checksumLock = threading.Lock()
+
+## Choose the hash algorithm of the run ##
+def setHashAlgorithm(algorithm):
+    global hashAlgorithm
+    if algorithm not in hashAlgorithms:
+        raise ValueError('ERROR: Invalid hash "'+str(algorithm)+'", use one of: '+', '.join(hashAlgorithms)+'.')
+    if algorithm == 'xxhash' and xxhash is None:
+        raise RuntimeError('ERROR: The xxhash hash requires the xxhash package.')
+    hashAlgorithm = algorithm
+
+
+## New hash object of an algorithm ##
+def newHash(algorithm=None):
+    if (algorithm or hashAlgorithm) == 'xxhash':
+        return xxhash.xxh64()
+    return hashlib.sha256()
+
+
+## Stream counting and hashing the bytes read from or written to it ##
+class HashingTee:
+    def __init__(self,stream,algorithm=None):
+        self.stream = stream
+        self.algorithm = algorithm or hashAlgorithm
+        self.hash = newHash(self.algorithm)
+        self.bytes = 0
+
+    def read(self,size=-1):
+        data = self.stream.read(size)
+        self.hash.update(data)
+        self.bytes += len(data)
+        return data
+
+    def write(self,data):
+        self.hash.update(data)
+        self.bytes += len(data)
+        return self.stream.write(data)
+
+    def tell(self):
+        return self.stream.tell()
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+## Start the checksums of a new run ##
+def startChecksums():
+    with checksumLock:
+        runChecksums.clear()
+
+
+## Record the checksum of a file ##
+def setChecksum(filename,size,digest,algorithm=None):
+    with checksumLock:
+        runChecksums[filename] = {'bytes': size, algorithm or hashAlgorithm: digest}
+
+
+## Record the checksum of a file written through a tee ##
+def addChecksum(filename,tee):
+    setChecksum(filename, tee.bytes, tee.hexdigest(), tee.algorithm)
+
+
+## Checksum of a file recorded in this run, if any ##
+def recordedChecksum(filename,algorithm='sha256'):
+    with checksumLock:
+        entry = runChecksums.get(filename)
+    if entry and algorithm in entry:
+        return entry['bytes'], entry[algorithm]
+    return None
+
+
+## Size and hash of a file, or of every file of a dump folder, read from disk ##
+def fileChecksum(filePath,algorithm=None):
+    tee = HashingTee(None, algorithm)
+    if os.path.isdir(filePath):
+        filePaths = [os.path.join(filePath, name) for name in sorted(os.listdir(filePath))]
+    else:
+        filePaths = [filePath]
+    for name in filePaths:
+        with open(name,'rb') as fin:
+            tee.stream = fin
+            while tee.read(blockSize):
+                pass
+    return tee.bytes, tee.hexdigest()
+
+
+## Record the checksum of a file written by another process (pg_dump -f, directory format) ##
+def addFileChecksum(path,filename):
+    size, digest = fileChecksum(path+filename)
+    setChecksum(filename, size, digest)
+
+
+## Run a dump command and write its output to a file, hashed in flight ##
+def streamDump(command,path,filename):
+    with DumpProcess(command) as process:
+        with open(path+filename,'wb') as fout:
+            tee = HashingTee(fout)
+            while True:
+                block = process.read(blockSize)
+                if not block:
+                    break
+                tee.write(block)
+    exitCode = process.exitCode
+    if exitCode == 0:
+        addChecksum(filename,tee)
+    return exitCode
+
+
+## Path of the checksum manifest of a database ##
+def checksumPath(path,DBName):
+    return path+DBName+'_checksums.json'
+
+
+## Tables of a native export, with the rows counted while exporting them ##
+def exportedTables(exportManifestFile):
+    with open(exportManifestFile) as fin:
+        manifest = json.load(fin)
+    return {table['name']: {'files': table['files'], 'rows': table.get('rows'), 'exact': True} for table in manifest['tables']}
+
+
+## Tables of a dump plan, with the row estimate of the catalog ##
+def plannedTables(units):
+    return {unit['name']: {'files': [unit['file']], 'rows': unit['rows'], 'exact': False} for unit in units}
+
+
+## Save the checksums of the run with the row count of every table ##
+def saveChecksums(path,DBName,tables,engine):
+    with checksumLock:
+        files = dict(runChecksums)
+    manifest = {'database': DBName, 'engine': engine, 'algorithm': hashAlgorithm,
+                'createdAt': datetime.now().isoformat(), 'files': files, 'tables': tables}
+    tempPath = checksumPath(path,DBName)+'.tmp'
+    with open(tempPath,'w') as fout:
+        json.dump(manifest, fout, indent=2)
+    os.replace(tempPath, checksumPath(path,DBName))
@@ -0,0 +1,352 @@
+############################################################################################
+##           Content-addressed chunk store of the dump files (--repository):              ##
+##                                                                                        ##
+##  - The output of mysqldump/pg_dump is cut in content-defined chunks (the cut points    ##
+##    only depend on the bytes around them, so an insert early in a table does not shift  ##
+##    every later chunk), between minChunk and maxChunk bytes, averaging avgChunk;        ##
+##  - Each chunk is stored once, compressed (--codec, --level), under the SHA-256 of its  ##
+##    content in <dump folder>\repository\chunks, a chunk already stored by an earlier    ##
+##    run is not written again;                                                           ##
+##  - Every run writes a small manifest in repository\runs listing the chunks of its      ##
+##    files, --restore rebuilds the files of a run manifest;                              ##
+##  - --gc drops the run manifests beyond the last --keep N of every database, then the   ##
+##    chunks no manifest references. A running backup has a .running marker in            ##
+##    repository\runs until its manifest is saved, --gc removes no chunk while one is     ##
+##    younger than gcGrace hours, and a backup starting during --gc waits for its end.    ##
+##                                                                                        ##
+## Script calling example:                                                                ##
+##  - python dumpChunkStore.py -r c:\MySQLDump\repository --gc --keep 30                  ##
+##  - python dumpChunkStore.py -r c:\MySQLDump\repository --list                          ##
+##  - python dumpChunkStore.py -r c:\MySQLDump\repository --restore                       ##
+##    DBName_20240101120000000000.json -o c:\restore                                      ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from datetime import datetime
+import threading
+import hashlib
+import json
+import time
+import sys
+import os
+from dumpCompress import blockCompressor, printSizes
+from dumpArchive import blockDecompressor
+from dumpChecksum import setChecksum
+from dumpReport import writeAtomic
+from dumpThrottle import throttleBytes
+from dumpProcess import DumpProcess
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+## Chunk sizes: a cut point is expected every avgChunk bytes ##
+minChunk = 64*1024
+avgChunk = 256*1024
+maxChunk = 2*1024**2
+
+## Bytes read from the dump pipe at a time ##
+readSize = 8*1024**2
+
+## Hours a chunk is kept by --gc after it was written or reused, and a .running marker or gc lock is honoured ##
+gcGrace = 24
+
+## Seconds between two checks of the gc lock by a starting run ##
+gcPoll = 5
+
+## Multiplier of the hash of the 8 bytes ending at each position ##
+windowMultiplier = 0x9E3779B97F4A7C15
+
+## Extension of the chunks of each codec ##
+chunkExtensions = {'gzip': '.gz', 'zstd': '.zst', 'lz4': '.lz4'}
+
+## Repository and files of the current run ##
+repository = {}
+runFiles = {}
+repositoryLock = threading.Lock()
+
+## Folder of the repository of a dump folder ##
+def repositoryPath(path):
+    return os.path.join(path, 'repository')
+
+
+## Path of a stored chunk ##
+def chunkPath(repositoryFolder,digest,codec):
+    return os.path.join(repositoryFolder, 'chunks', digest[:2], digest+chunkExtensions[codec])
+
+
+## Path of the lock --gc holds while it removes chunks ##
+def gcLockPath(repositoryFolder):
+    return os.path.join(repositoryFolder, 'gc.lock')
+
+
+## Path of the marker of a run that has not saved its manifest yet ##
+def runningMarkerPath(repositoryFolder,name):
+    return os.path.join(repositoryFolder, 'runs', name+'.running')
+
+
+## True when a file exists and is younger than gcGrace hours, older ones are left by a crashed process ##
+def isFresh(filePath):
+    try:
+        return os.stat(filePath).st_mtime >= time.time()-gcGrace*3600
+    except FileNotFoundError:
+        return False
+
+
+## Start the repository of a new run ##
+def startRepository(path,DBName,codec='gzip',level=None):
+    if numpy is None:
+        raise RuntimeError('ERROR: The repository requires the numpy package.')
+    startedAt = datetime.now()
+    with repositoryLock:
+        repository.update({'path': repositoryPath(path), 'database': DBName, 'codec': codec,
+                           'compress': blockCompressor(codec,level), 'startedAt': startedAt,
+                           'name': DBName+'_'+startedAt.strftime('%Y%m%d%H%M%S%f')})
+        runFiles.clear()
+    for folder in ('chunks', 'runs'):
+        os.makedirs(os.path.join(repository['path'], folder), exist_ok=True)
+    # The marker is written before the gc lock is checked: a --gc starting later sees it and keeps every chunk
+    with open(runningMarkerPath(repository['path'],repository['name']),'w') as fout:
+        fout.write(startedAt.isoformat())
+    if isFresh(gcLockPath(repository['path'])):
+        print('Waiting for the --gc of the repository to end.')
+        while isFresh(gcLockPath(repository['path'])):
+            time.sleep(gcPoll)
+
+
+## Cut points of a buffer, the first one at least minChunk bytes after the start ##
+def cutPoints(buffer,final=False):
+    cuts = []
+    start = 0
+    if len(buffer) >= 8:
+        # Hash of the 8 bytes ending at every position, a cut follows the ones with the top bits clear
+        windows = numpy.ndarray(shape=(len(buffer)-7,), dtype='<u8', buffer=buffer, strides=(1,))
+        hashes = windows*numpy.uint64(windowMultiplier)
+        candidates = numpy.flatnonzero(hashes < numpy.uint64(2**64//avgChunk))+8
+        for cut in candidates.tolist():
+            if cut-start < minChunk:
+                continue
+            while cut-start > maxChunk:
+                start += maxChunk
+                cuts.append(start)
+            cuts.append(cut)
+            start = cut
+    while len(buffer)-start >= maxChunk:
+        start += maxChunk
+        cuts.append(start)
+    if final and start < len(buffer):
+        cuts.append(len(buffer))
+    return cuts
+
+
+## Store a chunk unless the repository already has it, returns the bytes written ##
+def storeChunk(chunk):
+    digest = hashlib.sha256(chunk).hexdigest()
+    filePath = chunkPath(repository['path'],digest,repository['codec'])
+    if os.path.exists(filePath):
+        # Reused chunks are touched so --gc keeps them while this run has no manifest yet
+        os.utime(filePath)
+        return digest, 0
+    data = repository['compress'](chunk)
+    os.makedirs(os.path.dirname(filePath), exist_ok=True)
+    tempPath = filePath+'.'+str(threading.get_ident())+'.tmp'
+    with open(tempPath,'wb') as fout:
+        fout.write(data)
+    os.replace(tempPath, filePath)
+    return digest, len(data)
+
+
+## Run a dump command and store its output in the repository ##
+def storeDump(command,path,filename):
+    startTime = datetime.now()
+    fileHash = hashlib.sha256()
+    chunks = []
+    rawBytes = 0
+    writtenBytes = 0
+
+    with DumpProcess(command) as process:
+        buffer = b''
+        while True:
+            block = process.read(readSize)
+            buffer += block
+            start = 0
+            for cut in cutPoints(buffer,final=not block):
+                chunk = buffer[start:cut]
+                digest, written = storeChunk(chunk)
+                chunks.append([digest, len(chunk)])
+                writtenBytes += written
+                start = cut
+            buffer = buffer[start:]
+            if not block:
+                break
+            fileHash.update(block)
+            rawBytes += len(block)
+            throttleBytes(len(block))
+    exitCode = process.exitCode
+
+    if exitCode == 0:
+        # Recorded like a written file, so the journal can mark the table done
+        setChecksum(filename, rawBytes, fileHash.hexdigest(), 'sha256')
+        with repositoryLock:
+            runFiles[filename] = {'bytes': rawBytes, 'sha256': fileHash.hexdigest(), 'chunks': chunks}
+        print('{}: {} chunk(s), {:.2f} Mb new in the repository.'.format(filename, len(chunks), writtenBytes/(1024**2)))
+    printSizes(rawBytes, writtenBytes, datetime.now()-startTime)
+    return exitCode
+
+
+## Path of the manifest of a run ##
+def runManifestPath(repositoryFolder,name):
+    return os.path.join(repositoryFolder, 'runs', name+'.json')
+
+
+## Save the manifest of the run ##
+def saveRunManifest():
+    with repositoryLock:
+        files = dict(runFiles)
+    name = repository['name']
+    manifest = {'database': repository['database'], 'codec': repository['codec'],
+                'createdAt': repository['startedAt'].isoformat(), 'files': files}
+    writeAtomic(runManifestPath(repository['path'],name), json.dumps(manifest, indent=2))
+    os.remove(runningMarkerPath(repository['path'],name))
+    rawBytes = sum(entry['bytes'] for entry in files.values())
+    print('Run manifest {} saved: {} file(s), {:.2f} Mb.'.format(name, len(files), rawBytes/(1024**2)))
+    return name
+
+
+## Run manifests of a repository, oldest first ##
+def listRuns(repositoryFolder):
+    runs = []
+    for filename in sorted(os.listdir(os.path.join(repositoryFolder, 'runs'))):
+        if filename.endswith('.json'):
+            with open(os.path.join(repositoryFolder, 'runs', filename)) as fin:
+                manifest = json.load(fin)
+            runs.append((manifest['createdAt'], filename[:-len('.json')], manifest))
+    return sorted(runs, key=lambda run: run[0])
+
+
+## Rebuild the files of a run, checking their SHA-256 ##
+def restoreRun(repositoryFolder,name,outputPath):
+    with open(runManifestPath(repositoryFolder,name)) as fin:
+        manifest = json.load(fin)
+    decompress = blockDecompressor(manifest['codec'])
+    os.makedirs(outputPath, exist_ok=True)
+
+    failures = 0
+    for filename, entry in sorted(manifest['files'].items()):
+        fileHash = hashlib.sha256()
+        with open(os.path.join(outputPath, filename),'wb') as fout:
+            for digest, length in entry['chunks']:
+                with open(chunkPath(repositoryFolder,digest,manifest['codec']),'rb') as fin:
+                    chunk = decompress(fin.read())
+                fileHash.update(chunk)
+                fout.write(chunk)
+        matches = fileHash.hexdigest() == entry['sha256']
+        if not matches:
+            failures += 1
+        print('{}: {}'.format(filename, 'OK' if matches else 'CHECKSUM MISMATCH'))
+    return failures == 0
+
+
+## Drop the runs beyond the last keep of every database, then the chunks no run references ##
+def collectGarbage(repositoryFolder,keep=None):
+    lockPath = gcLockPath(repositoryFolder)
+    if isFresh(lockPath):
+        raise RuntimeError('ERROR: Another --gc holds {}.'.format(lockPath))
+    with open(lockPath,'w') as fout:
+        fout.write(datetime.now().isoformat())
+    try:
+        sweepRepository(repositoryFolder,keep)
+    finally:
+        os.remove(lockPath)
+
+
+## Body of collectGarbage, run while the gc lock is held ##
+def sweepRepository(repositoryFolder,keep):
+    runs = listRuns(repositoryFolder)
+    if keep:
+        byDatabase = {}
+        for createdAt, name, manifest in runs:
+            byDatabase.setdefault(manifest['database'], []).append(name)
+        for names in byDatabase.values():
+            for name in names[:-keep]:
+                os.remove(runManifestPath(repositoryFolder,name))
+                print('Run {} dropped.'.format(name))
+        runs = listRuns(repositoryFolder)
+
+    referenced = set()
+    for createdAt, name, manifest in runs:
+        extension = chunkExtensions[manifest['codec']]
+        for entry in manifest['files'].values():
+            referenced.update(digest+extension for digest, length in entry['chunks'])
+
+    # A run started before the lock was taken may reuse any chunk, nothing is removed until it saved its manifest
+    runningFolder = os.path.join(repositoryFolder, 'runs')
+    running = [filename[:-len('.running')] for filename in os.listdir(runningFolder)
+               if filename.endswith('.running') and isFresh(os.path.join(runningFolder, filename))]
+    graceLimit = time.time()-gcGrace*3600
+    removed = 0
+    freedBytes = 0
+    keptBytes = 0
+    chunksFolder = os.path.join(repositoryFolder, 'chunks')
+    for prefix in os.listdir(chunksFolder):
+        for entry in os.scandir(os.path.join(chunksFolder, prefix)):
+            stat = entry.stat()
+            if not running and entry.name not in referenced and stat.st_mtime < graceLimit:
+                os.remove(entry.path)
+                removed += 1
+                freedBytes += stat.st_size
+            else:
+                keptBytes += stat.st_size
+    if running:
+        print('No chunk removed, run(s) in progress: {}.'.format(', '.join(sorted(running))))
+    print('{} run(s) kept, {} chunk(s) removed ({:.2f} Mb freed), {:.2f} Mb stored.'.format(
+        len(runs), removed, freedBytes/(1024**2), keptBytes/(1024**2)))
+
+
+## Print the runs of a repository ##
+def printRuns(repositoryFolder):
+    for createdAt, name, manifest in listRuns(repositoryFolder):
+        rawBytes = sum(entry['bytes'] for entry in manifest['files'].values())
+        chunks = sum(len(entry['chunks']) for entry in manifest['files'].values())
+        print('{}\t{}\t{} file(s)\t{} chunk(s)\t{:.2f} Mb'.format(name, manifest['database'], len(manifest['files']),
+                                                             chunks, rawBytes/(1024**2)))
+
+
+## Get initial arguments ##
+def getArguments():
+    arguments = {}
+    for flag, name in (('-r', 'repository'), ('--keep', 'keep'), ('--restore', 'restore'), ('-o', 'output')):
+        if flag in sys.argv:
+            idx = 0
+            for entry in sys.argv:
+                if entry == flag:
+                    arguments[name] = sys.argv[idx+1]
+                    break
+                else:
+                    idx += 1
+    for flag, name in (('--gc', 'gc'), ('--list', 'list')):
+        if flag in sys.argv:
+            arguments[name] = True
+
+    if 'repository' not in arguments or not ('gc' in arguments or 'list' in arguments or 'restore' in arguments):
+        raise ValueError('Repository (-r) and --gc, --list or --restore arguments missing.')
+    if 'restore' in arguments and 'output' not in arguments:
+        raise ValueError('--restore needs an output folder (-o).')
+    return arguments
+
+
+### Main ###
+if __name__ == '__main__':
+    executionTime = datetime.now()
+    arguments = getArguments()
+
+    if arguments.get('gc'):
+        collectGarbage(arguments['repository'],int(arguments['keep']) if 'keep' in arguments else None)
+    elif arguments.get('list'):
+        printRuns(arguments['repository'])
+    elif not restoreRun(arguments['repository'],os.path.splitext(os.path.basename(arguments['restore']))[0],arguments['output']):
+        print('The restore could not be done.')
+        sys.exit(1)
+    print('Execution time: {}'.format(datetime.now()-executionTime))
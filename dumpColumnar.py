@@ -0,0 +1,255 @@
+############################################################################################
+##              Columnar export of the tables to Parquet or Arrow IPC (--columnar):       ##
+##                                                                                        ##
+##  - The tables are planned and split in primary key ranges like the native exporters    ##
+##    (mysqlExport/pgExport), and read on --jobs N connections sharing one snapshot;      ##
+##  - Rows are fetched fetchChunk at a time (unbuffered cursor on MySQL, server-side      ##
+##    cursor on PostgreSQL) and converted to Arrow record batches typed from the          ##
+##    catalog (integers, decimals, dates and timestamps keep their type, the types Arrow  ##
+##    has no match for are written as text);                                              ##
+##  - Batches are written as row groups of at most rowGroupRows rows or rowGroupBytes,    ##
+##    so memory stays flat whatever the table size;                                       ##
+##  - Parquet pages (or Arrow IPC buffers) are compressed with --codec, files are hashed  ##
+##    by dumpChecksum while they are written;                                             ##
+##  - A <DB>_columnar.json lists the files, the Arrow schema and the rows of each table.  ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from datetime import datetime
+import threading
+import json
+from dumpScheduler import runParallel, allSucceeded
+from dumpReport import recordMetrics
+from dumpThrottle import throttleBytes
+from dumpChecksum import HashingTee, addChecksum
+from dumpSnapshot import exportPostgresSnapshot
+import mysqlExport
+import pgExport
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+## Rows fetched at a time, and size of the row groups written ##
+fetchChunk = 10000
+rowGroupRows = 128*1024
+rowGroupBytes = 64*1024**2
+
+## Columnar formats and their file extension ##
+columnarFormats = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+## Compression of each codec in Parquet and Arrow IPC (IPC has no gzip) ##
+parquetCodecs = {'gzip': 'gzip', 'zstd': 'zstd', 'lz4': 'lz4'}
+arrowCodecs = {'zstd': 'zstd', 'lz4': 'lz4_frame'}
+columnarCodecs = {'parquet': sorted(parquetCodecs), 'arrow': sorted(arrowCodecs)}
+
+## HashingTee usable as an Arrow output stream ##
+class ArrowSink(HashingTee):
+    closed = False
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.closed = True
+
+
+## Text of a value without an Arrow type ##
+def textValue(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value).decode('utf8', 'replace')
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return mysqlExport.valueText(value)
+
+
+## Arrow type of a column (and the conversion of its values, if any) ##
+def arrowType(engine,dataType,columnType,precision,scale):
+    dataType = dataType.lower()
+    unsigned = 'unsigned' in (columnType or '').lower()
+    if dataType in ('tinyint', 'smallint', 'mediumint', 'int', 'integer', 'bigint', 'year'):
+        bits = {'tinyint': 8, 'smallint': 16, 'year': 16, 'mediumint': 32, 'int': 32, 'integer': 32, 'bigint': 64}[dataType]
+        return getattr(pyarrow, ('uint' if unsigned else 'int')+str(bits))(), None
+    if dataType == 'bit':
+        return pyarrow.int64(), lambda value: int.from_bytes(value, 'big') if isinstance(value, (bytes, bytearray)) else int(value)
+    if dataType in ('decimal', 'numeric') and precision and precision <= 38:
+        return pyarrow.decimal128(precision, scale or 0), None
+    if dataType in ('float', 'real'):
+        return pyarrow.float32(), None
+    if dataType in ('double', 'double precision'):
+        return pyarrow.float64(), None
+    if dataType == 'boolean':
+        return pyarrow.bool_(), None
+    if dataType == 'date':
+        return pyarrow.date32(), None
+    if dataType in ('datetime', 'timestamp', 'timestamp without time zone'):
+        return pyarrow.timestamp('us'), None
+    if dataType == 'timestamp with time zone':
+        return pyarrow.timestamp('us', tz='UTC'), None
+    if dataType == 'time without time zone':
+        return pyarrow.time64('us'), None
+    if (engine == 'mysql' and dataType == 'time') or dataType == 'interval':
+        return pyarrow.duration('us'), None
+    if dataType in ('binary', 'varbinary', 'tinyblob', 'blob', 'mediumblob', 'longblob', 'bytea'):
+        return pyarrow.binary(), bytes
+    return pyarrow.string(), textValue
+
+
+## Arrow type of the columns of every table, from the catalog ##
+def queryColumnTypes(engine,cursor,DBName):
+    if engine == 'mysql':
+        cursor.execute("SELECT table_name, column_name, data_type, column_type, numeric_precision, numeric_scale "
+                       "FROM information_schema.columns WHERE (table_schema = %s)", (DBName,))
+    else:
+        cursor.execute("SELECT table_name, column_name, data_type, udt_name, numeric_precision, numeric_scale "
+                       "FROM information_schema.columns WHERE (table_schema = 'public')")
+    return {(tableName, columnName): arrowType(engine,dataType,columnType,precision,scale)
+            for tableName, columnName, dataType, columnType, precision, scale in cursor.fetchall()}
+
+
+## Arrow record batch of fetched rows ##
+def recordBatch(rows,schema,converters):
+    arrays = []
+    for values, field, convert in zip(zip(*rows), schema, converters):
+        if convert:
+            values = [None if value is None else convert(value) for value in values]
+        arrays.append(pyarrow.array(values, type=field.type))
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+## Write the rows of a cursor to a columnar file, one row group per rowGroupRows/rowGroupBytes ##
+def writeColumnar(cursor,fout,table,columnarFormat,codec):
+    schema = table['schema']
+    if columnarFormat == 'parquet':
+        writer = pyarrow.parquet.ParquetWriter(pyarrow.PythonFile(fout, mode='w'), schema, compression=parquetCodecs[codec])
+    else:
+        writer = pyarrow.ipc.new_file(pyarrow.PythonFile(fout, mode='w'), schema,
+                                      options=pyarrow.ipc.IpcWriteOptions(compression=arrowCodecs[codec]))
+    rowCount = 0
+    rawBytes = 0
+    pending = []
+    pendingRows = 0
+    pendingBytes = 0
+    try:
+        while True:
+            rows = cursor.fetchmany(fetchChunk)
+            if rows:
+                batch = recordBatch(rows,schema,table['converters'])
+                throttleBytes(batch.nbytes)
+                pending.append(batch)
+                pendingRows += batch.num_rows
+                pendingBytes += batch.nbytes
+                rowCount += batch.num_rows
+                rawBytes += batch.nbytes
+            if pending and (not rows or pendingRows >= rowGroupRows or pendingBytes >= rowGroupBytes):
+                rowGroup = pyarrow.Table.from_batches(pending, schema=schema).combine_chunks()
+                writer.write_table(rowGroup, **({'row_group_size': rowGroup.num_rows} if columnarFormat == 'parquet' else {}))
+                pending = []
+                pendingRows = 0
+                pendingBytes = 0
+            if not rows:
+                break
+    finally:
+        writer.close()
+    return rowCount, rawBytes
+
+
+## Export the rows of a unit to its columnar file ##
+def exportUnit(cursor,path,tables,unit,columnarFormat,codec):
+    cursor.execute(unit['query'])
+    with open(path+unit['file'],'wb') as fout:
+        sink = ArrowSink(fout)
+        rowCount, rawBytes = writeColumnar(cursor,sink,tables[unit['table']],columnarFormat,codec)
+        # The raw size is the size of the rows in Arrow memory
+        recordMetrics(rows=rowCount, rawBytes=rawBytes, compressedBytes=sink.bytes)
+    addChecksum(unit['file'],sink)
+    return 0
+
+
+## Export a unit on a pooled MySQL connection ##
+def exportMysqlUnit(connections,path,tables,unit,columnarFormat,codec):
+    conn, cursor = connections.get()
+    try:
+        return exportUnit(cursor,path,tables,unit,columnarFormat,codec)
+    finally:
+        mysqlExport.releaseConnection(connections,conn,cursor)
+
+
+## Export a unit on the PostgreSQL connection of the worker, through a server-side cursor ##
+def exportPostgresUnit(connect,workers,opened,snapshotId,path,tables,unit,columnarFormat,codec):
+    pgExport.workerConnection(connect,workers,opened,snapshotId)
+    cursor = workers.conn.cursor(name='columnar_'+str(threading.get_ident()))
+    cursor.itersize = fetchChunk
+    try:
+        return exportUnit(cursor,path,tables,unit,columnarFormat,codec)
+    finally:
+        cursor.close()
+
+
+## Path of the columnar manifest of a database ##
+def columnarManifestPath(path,DBName):
+    return path+DBName+'_columnar.json'
+
+
+## Export the tables of a database to Parquet/Arrow files ##
+def exportColumnar(connect,DBName,path,engine,jobs=1,columnarFormat='parquet',codec='zstd'):
+    if pyarrow is None:
+        raise RuntimeError('ERROR: The columnar export requires the pyarrow package.')
+    if columnarFormat not in columnarFormats:
+        raise ValueError('ERROR: Invalid columnar format "'+str(columnarFormat)+'", use one of: '+', '.join(columnarFormats)+'.')
+    if codec not in columnarCodecs[columnarFormat]:
+        raise ValueError('ERROR: Invalid codec "'+str(codec)+'" for '+columnarFormat+', use one of: '+', '.join(columnarCodecs[columnarFormat])+'.')
+    startTime = datetime.now()
+    extension = columnarFormats[columnarFormat]
+    jobs = max(1, int(jobs))
+    opened = []
+    try:
+        if engine == 'mysql':
+            connections = mysqlExport.openSnapshots(connect,jobs,opened)
+            conn, cursor = connections.get()
+            tables = mysqlExport.queryExportTables(conn,cursor,DBName)
+        else:
+            conn, cursor = connect()
+            opened.append(conn)
+            snapshotId = exportPostgresSnapshot(conn,cursor)
+            tables = pgExport.queryExportTables(conn,cursor)
+        print('Exporting {} to {} on one snapshot.'.format(DBName, columnarFormat))
+
+        columnTypes = queryColumnTypes(engine,cursor,DBName)
+        units = []
+        for table in tables:
+            types = [columnTypes[(table['name'], column)] for column in table['columns']]
+            table['schema'] = pyarrow.schema([(column, arrowType) for column, (arrowType, convert) in zip(table['columns'], types)])
+            table['converters'] = [convert for arrowType, convert in types]
+            if engine == 'mysql':
+                units += mysqlExport.splitTable(cursor,DBName,table,extension)
+            else:
+                units += pgExport.splitTable(cursor,DBName,table,extension)
+
+        tablesByName = {table['name']: table for table in tables}
+        if engine == 'mysql':
+            connections.put((conn, cursor))
+            results = runParallel(units, lambda unit: exportMysqlUnit(connections,path,tablesByName,unit,columnarFormat,codec), jobs=jobs)
+        else:
+            workers = threading.local()
+            results = runParallel(units, lambda unit: exportPostgresUnit(connect,workers,opened,snapshotId,path,tablesByName,unit,columnarFormat,codec), jobs=jobs)
+        success = allSucceeded(results)
+        rowCounts = {result['name']: result.get('rows') for result in results if result['success']}
+    finally:
+        for workerConn in opened:
+            workerConn.close()
+
+    manifest = {'database': DBName, 'exportedAt': startTime.isoformat(), 'format': columnarFormat, 'codec': codec,
+                'tables': [{'name': table['name'], 'columns': table['columns'],
+                            'types': [str(field.type) for field in table['schema']],
+                            'files': [unit['file'] for unit in units if unit['table'] == table['name']],
+                            'rows': sum(rowCounts.get(unit['name']) or 0 for unit in units if unit['table'] == table['name'])}
+                           for table in tables]}
+    with open(columnarManifestPath(path,DBName),'w') as fout:
+        json.dump(manifest, fout, indent=2)
+    return success
@@ -0,0 +1,139 @@
+############################################################################################
+##                        Compression of the dump results:                                ##
+##                                                                                        ##
+##  - compress(): compresses a dump file already written to disk (-c);                    ##
+##  - streamCompress(): pipes the stdout of the dump process straight into the            ##
+##    compressor (--stream), so the uncompressed dump is never staged on disk.            ##
+##                                                                                        ##
+##  The input is split into blocks that are compressed at the same time on a thread       ##
+##  pool, each block as an independent gzip member/zstd frame/lz4 frame. Concatenated     ##
+##  members are still a valid stream (pigz-style), readable by gzip, zstd and lz4.        ##
+##                                                                                        ##
+##  Codecs (--codec): gzip (default), zstd (needs zstandard), lz4 (needs lz4).            ##
+##                                                                                        ##
+##  The blocks read from a dump pipe go through the dumpThrottle rate limiter and the     ##
+##  compressed file is hashed by dumpChecksum while it is written.                        ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from datetime import datetime
+import gzip
+import os
+from dumpReport import recordMetrics
+from dumpThrottle import throttleBytes
+from dumpChecksum import HashingTee, addChecksum
+from dumpProcess import DumpProcess
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+## Size of the blocks compressed by each thread ##
+blockSize = 1024**2
+
+## Default compression level and file extension of each codec ##
+codecLevels = {'gzip': 9, 'zstd': 3, 'lz4': 0}
+codecExtensions = {'gzip': '.gz', 'zstd': '.zst', 'lz4': '.lz4'}
+
+## Name of the compressed file ##
+def compressedName(filename,codec='gzip'):
+    if codec == 'gzip' and filename.endswith('.sql'):
+        return filename.replace('.sql','')+'.tar.gz'
+    return filename+codecExtensions[codec]
+
+
+## Get the function that compresses a single block ##
+def blockCompressor(codec='gzip',level=None):
+    if codec not in codecLevels:
+        raise ValueError('ERROR: Invalid codec "'+str(codec)+'", use one of: '+', '.join(codecLevels)+'.')
+    if level is None:
+        level = codecLevels[codec]
+
+    if codec == 'gzip':
+        return lambda block: gzip.compress(block, compresslevel=level, mtime=0)
+    elif codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('ERROR: The zstd codec requires the zstandard package.')
+        return lambda block: zstandard.ZstdCompressor(level=level).compress(block)
+    else:
+        if lz4 is None:
+            raise RuntimeError('ERROR: The lz4 codec requires the lz4 package.')
+        return lambda block: lz4.frame.compress(block, compression_level=level)
+
+
+## Compress a stream by blocks on a pool of threads ##
+def parallelCompress(fin,fout,codec='gzip',level=None,threads=None,throttle=False):
+    compressBlock = blockCompressor(codec,level)
+    threads = threads or os.cpu_count() or 1
+    uncompressedSize = 0
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        while True:
+            block = fin.read(blockSize)
+            if not block:
+                break
+            uncompressedSize += len(block)
+            if throttle:
+                throttleBytes(len(block))
+            pending.append(pool.submit(compressBlock, block))
+            # Keeps at most two blocks per thread in memory, written in input order
+            while len(pending) >= 2*threads:
+                fout.write(pending.popleft().result())
+        while pending:
+            fout.write(pending.popleft().result())
+
+    # An empty input still gives a valid compressed file
+    if uncompressedSize == 0:
+        fout.write(compressBlock(b''))
+    return uncompressedSize
+
+
+## Print file sizes in MB and the compression throughput in MB/s ##
+def printSizes(uncompressedSize,compressedSize,elapsed):
+    recordMetrics(rawBytes=uncompressedSize, compressedBytes=compressedSize)
+    seconds = max(elapsed.total_seconds(), 0.001)
+    print("Uncompressed size: {0:.2f} Mb".format(uncompressedSize/(1024**2)))
+    print("Compressed size: {0:.2f} Mb".format(compressedSize/(1024**2)))
+    print("Throughput: {0:.2f} MB/s".format(uncompressedSize/(1024**2)/seconds))
+
+
+## Compress data ##
+def compress(path,filename,codec='gzip',level=None):
+    compressedFile = compressedName(filename,codec)
+    startTime = datetime.now()
+
+    with open(path+filename, "rb") as fin, open(path+compressedFile, "wb") as fout:
+        # Reads the file by blocks to avoid exhausting memory
+        tee = HashingTee(fout)
+        uncompressedSize = parallelCompress(fin, tee, codec, level)
+    addChecksum(compressedFile, tee)
+
+    printSizes(uncompressedSize, os.stat(path+compressedFile).st_size, datetime.now()-startTime)
+
+
+## Stream the dump output into the compressed file ##
+def streamCompress(command,path,filename,codec='gzip',level=None):
+    compressedFile = compressedName(filename,codec)
+    startTime = datetime.now()
+
+    with DumpProcess(command) as process:
+        with open(path+compressedFile, "wb") as fout:
+            # Reads the pipe by blocks to avoid exhausting memory
+            tee = HashingTee(fout)
+            uncompressedSize = parallelCompress(process, tee, codec, level, throttle=True)
+    exitCode = process.exitCode
+    if exitCode == 0:
+        addChecksum(compressedFile, tee)
+
+    printSizes(uncompressedSize, os.stat(path+compressedFile).st_size, datetime.now()-startTime)
+    return exitCode
@@ -0,0 +1,133 @@
+############################################################################################
+##                  Checkpoint journal of the per-table dumps (--resume):                 ##
+##                                                                                        ##
+##  - A <DB>_journal.json is kept next to the dump files and replaced atomically every    ##
+##    time a table (or bin of tables) starts and finishes, a finished table is marked     ##
+##    'done' with the size and checksum (--hash) of its file;                             ##
+##  - With --resume, the tables marked 'done' whose file is still intact are skipped,     ##
+##    the partial or missing ones are dumped again;                                       ##
+##  - Once every table of the run succeeded the journal is marked complete, the next      ##
+##    run (with or without --resume) starts a new journal.                                ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from datetime import datetime
+import threading
+import json
+import os
+from dumpChecksum import fileChecksum, recordedChecksum, setChecksum
+import dumpChecksum
+
+## Serialises the journal writes of the worker threads ##
+journalLock = threading.Lock()
+
+## Path of the journal of a database ##
+def journalPath(path,DBName):
+    return path+DBName+'_journal.json'
+
+
+## Save the journal, replacing the previous one atomically ##
+def saveJournal(path,journal):
+    journal['updatedAt'] = datetime.now().isoformat()
+    tempPath = journalPath(path,journal['database'])+'.tmp'
+    with open(tempPath,'w') as fout:
+        json.dump(journal, fout, indent=2)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tempPath, journalPath(path,journal['database']))
+
+
+## Open the journal left by an interrupted run (resume), or start a new one ##
+def openJournal(path,DBName,resume=False):
+    if resume:
+        try:
+            with open(journalPath(path,DBName)) as fin:
+                journal = json.load(fin)
+            if not journal.get('complete'):
+                return journal
+            print('The last run of {} completed, nothing to resume.'.format(DBName))
+        except (OSError, ValueError):
+            print('No journal of {} found, nothing to resume.'.format(DBName))
+
+    journal = {'database': DBName, 'startedAt': datetime.now().isoformat(), 'complete': False, 'tables': {}}
+    saveJournal(path,journal)
+    return journal
+
+
+## Names of the tables dumped by a unit (a table or a bin) ##
+def unitTables(unit):
+    return [tableUnit['name'] for tableUnit in unit.get('units', [unit])]
+
+
+## Record that a unit started, its tables count as partial until it finishes ##
+def markStarted(path,journal,unit):
+    startedAt = datetime.now().isoformat()
+    with journalLock:
+        for name in unitTables(unit):
+            journal['tables'][name] = {'file': unit['file'], 'status': 'started', 'startedAt': startedAt}
+        saveJournal(path,journal)
+
+
+## Record that a unit finished, with the size and checksum of its file (hashed while written if possible) ##
+def markDone(path,journal,unit):
+    algorithm = dumpChecksum.hashAlgorithm
+    checksum = recordedChecksum(unit['file'],algorithm)
+    if checksum is None and not os.path.exists(path+unit['file']):
+        # Uploaded without a local copy (--upload), there is nothing to resume from
+        checksum = (None, None)
+    size, checksum = checksum or fileChecksum(path+unit['file'],algorithm)
+    finishedAt = datetime.now().isoformat()
+    with journalLock:
+        for name in unitTables(unit):
+            journal['tables'][name].update({'status': 'done', 'bytes': size, 'algorithm': algorithm, algorithm: checksum,
+                                            'finishedAt': finishedAt})
+        saveJournal(path,journal)
+
+
+## Run the dump of a unit, journaling its start and completion ##
+def runJournaled(path,journal,unit,dump):
+    markStarted(path,journal,unit)
+    exitCode = dump()
+    if exitCode == 0:
+        markDone(path,journal,unit)
+    return exitCode
+
+
+## Check that the file of a finished table is still the one that was journaled ##
+def isIntact(path,entry):
+    filePath = path+entry['file']
+    if entry.get('status') != 'done' or not os.path.exists(filePath):
+        return False
+    if not os.path.isdir(filePath) and os.stat(filePath).st_size != entry['bytes']:
+        return False
+    # Journals written before --hash hold a sha256
+    algorithm = entry.get('algorithm', 'sha256')
+    if algorithm == 'xxhash' and dumpChecksum.xxhash is None:
+        return False
+    return fileChecksum(filePath,algorithm) == (entry['bytes'], entry[algorithm])
+
+
+## Split the table units into still to dump and already dumped by the interrupted run ##
+def splitFinished(journal,units,path):
+    pending = []
+    finished = []
+    for unit in units:
+        entry = journal['tables'].get(unit['name'])
+        if entry and isIntact(path,entry):
+            unit['file'] = entry['file']
+            algorithm = entry.get('algorithm', 'sha256')
+            setChecksum(entry['file'], entry['bytes'], entry[algorithm], algorithm)
+            finished.append(unit)
+        else:
+            pending.append(unit)
+
+    print('{} table(s) already dumped by the interrupted run, {} partial or missing table(s) to dump.'.format(len(finished), len(pending)))
+    return pending, finished
+
+
+## Close the journal of the run, a complete journal is not resumed ##
+def finishJournal(path,journal,success):
+    with journalLock:
+        journal['complete'] = bool(success)
+        saveJournal(path,journal)
@@ -0,0 +1,377 @@
+############################################################################################
+##        Out-of-line export of the large binary values of the native exports:            ##
+##                                                                                        ##
+##  - The BLOB (MySQL) and bytea (PostgreSQL) columns of the tables whose rows average    ##
+##    lobHeavyBytes or more are found in the catalog, those values are not written in     ##
+##    the INSERT/COPY data but streamed raw into a <file>.lob side file;                  ##
+##  - The row data keeps a "lob:<side file>:<offset>:<length>" reference instead of the   ##
+##    value, the offsets follow the primary key order of the unit;                        ##
+##  - The side file is read in pages of pageRows keys, values bigger than inlineLimit     ##
+##    are read lobChunk bytes at a time, so memory stays bounded whatever the value size; ##
+##  - PostgreSQL large objects are streamed the same way to <DB>_largeobjects.lob;        ##
+##  - On restore the side files are loaded back on --jobs N connections after the data,   ##
+##    pageRows references at a time, one UPDATE per value found by primary key (indexed   ##
+##    first on PostgreSQL, whose constraints come after); MySQL takes each value as long  ##
+##    data of a prepared statement, the PostgreSQL values over lobChunk are streamed      ##
+##    through a temporary large object.                                                   ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+import io
+import os
+from dumpScheduler import runParallel, allSucceeded
+from dumpReport import recordMetrics
+from dumpThrottle import ThrottledWriter
+from dumpChecksum import HashingTee, addChecksum
+
+## Rows averaging lobHeavyBytes or more have their binary columns written out of line ##
+lobHeavyBytes = 64*1024
+
+## Bytes read or written at a time, values up to inlineLimit are read with their page ##
+lobChunk = 16*1024**2
+inlineLimit = 256*1024
+pageRows = 256
+
+## Binary column types written out of line ##
+lobTypes = {'mysql': ('blob', 'mediumblob', 'longblob'), 'postgres': ('bytea',)}
+
+## Prefix of the references left in the row data ##
+lobPrefix = 'lob:'
+
+## Binary columns of the tables with heavy rows, from the catalog ##
+def queryLobColumns(engine,cursor,DBName):
+    if engine == 'mysql':
+        cursor.execute("SELECT c.table_name, c.column_name FROM information_schema.columns c "
+                       "JOIN information_schema.tables t ON (t.table_schema = c.table_schema) AND (t.table_name = c.table_name) "
+                       "WHERE (c.table_schema = %s) AND (c.data_type IN ('"+"', '".join(lobTypes['mysql'])+"')) "
+                       "AND (t.avg_row_length >= %s) ORDER BY c.table_name, c.ordinal_position", (DBName, lobHeavyBytes))
+    else:
+        # The values stored out of line in the TOAST table tell the heavy rows
+        cursor.execute("SELECT c.relname, a.attname FROM pg_attribute a JOIN pg_class c ON (c.oid = a.attrelid) "
+                       "JOIN pg_namespace n ON (n.oid = c.relnamespace) "
+                       "WHERE (n.nspname = 'public') AND (a.atttypid = 'bytea'::regtype) AND (a.attnum > 0) AND NOT a.attisdropped "
+                       "AND (c.reltoastrelid <> 0) AND (pg_relation_size(c.reltoastrelid) >= %s*GREATEST(c.reltuples, 1)) "
+                       "ORDER BY c.relname, a.attnum", (lobHeavyBytes,))
+    lobColumns = {}
+    for tableName, columnName in cursor.fetchall():
+        lobColumns.setdefault(tableName, []).append(columnName)
+    return lobColumns
+
+
+## Mark the out-of-line columns of the planned tables, rows are found again by primary key on restore ##
+def markLobColumns(engine,cursor,DBName,tables):
+    lobColumns = queryLobColumns(engine,cursor,DBName)
+    for table in tables:
+        table['lobColumns'] = [column for column in lobColumns.get(table['name'], []) if column in table['columns']] if table['table'].pkColumns else []
+        if table['lobColumns']:
+            print('{}: {} written out of line.'.format(table['name'], ', '.join(table['lobColumns'])))
+
+
+## Manifest entries of the out-of-line columns of a table ##
+def lobManifest(table,units,tableName):
+    if not table.get('lobColumns'):
+        return {}
+    return {'from': tableName, 'pk': list(table['table'].pkColumns), 'lobColumns': table['lobColumns'],
+            'lobFiles': [sideFileName(unit['file']) for unit in units if unit['table'] == table['name']]}
+
+
+## Name of the side file of a data file ##
+def sideFileName(filename):
+    return os.path.splitext(filename)[0]+'.lob'
+
+
+## SQL length and substring of a binary value ##
+def lengthOf(engine,column):
+    return ('LENGTH(' if engine == 'mysql' else 'octet_length(')+column+')'
+
+
+def substringOf(engine,column):
+    return 'SUBSTRING('+column+', %s, %s)' if engine == 'mysql' else 'substring('+column+' from %s for %s)'
+
+
+## Condition matching one key, or the keys after one ##
+def keyCondition(quote,pkColumns,operator):
+    if len(pkColumns) == 1:
+        return quote(pkColumns[0])+' '+operator+' %s'
+    return '('+', '.join(quote(column) for column in pkColumns)+') '+operator+' ('+', '.join(['%s']*len(pkColumns))+')'
+
+
+## Query of the row data of a unit, the binary values replaced by their length (MySQL) or reference (PostgreSQL) ##
+def lobQuery(engine,quote,table,unit):
+    pkColumns = list(table['table'].pkColumns)
+    lobColumns = [quote(column) for column in table['lobColumns']]
+    if engine == 'postgres':
+        # Offset of each value in the side file: the lengths of the values before it, in primary key order
+        lengths = ['COALESCE('+lengthOf(engine,column)+', 0)' for column in lobColumns]
+        before = 'SUM('+'+'.join(lengths)+') OVER (ORDER BY '+', '.join(quote(column) for column in pkColumns)+')-('+'+'.join(lengths)+')'
+    expressions = []
+    for column in table['columns']:
+        if quote(column) not in lobColumns:
+            expressions.append(quote(column))
+        elif engine == 'mysql':
+            expressions.append(lengthOf(engine,quote(column)))
+        else:
+            position = lobColumns.index(quote(column))
+            offset = '('+before+''.join('+'+length for length in lengths[:position])+')'
+            expressions.append("CASE WHEN "+quote(column)+" IS NOT NULL THEN '"+lobPrefix+sideFileName(unit['file'])+":'||"
+                               +offset+"::text||':'||"+lengthOf(engine,quote(column))+"::text END")
+    query = 'SELECT '+', '.join(expressions)+' FROM '+unit['from']
+    if unit['where']:
+        query += ' WHERE '+unit['where']
+    if engine == 'mysql':
+        query += ' ORDER BY '+', '.join(quote(column) for column in pkColumns)
+    return query
+
+
+## Cursor giving the rows of a MySQL lobQuery with the lengths turned into references ##
+class LobReferences:
+    def __init__(self,cursor,table,sideFile):
+        self.cursor = cursor
+        self.positions = [table['columns'].index(column) for column in table['lobColumns']]
+        self.sideFile = sideFile
+        self.offset = 0
+
+    def fetchmany(self,size):
+        rows = []
+        for row in self.cursor.fetchmany(size):
+            row = list(row)
+            for position in self.positions:
+                if row[position] is not None:
+                    length = int(row[position])
+                    row[position] = '{}{}:{}:{}'.format(lobPrefix, self.sideFile, self.offset, length)
+                    self.offset += length
+            rows.append(row)
+        return rows
+
+
+## Stream the binary values of a unit to its side file, in primary key order ##
+def writeSideFile(engine,quote,cursor,table,unit,fout):
+    pkColumns = list(table['table'].pkColumns)
+    lobColumns = [quote(column) for column in table['lobColumns']]
+    select = ('SELECT '+', '.join(quote(column) for column in pkColumns)+', '
+              +', '.join(lengthOf(engine,column)+', CASE WHEN '+lengthOf(engine,column)+' <= '+str(inlineLimit)+' THEN '+column+' END'
+                         for column in lobColumns)+' FROM '+unit['from'])
+    orderBy = ' ORDER BY '+', '.join(quote(column) for column in pkColumns)+' LIMIT '+str(pageRows)
+    conditions = [unit['where']] if unit['where'] else []
+
+    lastKey = None
+    while True:
+        # Key set pages: the cursor is free between two pages to read the big values
+        pageConditions = conditions+([keyCondition(quote,pkColumns,'>')] if lastKey else [])
+        query = select+(' WHERE '+' AND '.join(pageConditions) if pageConditions else '')+orderBy
+        cursor.execute(query, list(lastKey) if lastKey else None)
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        for row in rows:
+            key = row[:len(pkColumns)]
+            for position, column in enumerate(lobColumns):
+                length, value = row[len(pkColumns)+2*position:len(pkColumns)+2*position+2]
+                if length is None:
+                    continue
+                if value is not None:
+                    fout.write(bytes(value))
+                    continue
+                for start in range(1, int(length)+1, lobChunk):
+                    cursor.execute('SELECT '+substringOf(engine,column)+' FROM '+unit['from']+' WHERE '+keyCondition(quote,pkColumns,'='),
+                                   [start, lobChunk]+list(key))
+                    fout.write(bytes(cursor.fetchall()[0][0]))
+        lastKey = rows[-1][:len(pkColumns)]
+
+
+## Export the side file of a unit ##
+def exportSideFile(engine,quote,cursor,path,table,unit):
+    sideFile = sideFileName(unit['file'])
+    with open(path+sideFile,'wb') as fout:
+        tee = HashingTee(fout)
+        writeSideFile(engine,quote,cursor,table,unit,ThrottledWriter(tee))
+    addChecksum(sideFile,tee)
+    return tee.bytes
+
+
+## Stream every PostgreSQL large object to one side file, returns [oid, offset, length] of each ##
+def exportLargeObjects(cursor,path,filename):
+    cursor.execute('SELECT oid FROM pg_largeobject_metadata ORDER BY oid')
+    oids = [oid for oid, in cursor.fetchall()]
+    objects = []
+    with open(path+filename,'wb') as fout:
+        tee = HashingTee(fout)
+        writer = ThrottledWriter(tee)
+        for oid in oids:
+            offset = tee.bytes
+            while True:
+                cursor.execute('SELECT lo_get(%s, %s, %s)', (oid, tee.bytes-offset, lobChunk))
+                chunk = bytes(cursor.fetchone()[0])
+                writer.write(chunk)
+                if len(chunk) < lobChunk:
+                    break
+            objects.append([oid, offset, tee.bytes-offset])
+    addChecksum(filename,tee)
+    recordMetrics(rawBytes=tee.bytes)
+    print('{} large object(s) exported to {}.'.format(len(objects), filename))
+    return objects
+
+
+## Read a value of a side file lobChunk bytes at a time, write(chunk, position) is called for each chunk ##
+def writeValue(fin,offset,length,write):
+    fin.seek(offset)
+    written = 0
+    while written < length:
+        chunk = fin.read(min(lobChunk, length-written))
+        if not chunk:
+            raise RuntimeError('ERROR: The side file ends before the value at offset '+str(offset)+'.')
+        write(chunk, written)
+        written += len(chunk)
+    return written
+
+
+## One value of a side file as a stream, sent in pieces by the MySQL prepared statements (long data) ##
+class SideValue(io.RawIOBase):
+    def __init__(self,fin,offset,length):
+        fin.seek(offset)
+        self.fin = fin
+        self.offset = offset
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def read(self,size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fin.read(size)
+        if len(data) < size:
+            raise RuntimeError('ERROR: The side file ends before the value at offset '+str(self.offset)+'.')
+        self.remaining -= len(data)
+        return data
+
+
+## Set one value, streamed as long data (MySQL), in a single statement or through a temporary large object ##
+def restoreValue(engine,cursor,fin,offset,length,update,key):
+    if engine == 'mysql':
+        cursor.execute(update.format('%s'), [SideValue(fin,offset,length)]+key)
+        return length
+    if length <= lobChunk:
+        fin.seek(offset)
+        value = fin.read(length)
+        if len(value) < length:
+            raise RuntimeError('ERROR: The side file ends before the value at offset '+str(offset)+'.')
+        cursor.execute(update.format('%s'), [value]+key)
+        return length
+
+    # The value is streamed into the large object and copied to the row once, not appended to it chunk by chunk
+    cursor.execute('SELECT lo_create(0)')
+    oid = cursor.fetchone()[0]
+    writeValue(fin, offset, length, lambda chunk, position: cursor.execute('SELECT lo_put(%s, %s, %s)', (oid, position, chunk)))
+    cursor.execute(update.format('lo_get(%s)'), [oid]+key)
+    cursor.execute('SELECT lo_unlink(%s)', (oid,))
+    return length
+
+
+## Load the values of a side file back into the rows referencing it, pageRows keys at a time ##
+def restoreSideFile(connect,engine,quote,path,unit):
+    pkColumns = unit['pk']
+    lobColumns = [quote(column) for column in unit['lobColumns']]
+    reference = (lobPrefix+unit['file'].replace('\\','\\\\').replace('%','\\%').replace('_','\\_')+':%').encode('utf8')
+    # Only the references are read, not the values of the other side files already restored
+    select = ('SELECT '+', '.join(quote(column) for column in pkColumns)+', '
+              +', '.join('CASE WHEN '+column+' LIKE %s THEN '+column+' END' for column in lobColumns)+' FROM '+unit['from'])
+    conditions = ['('+' OR '.join(column+' LIKE %s' for column in lobColumns)+')']
+    orderBy = ' ORDER BY '+', '.join(quote(column) for column in pkColumns)+' LIMIT '+str(pageRows)
+    conn, cursor = connect()
+    try:
+        # MySQL takes the values as long data of a prepared statement, a piece at a time
+        updates = conn.cursor(prepared=True) if engine == 'mysql' else cursor
+        restoredBytes = 0
+        lastKey = None
+        with open(path+unit['file'],'rb') as fin:
+            while True:
+                pageConditions = conditions+([keyCondition(quote,pkColumns,'>')] if lastKey else [])
+                cursor.execute(select+' WHERE '+' AND '.join(pageConditions)+orderBy,
+                               [reference]*(2*len(lobColumns))+(list(lastKey) if lastKey else []))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    key = list(row[:len(pkColumns)])
+                    for column, value in zip(lobColumns, row[len(pkColumns):]):
+                        if value is None:
+                            continue
+                        filename, offset, length = bytes(value).decode('utf8')[len(lobPrefix):].rsplit(':', 2)
+                        if filename != unit['file']:
+                            continue
+                        update = 'UPDATE '+unit['from']+' SET '+column+' = {} WHERE '+keyCondition(quote,pkColumns,'=')
+                        restoredBytes += restoreValue(engine, updates, fin, int(offset), int(length), update, key)
+                        conn.commit()
+                lastKey = rows[-1][:len(pkColumns)]
+        recordMetrics(rawBytes=restoredBytes)
+    finally:
+        conn.close()
+    return 0
+
+
+## Index the primary key of the tables being updated, the pre-data schema has none yet (PostgreSQL) ##
+def indexLobKeys(connect,quote,tables,drop=False):
+    conn, cursor = connect()
+    try:
+        for table in tables:
+            # The index is on the table itself, not on its inheritance children ("ONLY public.table")
+            relation = table['from'][len('ONLY '):] if table['from'].startswith('ONLY ') else table['from']
+            schemaName = relation.split('.')[0]
+            indexName = quote(table['name'][:54]+'_lob_key')
+            if drop:
+                cursor.execute('DROP INDEX IF EXISTS '+schemaName+'.'+indexName)
+            else:
+                cursor.execute('CREATE INDEX '+indexName+' ON '+table['from']+' ('+', '.join(quote(column) for column in table['pk'])+')')
+        conn.commit()
+    finally:
+        conn.close()
+
+
+## Load the side files of the tables of an export in parallel (indexKeys: the tables have no primary key yet) ##
+def restoreLobs(connect,engine,quote,path,tables,jobs=1,indexKeys=False):
+    units = []
+    for table in tables:
+        for filename in table.get('lobFiles', []):
+            units.append({'name': filename, 'file': filename, 'from': table['from'], 'pk': table['pk'],
+                          'lobColumns': table['lobColumns'], 'size': os.stat(path+filename).st_size})
+    if not units:
+        return True
+    # Every UPDATE finds its row by key, without an index each one would scan the table
+    lobTables = [table for table in tables if table.get('lobFiles')]
+    if indexKeys:
+        indexLobKeys(connect,quote,lobTables)
+    try:
+        results = runParallel(units, lambda unit: restoreSideFile(connect,engine,quote,path,unit), jobs=jobs, unitName='side file')
+    finally:
+        if indexKeys:
+            indexLobKeys(connect,quote,lobTables,drop=True)
+    return allSucceeded(results)
+
+
+## Load the large objects back, --jobs N connections at the same time ##
+def restoreLargeObjects(connect,path,largeObjects,jobs=1):
+    jobs = max(1, int(jobs))
+    groups = [largeObjects['objects'][group::jobs] for group in range(jobs)]
+
+    def loadGroup(unit):
+        conn, cursor = connect()
+        try:
+            with open(path+largeObjects['file'],'rb') as fin:
+                for oid, offset, length in unit['objects']:
+                    # pg_dump's pre-data may have created the (empty) object already
+                    cursor.execute('SELECT lo_create(%s) WHERE NOT EXISTS (SELECT 1 FROM pg_largeobject_metadata WHERE oid = %s)', (oid, oid))
+                    fin.seek(offset)
+                    for start in range(0, length, lobChunk):
+                        cursor.execute('SELECT lo_put(%s, %s, %s)', (oid, start, fin.read(min(lobChunk, length-start))))
+                    conn.commit()
+        finally:
+            conn.close()
+        recordMetrics(rawBytes=sum(length for oid, offset, length in unit['objects']))
+        return 0
+
+    units = [{'name': 'large objects {}/{}'.format(group+1, len(groups)), 'objects': objects,
+              'size': sum(length for oid, offset, length in objects)} for group, objects in enumerate(groups) if objects]
+    results = runParallel(units, loadGroup, jobs=jobs, unitName='large object group')
+    return allSucceeded(results)
@@ -0,0 +1,92 @@
+############################################################################################
+##                   Manifest of the per-table dumps (--incremental):                     ##
+##                                                                                        ##
+##  - A <DB>_manifest.json is kept next to the dump files, holding for each table the     ##
+##    fingerprint read from the catalog before it was dumped and the file it went to;     ##
+##  - On the next run only the tables whose fingerprint changed (or whose file is         ##
+##    missing) are dumped, the others keep pointing at the previous file;                 ##
+##  - A <DB>_index.json maps every table to the file holding it, so a table dumped in a   ##
+##    bin (--bin-size) can still be found and restored on its own, and the schema file    ##
+##    of the data-only dumps (--schema-cache).                                            ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from datetime import datetime
+import json
+import os
+
+## Path of the manifest of a database ##
+def manifestPath(path,DBName):
+    return path+DBName+'_manifest.json'
+
+
+## Load the manifest of the last run ##
+def loadManifest(path,DBName):
+    try:
+        with open(manifestPath(path,DBName)) as fin:
+            return json.load(fin)
+    except (OSError, ValueError):
+        return {'database': DBName, 'tables': {}}
+
+
+## Save the manifest, replacing the previous one atomically ##
+def saveManifest(path,DBName,manifest):
+    manifest['updatedAt'] = datetime.now().isoformat()
+    tempPath = manifestPath(path,DBName)+'.tmp'
+    with open(tempPath,'w') as fout:
+        json.dump(manifest, fout, indent=2, default=str)
+    os.replace(tempPath, manifestPath(path,DBName))
+
+
+## Split the dump units into changed and unchanged since the last run (forced: dumped anyway) ##
+def splitUnchanged(manifest,units,fingerprints,path,forced=()):
+    changed = []
+    unchanged = []
+    for unit in units:
+        entry = manifest['tables'].get(unit['name'])
+        fingerprint = fingerprints.get(unit['name'])
+        if (unit['name'] not in forced and entry and fingerprint is not None and entry['fingerprint'] == fingerprint
+                and os.path.exists(path+entry['file'])):
+            unchanged.append(unit)
+        else:
+            changed.append(unit)
+
+    print('{} table(s) changed since the last run, {} unchanged table(s) skipped.'.format(len(changed), len(unchanged)))
+    return changed, unchanged
+
+
+## Record the tables dumped in this run ##
+def updateManifest(manifest,units,results,fingerprints):
+    files = {unit['name']: unit['file'] for unit in units}
+    dumpedAt = datetime.now().isoformat()
+    for result in results:
+        if result['success']:
+            manifest['tables'][result['name']] = {'fingerprint': fingerprints.get(result['name']),
+                                                  'file': files[result['name']],
+                                                  'dumpedAt': dumpedAt}
+        else:
+            # Failed tables are dumped again on the next run
+            manifest['tables'].pop(result['name'], None)
+
+    # Tables dropped from the database are dropped from the manifest
+    for name in list(manifest['tables']):
+        if name not in fingerprints:
+            del manifest['tables'][name]
+    return manifest
+
+
+## Path of the table index of a database ##
+def indexPath(path,DBName):
+    return path+DBName+'_index.json'
+
+
+## Save the table -> file index ##
+def saveTableIndex(path,DBName,files,schemaFile=None):
+    index = {'database': DBName, 'updatedAt': datetime.now().isoformat(), 'tables': files}
+    if schemaFile:
+        index['schema'] = schemaFile
+    tempPath = indexPath(path,DBName)+'.tmp'
+    with open(tempPath,'w') as fout:
+        json.dump(index, fout, indent=2)
+    os.replace(tempPath, indexPath(path,DBName))
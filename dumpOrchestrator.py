@@ -0,0 +1,255 @@
+############################################################################################
+##               Script to back up many MySQL and PostgreSQL servers in one run:          ##
+##                                                                                        ##
+## Script calling example:                                                                ##
+##  - python dumpOrchestrator.py -i inventory.json --max-jobs 8 --per-host 2              ##
+##                                                                                        ##
+## Arguments Explanation:                                                                 ##
+##                                                                                        ##
+##  - (-i): Inventory file (JSON) listing the targets to back up                          ##
+##  - (--max-jobs N): Number of databases dumped at the same time (Optional, default 4)   ##
+##  - (--per-host N): Number of databases of the same host dumped at the same time        ##
+##    (Optional, default 1)                                                               ##
+##  - (--timeout S): Seconds a database dump may take before it is stopped (Optional,     ##
+##    default none, a target can set its own "timeout")                                   ##
+##                                                                                        ##
+## Inventory file:                                                                        ##
+##                                                                                        ##
+##  {"targets": [{"name": "sales", "engine": "mysql", "host": "db1", "port": 3306,        ##
+##                "user": "backup", "passwordEnv": "SalesDBPass",                         ##
+##                "databases": ["sales", "crm"], "options": ["-t", "--jobs", "4"]},       ##
+##               {"name": "pg1", "engine": "postgres", "host": "db2", "user": "admin",    ##
+##                "passwordEnv": "Pg1DBPass", "server": true, "timeout": 7200}]}          ##
+##                                                                                        ##
+##  - Each database (or whole server, "server": true on postgres) runs the existing       ##
+##    mysqlDump.py/postgresDump.py backupDB in its own subprocess, managed by asyncio;    ##
+##  - Every subprocess gets its own working folder (my.cnf) and APPDATA (pgpass.conf),    ##
+##    so the temporary credential files of the targets never overwrite each other;        ##
+##  - The passwords stay in the environment variables named by "passwordEnv";             ##
+##  - A combined summary is printed and written to c:\dumpOrchestrator\<run>_report.json. ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from datetime import datetime
+import tempfile
+import asyncio
+import subprocess
+import shutil
+import json
+import signal
+import sys
+import os
+from dumpReport import writeReport
+
+## Global Flags ##
+inventoryFile = None
+maxJobs = 4
+perHost = 1
+timeout = None
+
+## Script running the backup of each engine ##
+engineScripts = {'mysql': 'mysqlDump.py', 'postgres': 'postgresDump.py'}
+
+## Folder of the combined reports ##
+reportPath = 'c:\\dumpOrchestrator\\'
+
+## Load and check the inventory ##
+def loadInventory(filePath):
+    with open(filePath) as fin:
+        inventory = json.load(fin)
+
+    seen = {}
+    for target in inventory.get('targets', []):
+        for key in ('name', 'engine', 'host', 'user', 'passwordEnv'):
+            if not target.get(key):
+                raise ValueError('ERROR: Target '+str(target.get('name'))+' of the inventory has no "'+key+'".')
+        if target['engine'] not in engineScripts:
+            raise ValueError('ERROR: Invalid engine "'+str(target['engine'])+'", use one of: '+', '.join(engineScripts)+'.')
+        if not target.get('databases') and not target.get('server'):
+            raise ValueError('ERROR: Target '+target['name']+' must list its "databases" or set "server": true.')
+        # The dump files are named after the database (or server), in the same folder for every host
+        for name in ([target['name']] if target.get('server') else target['databases']):
+            key = (target['engine'], name)
+            if key in seen:
+                raise ValueError('ERROR: '+target['name']+' and '+seen[key]+' both dump "'+name+'" to the same files.')
+            seen[key] = target['name']
+    return inventory['targets']
+
+
+## Split the targets in jobs: one per database, or one per server ##
+def makeJobs(targets):
+    jobList = []
+    for target in targets:
+        arguments = ['-h', target['host'], '-u', target['user'], '-ev', target['passwordEnv']]
+        if target.get('port'):
+            arguments += ['-p', str(target['port'])]
+        arguments += [str(option) for option in target.get('options', [])]
+        if target.get('server'):
+            jobList.append({'name': target['name'], 'target': target,
+                            'arguments': arguments+['-s', '-sn', target['name']]})
+        else:
+            for DBName in target['databases']:
+                jobList.append({'name': target['name']+'/'+DBName, 'target': target,
+                                'arguments': arguments+['-db', DBName]})
+    return jobList
+
+
+## Print the output of a job, each line prefixed with its name ##
+async def relayOutput(job,stream):
+    while True:
+        line = await stream.readline()
+        if not line:
+            break
+        print('[{}] {}'.format(job['name'], line.decode(errors='replace').rstrip()))
+
+
+## Start a job in its own process group, so the tools it starts can be stopped with it ##
+def processGroup():
+    if os.name == 'nt':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+
+## Kill a job and every process it started (mysqldump, pg_dump, ...) ##
+async def killTree(process):
+    if os.name == 'nt':
+        killer = await asyncio.create_subprocess_exec('taskkill', '/T', '/F', '/PID', str(process.pid),
+                                                      stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        await killer.wait()
+    else:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+## Run the backup of a job in its own subprocess ##
+async def runJob(job,allJobs,hostLimits):
+    target = job['target']
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), engineScripts[target['engine']])
+    jobTimeout = target.get('timeout', timeout)
+    submittedAt = datetime.now()
+
+    # The host slot first: a job waiting for a busy host must not hold a global slot
+    async with hostLimits[target['host']], allJobs:
+        startTime = datetime.now()
+        workPath = tempfile.mkdtemp(prefix='dumpOrchestrator_')
+        # Unbuffered output, so the lines of the job are relayed as they are printed
+        environment = dict(os.environ, APPDATA=workPath, PYTHONUNBUFFERED='1')
+        status = 'OK'
+        try:
+            process = await asyncio.create_subprocess_exec(sys.executable, script, *job['arguments'], cwd=workPath, env=environment,
+                                                           stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, **processGroup())
+            relay = asyncio.ensure_future(relayOutput(job,process.stdout))
+            try:
+                exitCode = await asyncio.wait_for(process.wait(), jobTimeout)
+            except asyncio.TimeoutError:
+                # The dump tools would keep running, and keep the output pipe open
+                await killTree(process)
+                exitCode = await process.wait()
+                status = 'TIMEOUT (after {}s)'.format(jobTimeout)
+            await relay
+        except OSError as error:
+            exitCode = None
+            status = 'FAILED ({})'.format(error)
+        finally:
+            shutil.rmtree(workPath, ignore_errors=True)
+        if status == 'OK' and exitCode != 0:
+            status = 'FAILED (exit code {})'.format(exitCode)
+
+    elapsed = datetime.now()-startTime
+    print('[{}] {} in {}'.format(job['name'], status, elapsed))
+    return {'name': job['name'], 'engine': target['engine'], 'host': target['host'], 'exitCode': exitCode,
+            'success': status == 'OK', 'status': status, 'wallSeconds': elapsed.total_seconds(),
+            'queueWaitSeconds': (startTime-submittedAt).total_seconds()}
+
+
+## Run every job, at most maxJobs at the same time and perHost on the same host ##
+async def runJobs(jobList):
+    allJobs = asyncio.Semaphore(maxJobs)
+    hostLimits = {job['target']['host']: asyncio.Semaphore(perHost) for job in jobList}
+    return await asyncio.gather(*(runJob(job,allJobs,hostLimits) for job in jobList))
+
+
+## Back up every target of the inventory ##
+def backupTargets(targets):
+    startTime = datetime.now()
+    jobList = makeJobs(targets)
+    print('Backing up {} database(s) of {} target(s), {} at the same time, {} per host.'.format(len(jobList), len(targets), maxJobs, perHost))
+    results = asyncio.run(runJobs(jobList))
+
+    failed = [result for result in results if not result['success']]
+    print('{} of {} database(s) backed up.'.format(len(results)-len(failed), len(results)))
+    for result in failed:
+        print('  - {}: {}'.format(result['name'], result['status']))
+
+    if not os.path.isdir(reportPath):
+        os.mkdir(reportPath)
+    report = {'run': {'name': 'orchestrator', 'startedAt': startTime.isoformat(), 'finishedAt': datetime.now().isoformat(),
+                      'wallSeconds': (datetime.now()-startTime).total_seconds(), 'success': not failed,
+                      'units': len(results), 'failedUnits': len(failed)},
+              'units': results}
+    writeReport(report, reportPath+'orchestrator_'+startTime.strftime('%Y%m%d%H%M%S')+'_report.json')
+    return not failed
+
+
+## Get initial arguments and set flags ##
+def getArguments():
+    global inventoryFile
+    if '-i' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '-i':
+                inventoryFile = sys.argv[idx+1]
+                break
+            else:
+                idx += 1
+
+    global maxJobs
+    if '--max-jobs' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--max-jobs':
+                maxJobs = max(1, int(sys.argv[idx+1]))
+                break
+            else:
+                idx += 1
+
+    global perHost
+    if '--per-host' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--per-host':
+                perHost = max(1, int(sys.argv[idx+1]))
+                break
+            else:
+                idx += 1
+
+    global timeout
+    if '--timeout' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--timeout':
+                timeout = float(sys.argv[idx+1])
+                break
+            else:
+                idx += 1
+
+    if not inventoryFile:
+        raise ValueError('Inventory file argument (-i) missing.')
+    return inventoryFile
+
+
+### Main ###
+if __name__ == '__main__':
+    executionTime = datetime.now()
+    inventoryFile = getArguments()
+
+    if backupTargets(loadInventory(inventoryFile)):
+        print('Backup of every target finished.')
+        print('Execution time: {}'.format(datetime.now()-executionTime))
+    else:
+        print('The backup of some targets could not be done.')
+        print('Execution time: {}'.format(datetime.now()-executionTime))
+        sys.exit(1)
@@ -0,0 +1,143 @@
+############################################################################################
+##                         Dump planner for both scripts:                                 ##
+##                                                                                        ##
+##  - One catalog query per database collects, for every table: schema, name, kind,       ##
+##    data+index bytes, estimated rows, primary key columns and partitions, kept in       ##
+##    compact TableInfo records (no pandas);                                              ##
+##  - makePlan() turns them into dump units: biggest first, with the number of chunks     ##
+##    a large table is split in (by primary key range or by partition);                   ##
+##  - packBins() groups the small tables in bins up to a target size (--bin-size MB),     ##
+##    each bin dumped by a single mysqldump/pg_dump invocation.                           ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from collections import namedtuple
+import math
+
+## Tables bigger than splitSize are split in chunks of about splitSize ##
+splitSize = 1024**3
+maxChunks = 64
+
+## Maximum number of tables in a bin, keeps the command line short ##
+maxBinTables = 100
+
+## Integer types that can be split in primary key ranges (MySQL and PostgreSQL names) ##
+integerTypes = ('tinyint', 'smallint', 'mediumint', 'int', 'integer', 'bigint')
+
+## Catalog record of a table ##
+TableInfo = namedtuple('TableInfo', ['schema', 'name', 'kind', 'size', 'rows', 'pkColumns', 'pkType', 'partitions'])
+
+## Read the MySQL catalog of a database ##
+def queryMysqlTables(cursor,DBName):
+    query = ("SELECT t.table_schema, t.table_name, t.table_type, "
+            "COALESCE(t.data_length,0)+COALESCE(t.index_length,0), COALESCE(t.table_rows,0), "
+            "(SELECT GROUP_CONCAT(k.column_name ORDER BY k.ordinal_position SEPARATOR '\\t') "
+            " FROM information_schema.key_column_usage k "
+            " WHERE (k.table_schema = t.table_schema) AND (k.table_name = t.table_name) AND (k.constraint_name = 'PRIMARY')), "
+            "(SELECT c.data_type FROM information_schema.key_column_usage k "
+            " JOIN information_schema.columns c ON (c.table_schema = k.table_schema AND c.table_name = k.table_name AND c.column_name = k.column_name) "
+            " WHERE (k.table_schema = t.table_schema) AND (k.table_name = t.table_name) AND (k.constraint_name = 'PRIMARY') AND (k.ordinal_position = 1)), "
+            "(SELECT GROUP_CONCAT(p.partition_name ORDER BY p.partition_ordinal_position SEPARATOR '\\t') "
+            " FROM information_schema.partitions p "
+            " WHERE (p.table_schema = t.table_schema) AND (p.table_name = t.table_name) AND (p.partition_name IS NOT NULL)) "
+            "FROM information_schema.tables t "
+            "WHERE (t.table_schema = %s) "
+            "ORDER BY t.table_name")
+
+    cursor.execute(query, (DBName,))
+    tables = []
+    for schema, name, tableType, size, rows, pkColumns, pkType, partitions in cursor.fetchall():
+        tables.append(TableInfo(schema, name, 'view' if tableType == 'VIEW' else 'table', int(size), int(rows),
+                                tuple(pkColumns.split('\t')) if pkColumns else (), pkType,
+                                tuple(partitions.split('\t')) if partitions else ()))
+    return tables
+
+
+## Read the PostgreSQL catalog of a schema ##
+def queryPostgresTables(cursor,schema='public'):
+    query = ("SELECT n.nspname, c.relname, c.relkind, c.relispartition, "
+            "pg_total_relation_size(c.oid), GREATEST(c.reltuples,0)::bigint, "
+            "(SELECT array_agg(a.attname ORDER BY k.ord) FROM unnest(i.indkey) WITH ORDINALITY k(attnum, ord) "
+            " JOIN pg_attribute a ON (a.attrelid = c.oid AND a.attnum = k.attnum)), "
+            "(SELECT format_type(a.atttypid, a.atttypmod) FROM pg_attribute a "
+            " WHERE (a.attrelid = c.oid) AND (a.attnum = i.indkey[0])), "
+            "(SELECT array_agg(ch.relname ORDER BY ch.relname) FROM pg_inherits h "
+            " JOIN pg_class ch ON (ch.oid = h.inhrelid) WHERE (h.inhparent = c.oid)) "
+            "FROM pg_class c "
+            "JOIN pg_namespace n ON (n.oid = c.relnamespace) "
+            "LEFT JOIN pg_index i ON (i.indrelid = c.oid AND i.indisprimary) "
+            "WHERE (n.nspname = %s) AND (c.relkind IN ('r','p','v','m','f')) "
+            "ORDER BY c.relname")
+    kinds = {'r': 'table', 'p': 'partitioned', 'v': 'view', 'm': 'view', 'f': 'foreign'}
+
+    cursor.execute(query, (schema,))
+    tables = []
+    for schema, name, relkind, isPartition, size, rows, pkColumns, pkType, partitions in cursor.fetchall():
+        kind = 'partition' if isPartition else kinds[relkind]
+        tables.append(TableInfo(schema, name, kind, size, rows, tuple(pkColumns or ()), pkType, tuple(partitions or ())))
+    return tables
+
+
+## Decide in how many chunks a table is split, and how ##
+def splitDecision(table):
+    chunks = min(maxChunks, math.ceil(table.size/splitSize))
+    if chunks <= 1 or table.kind not in ('table', 'partition'):
+        return 1, None
+    if len(table.pkColumns) == 1 and table.pkType in integerTypes:
+        return chunks, 'pk'
+    if table.partitions:
+        return len(table.partitions), 'partition'
+    return 1, None
+
+
+## Build the dump plan: one unit per table, biggest first ##
+def makePlan(tables,kinds=None):
+    units = []
+    for table in tables:
+        if kinds and table.kind not in kinds:
+            continue
+        chunks, splitBy = splitDecision(table)
+        units.append({'name': table.name, 'size': table.size, 'rows': table.rows,
+                      'chunks': chunks, 'splitBy': splitBy, 'table': table})
+    units.sort(key=lambda unit: unit['size'], reverse=True)
+    return units
+
+
+## Pack the units smaller than binSize in bins (first fit decreasing), bigger units keep their own dump ##
+def packBins(units,binSize):
+    packed = [unit for unit in units if unit['size'] >= binSize]
+    bins = []
+    for unit in sorted((unit for unit in units if unit['size'] < binSize), key=lambda unit: unit['size'], reverse=True):
+        for tableBin in bins:
+            if tableBin['size']+unit['size'] <= binSize and len(tableBin['tables']) < maxBinTables:
+                break
+        else:
+            tableBin = {'bin': len(bins)+1, 'size': 0, 'rows': 0, 'tables': [], 'units': []}
+            bins.append(tableBin)
+        tableBin['size'] += unit['size']
+        tableBin['rows'] += unit['rows']
+        tableBin['tables'].append(unit['name'])
+        tableBin['units'].append(unit)
+
+    for tableBin in bins:
+        tableBin['name'] = 'bin {} ({} tables)'.format(tableBin['bin'], len(tableBin['tables']))
+    if bins:
+        print('{} small table(s) packed in {} bin(s).'.format(sum(len(tableBin['tables']) for tableBin in bins), len(bins)))
+    packed += bins
+    packed.sort(key=lambda unit: unit['size'], reverse=True)
+    return packed
+
+
+## Get back the table units and results of a run with bins, each table pointing at its bin file ##
+def unpackResults(units,results):
+    resultsByName = {result['name']: result for result in results}
+    tableUnits = []
+    tableResults = []
+    for unit in units:
+        for tableUnit in unit.get('units', [unit]):
+            tableUnit['file'] = unit['file']
+            tableUnits.append(tableUnit)
+            if unit['name'] in resultsByName:
+                tableResults.append(dict(resultsByName[unit['name']], name=tableUnit['name']))
+    return tableUnits, tableResults
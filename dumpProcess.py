@@ -0,0 +1,173 @@
+############################################################################################
+##          Execution layer of the dump tools (mysqldump, pg_dump, psql, ...):            ##
+##                                                                                        ##
+##  - The tools are started directly from an argv list, without cmd.exe or a shell, so    ##
+##    no shell is spawned per table, nothing in a name needs quoting and the exit code    ##
+##    seen is the real one of the tool;                                                   ##
+##  - Their stdin/stdout are pipes read and written in-process (hashing, compression,     ##
+##    upload, restore), the bytes going through each pipe are counted;                    ##
+##  - A watchdog thread prints the progress of the running tools every progressInterval   ##
+##    seconds and kills the ones running longer than --timeout MIN or whose pipes stayed  ##
+##    idle for --stall MIN;                                                               ##
+##  - With --fail-fast, the first unit that fails cancels the run: the running tools are  ##
+##    killed and the units not started yet are skipped (see dumpScheduler).               ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+import subprocess
+import threading
+import time
+import os
+
+## Seconds between two checks of the watchdog, and between two progress lines ##
+watchInterval = 5
+progressInterval = 60
+
+## Limits of a single tool run in seconds (--timeout/--stall), None for no limit ##
+processTimeout = None
+stallTimeout = None
+
+## Cancel the run when a unit fails (--fail-fast) ##
+failFast = False
+cancelled = threading.Event()
+
+## Tools running, and the watchdog thread watching them ##
+running = set()
+runningLock = threading.Lock()
+watchdog = {}
+
+## Set the limits of the tools and the --fail-fast behaviour of a run ##
+def configureProcesses(timeout=None,stall=None,cancelOnFailure=False):
+    global processTimeout, stallTimeout, failFast
+    processTimeout = timeout
+    stallTimeout = stall
+    failFast = cancelOnFailure
+    cancelled.clear()
+
+
+## Cancel the run: kill every running tool, the next units are skipped ##
+def cancelRun(reason):
+    if cancelled.is_set():
+        return
+    cancelled.set()
+    print('Cancelling the run: {}.'.format(reason))
+    with runningLock:
+        processes = list(running)
+    for process in processes:
+        process.kill('the run was cancelled')
+
+
+## Running tool, its pipes read and written through it ##
+class DumpProcess:
+    def __init__(self,command,stdin=False,stdout=True,output=None):
+        self.command = [str(argument) for argument in command]
+        self.name = os.path.basename(self.command[0])
+        if cancelled.is_set():
+            raise RuntimeError('ERROR: The run was cancelled, '+self.name+' was not started.')
+        self.piped = stdin or (stdout and output is None)
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE if stdin else None,
+                                        stdout=output if output is not None else (subprocess.PIPE if stdout else None))
+        self.bytesRead = 0
+        self.bytesWritten = 0
+        self.startedAt = time.monotonic()
+        self.lastActivity = self.startedAt
+        self.killedBecause = None
+        self.exitCode = None
+        with runningLock:
+            running.add(self)
+        startWatchdog()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,errorType,error,traceback):
+        if errorType is not None:
+            self.kill('the consumer of its output failed')
+            try:
+                self.wait()
+            except RuntimeError:
+                pass
+            return False
+        self.wait()
+        return False
+
+    def read(self,size=-1):
+        data = self.process.stdout.read(size)
+        self.bytesRead += len(data)
+        self.lastActivity = time.monotonic()
+        return data
+
+    def __iter__(self):
+        for line in self.process.stdout:
+            self.bytesRead += len(line)
+            self.lastActivity = time.monotonic()
+            yield line
+
+    def write(self,data):
+        self.process.stdin.write(data)
+        self.bytesWritten += len(data)
+        self.lastActivity = time.monotonic()
+        return len(data)
+
+    def closeInput(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+    def kill(self,reason):
+        if self.process.poll() is None and self.killedBecause is None:
+            self.killedBecause = reason
+            self.process.kill()
+
+    ## Wait for the tool, returns its exit code or raises if the watchdog killed it ##
+    def wait(self):
+        if self.process.stdin:
+            self.closeInput()
+        if self.process.stdout:
+            self.process.stdout.close()
+        self.exitCode = self.process.wait()
+        with runningLock:
+            running.discard(self)
+        if self.killedBecause:
+            raise RuntimeError('ERROR: '+self.name+' was killed, '+self.killedBecause+' (exit code '+str(self.exitCode)+').')
+        return self.exitCode
+
+
+## Run a tool to the end, its output to a file or to the console ##
+def runCommand(command,output=None):
+    with DumpProcess(command,stdout=output is not None,output=output) as process:
+        pass
+    return process.exitCode
+
+
+## Check the running tools against the limits, and print their progress ##
+def watchProcesses():
+    lastProgress = time.monotonic()
+    while True:
+        time.sleep(watchInterval)
+        now = time.monotonic()
+        with runningLock:
+            processes = list(running)
+        for process in processes:
+            if processTimeout and now-process.startedAt > processTimeout:
+                process.kill('it ran for more than {:g} minute(s)'.format(processTimeout/60))
+            elif stallTimeout and process.piped and now-process.lastActivity > stallTimeout:
+                process.kill('its pipes stayed idle for {:g} minute(s)'.format(stallTimeout/60))
+        if now-lastProgress >= progressInterval:
+            lastProgress = now
+            for process in processes:
+                if process.piped and process.process.poll() is None:
+                    elapsed = now-process.startedAt
+                    print('[{} {}] {:.2f} Mb read, {:.2f} Mb written in {:.0f}s ({:.2f} Mb/s)'.format(
+                        process.name, process.process.pid, process.bytesRead/(1024**2), process.bytesWritten/(1024**2),
+                        elapsed, (process.bytesRead+process.bytesWritten)/(1024**2)/max(elapsed, 1)))
+
+
+## Start the watchdog thread once ##
+def startWatchdog():
+    with runningLock:
+        if 'thread' not in watchdog:
+            watchdog['thread'] = threading.Thread(target=watchProcesses, name='dumpWatchdog', daemon=True)
+            watchdog['thread'].start()
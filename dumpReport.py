@@ -0,0 +1,155 @@
+############################################################################################
+##                     Instrumentation and run report of the dumps:                       ##
+##                                                                                        ##
+##  - Every dump unit (table, bin, chunk, database) run by dumpScheduler is timed and     ##
+##    measured: raw/compressed bytes, rows, wall time, MB/s, exit code and queue wait;    ##
+##  - The code running a unit adds its own measures with recordMetrics();                 ##
+##  - finishRun() builds the run report, written as <name>_report.json next to the dump   ##
+##    files and, with --prometheus FILE, as a Prometheus textfile;                        ##
+##  - Callers can subscribe() to the 'unitFinished' and 'runFinished' events;             ##
+##  - printSummary() lists the failed units, with their error and attempts, at the end.   ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from datetime import datetime
+import threading
+import json
+import os
+
+## Callbacks subscribed to each event ##
+hooks = {'unitFinished': [], 'runFinished': []}
+
+## Units finished in the current run ##
+runUnits = []
+runLock = threading.Lock()
+runStart = datetime.now()
+
+## Metrics of the unit running on the current thread ##
+current = threading.local()
+
+## Subscribe a callback to an event ##
+def subscribe(event,callback):
+    if event not in hooks:
+        raise ValueError('ERROR: Invalid event "'+str(event)+'", use one of: '+', '.join(hooks)+'.')
+    hooks[event].append(callback)
+
+
+## Call the callbacks subscribed to an event ##
+def emit(event,payload):
+    for callback in hooks[event]:
+        callback(payload)
+
+
+## Start measuring a unit on the current thread ##
+def startUnit():
+    current.metrics = {}
+
+
+## Record measures of the unit running on the current thread ##
+def recordMetrics(**metrics):
+    if getattr(current, 'metrics', None) is not None:
+        current.metrics.update(metrics)
+
+
+## Stop measuring the unit running on the current thread ##
+def stopUnit():
+    metrics = getattr(current, 'metrics', None) or {}
+    current.metrics = None
+    return metrics
+
+
+## Add a finished unit to the run ##
+def unitFinished(result):
+    rawBytes = result.get('rawBytes')
+    result['MBps'] = round(rawBytes/(1024**2)/max(result['wallSeconds'], 0.001), 2) if rawBytes else None
+    with runLock:
+        runUnits.append(result)
+    emit('unitFinished', result)
+
+
+## Start a new run ##
+def startRun():
+    global runStart
+    runStart = datetime.now()
+    with runLock:
+        runUnits.clear()
+
+
+## Build the report of the run ##
+def finishRun(name,success):
+    finishedAt = datetime.now()
+    wallSeconds = (finishedAt-runStart).total_seconds()
+    with runLock:
+        units = [{key: value for key, value in result.items() if key != 'elapsed'} for result in runUnits]
+    rawBytes = sum(unit.get('rawBytes') or 0 for unit in units)
+    compressedBytes = sum(unit.get('compressedBytes') or 0 for unit in units)
+
+    report = {'run': {'name': name, 'startedAt': runStart.isoformat(), 'finishedAt': finishedAt.isoformat(),
+                      'wallSeconds': wallSeconds, 'success': bool(success), 'units': len(units),
+                      'failedUnits': sum(1 for unit in units if not unit['success']),
+                      'rawBytes': rawBytes, 'compressedBytes': compressedBytes or None,
+                      'MBps': round(rawBytes/(1024**2)/max(wallSeconds, 0.001), 2)},
+              'units': units}
+    emit('runFinished', report)
+    return report
+
+
+## Print the summary of the run, listing every failed unit ##
+def printSummary(report):
+    run = report['run']
+    print('{}: {} unit(s) dumped, {} failed, {:.2f} Mb in {:.1f}s.'.format(run['name'], run['units'], run['failedUnits'],
+                                                                         run['rawBytes']/(1024**2), run['wallSeconds']))
+    for unit in report['units']:
+        if not unit['success']:
+            print('  - {}: {} after {} attempt(s)'.format(unit['name'], unit.get('status', 'FAILED'), unit.get('attempts', 1)))
+
+
+## Write a file atomically ##
+def writeAtomic(filePath,text):
+    tempPath = filePath+'.tmp'
+    with open(tempPath,'w') as fout:
+        fout.write(text)
+    os.replace(tempPath, filePath)
+
+
+## Write the JSON report ##
+def writeReport(report,filePath):
+    writeAtomic(filePath, json.dumps(report, indent=2, default=str))
+
+
+## Escape a Prometheus label value ##
+def labelValue(value):
+    return str(value).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+
+## Write the report as a Prometheus textfile (node_exporter textfile collector) ##
+def writePrometheus(report,filePath):
+    run = labelValue(report['run']['name'])
+    unitMetrics = (('dump_unit_bytes_raw', 'rawBytes', 'Uncompressed bytes dumped by the unit'),
+                   ('dump_unit_bytes_compressed', 'compressedBytes', 'Compressed bytes written by the unit'),
+                   ('dump_unit_rows', 'rows', 'Rows dumped by the unit (catalog estimate unless counted)'),
+                   ('dump_unit_wall_seconds', 'wallSeconds', 'Wall time of the unit'),
+                   ('dump_unit_queue_wait_seconds', 'queueWaitSeconds', 'Time the unit waited for a worker'),
+                   ('dump_unit_throughput_mbps', 'MBps', 'Throughput of the unit in MB/s'),
+                   ('dump_unit_exit_code', 'exitCode', 'Exit code of the dump process of the unit'),
+                   ('dump_unit_attempts', 'attempts', 'Attempts made to dump the unit'),
+                   ('dump_unit_success', 'success', 'Whether the unit succeeded'))
+    runMetrics = (('dump_run_wall_seconds', 'wallSeconds', 'Wall time of the run'),
+                  ('dump_run_bytes_raw', 'rawBytes', 'Uncompressed bytes dumped by the run'),
+                  ('dump_run_units', 'units', 'Units dumped by the run'),
+                  ('dump_run_failed_units', 'failedUnits', 'Units that failed in the run'),
+                  ('dump_run_success', 'success', 'Whether every unit of the run succeeded'))
+
+    lines = []
+    for metric, key, description in unitMetrics:
+        lines += ['# HELP '+metric+' '+description, '# TYPE '+metric+' gauge']
+        for unit in report['units']:
+            if unit.get(key) is not None:
+                lines.append('{}{{run="{}",unit="{}"}} {}'.format(metric, run, labelValue(unit['name']), float(unit[key])))
+    for metric, key, description in runMetrics:
+        lines += ['# HELP '+metric+' '+description, '# TYPE '+metric+' gauge',
+                  '{}{{run="{}"}} {}'.format(metric, run, float(report['run'][key]))]
+    lines += ['# HELP dump_run_last_timestamp_seconds Time the run finished', '# TYPE dump_run_last_timestamp_seconds gauge',
+              '{}{{run="{}"}} {}'.format('dump_run_last_timestamp_seconds', run, datetime.fromisoformat(report['run']['finishedAt']).timestamp())]
+    writeAtomic(filePath, '\n'.join(lines)+'\n')
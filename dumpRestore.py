@@ -0,0 +1,324 @@
+############################################################################################
+##             Parallel restore of the per-table dump files (--restore):                  ##
+##                                                                                        ##
+##  - The <DB>_tb_<table> and <DB>_bin_ files of a dump folder are found through the      ##
+##    <DB>_index.json (or their names) and loaded by --jobs N workers at the same time,   ##
+##    compressed files (-c, --stream) are decompressed on the fly;                        ##
+##  - MySQL: each file is piped into the mysql client with unique_checks and              ##
+##    foreign_key_checks off, the secondary keys and foreign keys are cut from its        ##
+##    CREATE TABLE: the keys are added by one ALTER TABLE once the table is loaded, the   ##
+##    foreign keys once every table is loaded;                                            ##
+##  - PostgreSQL: pg_restore creates the tables of every file first, then loads the data  ##
+##    of the files in parallel, then builds their indexes and constraints in parallel,    ##
+##    the foreign keys last (filtered pg_restore -l/-L lists);                            ##
+##  - The data-only files of --schema-cache are loaded after the schema file of the       ##
+##    index, the keys and constraints of its tables are still built after the data;       ##
+##  - A file failing on a missing dependency (a view on a table not loaded yet) is        ##
+##    loaded again once the others are done;                                              ##
+##  - The throughput of every file is printed and kept in the run report.                 ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+import threading
+import tempfile
+import gzip
+import json
+import glob
+import re
+import os
+from dumpScheduler import runParallel, allSucceeded
+from dumpReport import recordMetrics
+from dumpCompress import zstandard, lz4
+from dumpProcess import DumpProcess
+
+## Size of the blocks piped into the restore tools ##
+blockSize = 1024**2
+
+## Session settings of the MySQL loads ##
+mysqlRestoreHeader = (b"SET SESSION unique_checks=0;\n"
+                      b"SET SESSION foreign_key_checks=0;\n")
+
+## Lines of a mysqldump CREATE TABLE ##
+createTable = re.compile(rb'^CREATE TABLE `((?:[^`]|``)+)` \(')
+deferredKeys = (b'  KEY ', b'  FULLTEXT KEY ', b'  SPATIAL KEY ')
+alterTable = re.compile(rb'^ALTER TABLE `((?:[^`]|``)+)` ')
+
+## pg_restore -l entries built after the data, the foreign keys after everything else ##
+foreignKeyEntry = re.compile(rb'^\d+; \d+ \d+ FK CONSTRAINT ')
+
+## Files of a dump, from the table index or their names ##
+def discoverFiles(path,DBName):
+    tablesByFile = {}
+    try:
+        with open(path+DBName+'_index.json') as fin:
+            for tableName, filename in json.load(fin)['tables'].items():
+                tablesByFile.setdefault(filename, []).append(tableName)
+    except (OSError, ValueError):
+        prefix = path+DBName+'_tb_'
+        for filePath in glob.glob(glob.escape(prefix)+'*'):
+            tableName = re.sub(r'(\.sql|\.tar)?(\.tar\.gz|\.gz|\.zst|\.lz4)?$', '', filePath[len(prefix):])
+            tablesByFile[os.path.basename(filePath)] = [tableName]
+        for filePath in glob.glob(glob.escape(path+DBName+'_bin_')+'*'):
+            tablesByFile[os.path.basename(filePath)] = [os.path.basename(filePath)]
+
+    units = []
+    for filename, tableNames in tablesByFile.items():
+        filePath = path+filename
+        if not os.path.exists(filePath):
+            print('WARNING: {} of {} not found, skipped.'.format(filename, ', '.join(tableNames)))
+            continue
+        if os.path.isdir(filePath):
+            size = sum(entry.stat().st_size for entry in os.scandir(filePath) if entry.is_file())
+        else:
+            size = os.stat(filePath).st_size
+        units.append({'name': ', '.join(sorted(tableNames)), 'file': filename, 'tables': sorted(tableNames), 'size': size})
+    print('{} dump file(s) of {} found to restore.'.format(len(units), DBName))
+    return units
+
+
+## Schema file of the data-only dumps (--schema-cache), if any ##
+def indexedSchema(path,DBName):
+    try:
+        with open(path+DBName+'_index.json') as fin:
+            schemaFile = json.load(fin).get('schema')
+    except (OSError, ValueError):
+        return None
+    if schemaFile and not os.path.exists(path+schemaFile):
+        raise RuntimeError('ERROR: The schema file '+schemaFile+' of '+DBName+' is missing.')
+    return schemaFile
+
+
+## Check if a dump file is compressed ##
+def isCompressed(filePath):
+    return filePath.endswith(('.gz', '.zst', '.lz4'))
+
+
+## Open a dump file, decompressing it on the fly ##
+def openDump(filePath):
+    if filePath.endswith('.gz'):
+        return gzip.open(filePath,'rb')
+    if filePath.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError('ERROR: The zstd codec requires the zstandard package.')
+        return zstandard.ZstdDecompressor().stream_reader(open(filePath,'rb'), closefd=True)
+    if filePath.endswith('.lz4'):
+        if lz4 is None:
+            raise RuntimeError('ERROR: The lz4 codec requires the lz4 package.')
+        return lz4.frame.open(filePath,'rb')
+    return open(filePath,'rb')
+
+
+## Pipe a dump file (or a header and lines) into a command, optionally collecting its output ##
+def pipeInto(command,filePath=None,header=b'',transform=None,output=None):
+    with DumpProcess(command,stdin=True,stdout=output is not None) as process:
+        if output is not None:
+            reader = threading.Thread(target=lambda: output.append(process.read()))
+            reader.start()
+        try:
+            process.write(header)
+            if filePath:
+                with openDump(filePath) as fin:
+                    if transform:
+                        for data in transform(fin):
+                            process.write(data)
+                    else:
+                        while True:
+                            block = fin.read(blockSize)
+                            if not block:
+                                break
+                            process.write(block)
+        except BrokenPipeError:
+            # The command stopped early, its exit code tells why
+            pass
+        process.closeInput()
+        if output is not None:
+            reader.join()
+    recordMetrics(rawBytes=process.bytesWritten)
+    return process.exitCode
+
+
+## Cut the secondary and foreign keys from the CREATE TABLE statements of a mysqldump file ##
+def deferMysqlKeys(fin,deferred):
+    tableName = None
+    for line in fin:
+        if tableName is None:
+            match = createTable.match(line)
+            if match:
+                tableName = match.group(1)
+                header = line
+                columns = []
+                autoIncrement = []
+            else:
+                yield line
+            continue
+
+        if not line.startswith(b'  '):
+            # End of the CREATE TABLE: ") ENGINE=..."
+            keys = []
+            kept = []
+            for column in columns:
+                isKey = column.startswith(deferredKeys)
+                # An AUTO_INCREMENT column must stay first in a key
+                keyColumns = re.search(rb'\(`((?:[^`]|``)+)`', column) if isKey else None
+                if isKey and not (keyColumns and keyColumns.group(1) in autoIncrement):
+                    keys.append(b'ADD '+column.strip())
+                elif column.startswith(b'  CONSTRAINT ') and b' FOREIGN KEY ' in column:
+                    deferred['foreignKeys'].append(b'ALTER TABLE `'+tableName+b'` ADD '+column.strip()+b';\n')
+                else:
+                    kept.append(column)
+            if keys:
+                deferred['indexes'].append(b'ALTER TABLE `'+tableName+b'` '+b', '.join(keys)+b';\n')
+            yield header+b',\n'.join(kept)+b'\n'+line
+            tableName = None
+            continue
+
+        column = line.rstrip(b'\r\n').rstrip(b',')
+        if column.startswith(b'  `') and b' AUTO_INCREMENT' in column:
+            autoIncrement.append(column[3:column.index(b'`', 3)])
+        columns.append(column)
+
+
+## Print the throughput of every restored file ##
+def printThroughput(results):
+    for result in sorted(results, key=lambda result: result['wallSeconds'], reverse=True):
+        rawBytes = result.get('rawBytes') or 0
+        print('{}: {:.2f} Mb in {:.1f}s ({:.2f} MB/s)'.format(result['name'], rawBytes/(1024**2), result['wallSeconds'],
+                                                             rawBytes/(1024**2)/max(result['wallSeconds'], 0.001)))
+
+
+## Run units in parallel, then once more the ones that failed (missing dependencies), with retryWorker if given ##
+def runTwice(units,worker,jobs,unitName,retryWorker=None):
+    results = runParallel(units, worker, jobs=jobs, unitName=unitName)
+    failed = [result['name'] for result in results if not result['success']]
+    if failed:
+        print('Loading again {} {}(s) that may depend on the others.'.format(len(failed), unitName))
+        retried = runParallel([unit for unit in units if unit['name'] in failed], retryWorker or worker, jobs=jobs, unitName=unitName)
+        results = [result for result in results if result['success']]+retried
+    return results
+
+
+## Restore the per-table files of a mysqldump -t run ##
+def restoreMysql(mysql,path,DBName,jobs=1):
+    units = discoverFiles(path,DBName)
+    if not units:
+        print('ERROR: No dump file of {} found in {}, nothing was restored.'.format(DBName, path))
+        return False
+    foreignKeys = []
+    keysLock = threading.Lock()
+
+    schemaFile = indexedSchema(path,DBName)
+    schemaKeys = {'indexes': [], 'foreignKeys': foreignKeys}
+    if schemaFile:
+        print('Creating the tables from {}.'.format(schemaFile))
+        if pipeInto(mysql,path+schemaFile,mysqlRestoreHeader,lambda fin: deferMysqlKeys(fin,schemaKeys)) != 0:
+            print('The schema could not be loaded.')
+            return False
+
+    def loadFile(unit):
+        deferred = {'indexes': [], 'foreignKeys': []}
+        exitCode = pipeInto(mysql,path+unit['file'],mysqlRestoreHeader,lambda fin: deferMysqlKeys(fin,deferred))
+        if exitCode == 0 and deferred['indexes']:
+            # All the secondary keys of a table are built by a single ALTER TABLE
+            exitCode = pipeInto(mysql,header=mysqlRestoreHeader+b''.join(deferred['indexes']))
+        with keysLock:
+            foreignKeys.extend(deferred['foreignKeys'])
+        return exitCode
+
+    def reloadFile(unit):
+        # A data-only file does not drop and create its tables, the rows of the first attempt are removed first
+        truncate = b''.join(b'TRUNCATE TABLE `'+tableName.replace('`','``').encode('utf8')+b'`;\n' for tableName in unit['tables'])
+        exitCode = pipeInto(mysql,header=mysqlRestoreHeader+truncate)
+        return exitCode if exitCode != 0 else loadFile(unit)
+
+    results = runTwice(units, loadFile, jobs, 'dump file', reloadFile if schemaFile else None)
+    printThroughput(results)
+    if not allSucceeded(results):
+        return False
+
+    if schemaKeys['indexes']:
+        # One ALTER TABLE per table of the schema file, the tables are indexed in parallel
+        results = runParallel([{'name': alterTable.match(statement).group(1).decode('utf8'), 'statement': statement}
+                               for statement in schemaKeys['indexes']],
+                              lambda unit: pipeInto(mysql,header=mysqlRestoreHeader+unit['statement']), jobs=jobs, unitName='index')
+        if not allSucceeded(results):
+            return False
+
+    if foreignKeys:
+        # With foreign_key_checks off the foreign keys are added without checking the loaded rows
+        print('Adding {} foreign key(s).'.format(len(foreignKeys)))
+        if pipeInto(mysql,header=mysqlRestoreHeader+b''.join(foreignKeys)) != 0:
+            print('The foreign keys could not be added.')
+            return False
+    return True
+
+
+## Run pg_restore on a dump file, decompressing it into its stdin when needed ##
+def pgRestoreFile(pg_restore,filePath,output=None):
+    if isCompressed(filePath):
+        return pipeInto(pg_restore,filePath,output=output)
+    with DumpProcess(pg_restore+[filePath],stdout=output is not None) as process:
+        if output is not None:
+            output.append(process.read())
+    if os.path.isfile(filePath):
+        recordMetrics(rawBytes=os.stat(filePath).st_size)
+    return process.exitCode
+
+
+## Write the pg_restore -L lists of the post-data entries of a file: foreign keys, and all the others ##
+def postDataLists(pg_restore,filePath,listPath):
+    output = []
+    if pgRestoreFile(pg_restore+['-l'],filePath,output) != 0:
+        return None
+    entries = [line for line in b''.join(output).splitlines(True) if line and not line.startswith(b';')]
+    lists = {}
+    for kind in ('other', 'foreignKeys'):
+        with open(listPath+'.'+kind,'wb') as fout:
+            fout.writelines(entry for entry in entries if bool(foreignKeyEntry.match(entry)) == (kind == 'foreignKeys'))
+        lists[kind] = listPath+'.'+kind
+    return lists
+
+
+## Restore the per-table files of a pg_dump -t run ##
+def restorePostgres(pg_restore,path,DBName,jobs=1):
+    units = discoverFiles(path,DBName)
+    if not units:
+        print('ERROR: No dump file of {} found in {}, nothing was restored.'.format(DBName, path))
+        return False
+    restore = pg_restore+['--exit-on-error', '-d', DBName]
+    # The data-only files of --schema-cache take their tables, indexes and constraints from the schema file
+    schemaFile = indexedSchema(path,DBName)
+    schemaUnits = [{'name': schemaFile, 'file': schemaFile}] if schemaFile else units
+    listFolder = tempfile.mkdtemp(prefix='pgRestore_')
+    try:
+        print('Creating the tables.')
+        results = runTwice(schemaUnits, lambda unit: pgRestoreFile(restore+['--section=pre-data'],path+unit['file']), 1, 'schema')
+        if not allSucceeded(results):
+            return False
+
+        print('Loading the data.')
+        results = runParallel(units, lambda unit: pgRestoreFile(restore+['--section=data'],path+unit['file']), jobs=jobs, unitName='data file')
+        printThroughput(results)
+        if not allSucceeded(results):
+            return False
+
+        for unit in schemaUnits:
+            unit['lists'] = postDataLists(pg_restore,path+unit['file'],os.path.join(listFolder, os.path.basename(unit['file'].rstrip('\\/'))))
+            if unit['lists'] is None:
+                print('The table of contents of {} could not be read.'.format(unit['file']))
+                return False
+
+        print('Building the indexes and constraints.')
+        results = runParallel(schemaUnits, lambda unit: pgRestoreFile(restore+['--section=post-data', '-L', unit['lists']['other']],path+unit['file']),
+                              jobs=jobs, unitName='index file')
+        if not allSucceeded(results):
+            return False
+
+        print('Adding the foreign keys.')
+        results = runParallel(schemaUnits, lambda unit: pgRestoreFile(restore+['-L', unit['lists']['foreignKeys']],path+unit['file']),
+                              jobs=1, unitName='foreign key file')
+        return allSucceeded(results)
+    finally:
+        for listName in os.listdir(listFolder):
+            os.remove(os.path.join(listFolder, listName))
+        os.rmdir(listFolder)
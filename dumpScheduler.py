@@ -0,0 +1,99 @@
+############################################################################################
+##                 Parallel scheduler for the per-table (-t) dump mode:                   ##
+##                                                                                        ##
+##  - Dump units (tables) are sorted by size, biggest first, so one huge table does not   ##
+##    start last and stretch the wall-clock time of the whole run;                        ##
+##  - Units are dumped by a pool of N workers (--jobs N), each one reporting its status;  ##
+##  - The run only counts as successful if every unit succeeded;                          ##
+##  - Every unit is timed and measured by dumpReport (wall time, queue wait, bytes, ...); ##
+##  - A failed unit is run again up to --retries N times, waiting retryBackoff seconds    ##
+##    before the first retry and twice as long before each next one;                      ##
+##  - A unit only starts when dumpThrottle lets it, the time waited counts as queue wait; ##
+##  - With --fail-fast, a unit failing for good cancels the run (dumpProcess): the tools  ##
+##    running are killed and the units not started yet are skipped.                       ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+import threading
+import time
+from dumpReport import startUnit, stopUnit, unitFinished
+from dumpThrottle import acquireUnit, releaseUnit
+import dumpProcess
+
+## Seconds waited before the first retry of a failed unit, doubled on each retry ##
+retryBackoff = 5
+
+## Sort dump units, biggest first ##
+def largestFirst(units):
+    return sorted(units, key=lambda unit: unit.get('size') or 0, reverse=True)
+
+
+## Run a single dump unit and report its status ##
+def runUnit(unit, worker, submittedAt=None, retries=0):
+    acquireUnit()
+    startTime = datetime.now()
+    workerName = threading.current_thread().name
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            startUnit()
+            if dumpProcess.cancelled.is_set():
+                exitCode = None
+                status = 'CANCELLED'
+            else:
+                try:
+                    exitCode = worker(unit)
+                except Exception as error:
+                    exitCode = None
+                    status = 'FAILED ({})'.format(error)
+                else:
+                    status = 'OK' if exitCode == 0 else 'FAILED (exit code {})'.format(exitCode)
+            metrics = stopUnit()
+        finally:
+            releaseUnit()
+        if status == 'OK' or attempts > retries or dumpProcess.cancelled.is_set():
+            break
+        wait = retryBackoff*2**(attempts-1)
+        print('[{}] {}: {}, retry {}/{} in {}s'.format(workerName, unit['name'], status, attempts, retries, wait))
+        # The throttle slot goes to another unit while this one waits
+        time.sleep(wait)
+        acquireUnit()
+
+    elapsed = datetime.now()-startTime
+    print('[{}] {}: {} in {}'.format(workerName, unit['name'], status, elapsed))
+    if dumpProcess.failFast and status.startswith('FAILED'):
+        dumpProcess.cancelRun(unit['name']+' failed')
+    result = {'name': unit['name'], 'size': unit.get('size'), 'rows': unit.get('rows'), 'exitCode': exitCode,
+              'success': status == 'OK', 'status': status, 'attempts': attempts, 'elapsed': elapsed, 'worker': workerName,
+              'wallSeconds': elapsed.total_seconds(),
+              'queueWaitSeconds': (startTime-(submittedAt or startTime)).total_seconds()}
+    result.update(metrics)
+    unitFinished(result)
+    return result
+
+
+## Run all dump units on a pool of workers ##
+def runParallel(units, worker, jobs=1, unitName='table', retries=0):
+    jobs = max(1, int(jobs))
+    units = largestFirst(units)
+    print('Dumping {} {}(s) using {} worker(s).'.format(len(units), unitName, jobs))
+
+    results = []
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='dumpWorker') as pool:
+        futures = [pool.submit(runUnit, unit, worker, datetime.now(), retries) for unit in units]
+        for future in as_completed(futures):
+            results.append(future.result())
+    return results
+
+
+## Check if every unit succeeded and list the failed ones ##
+def allSucceeded(results):
+    failed = [result['name'] for result in results if not result['success']]
+    if failed:
+        print('{} of {} unit(s) failed: {}'.format(len(failed), len(results), ', '.join(failed)))
+        return False
+    return True
@@ -0,0 +1,237 @@
+############################################################################################
+##              Schema-change cache of the per-table dumps (--schema-cache):              ##
+##                                                                                        ##
+##  - A few bulk catalog queries read the definition of every table, index, constraint,   ##
+##    view, routine (and trigger, sequence, type on PostgreSQL) of the database, each     ##
+##    object is hashed on its own;                                                        ##
+##  - The hashes are kept in <DB>_schema.json with the schema file they were dumped to:   ##
+##    when no hash changed since the last run, that file is reused and no schema dump     ##
+##    runs at all;                                                                        ##
+##  - When something changed, the added, dropped and changed objects are printed and      ##
+##    saved in <DB>_schema_diff.json, and the schema is dumped again on its own worker    ##
+##    while the data-only table dumps already run;                                        ##
+##  - The tables the diff added or changed are dumped again with --incremental, their     ##
+##    previous data-only files would not load into the new schema;                        ##
+##  - Without a snapshot shared with the schema dump, the hashes are read again once the  ##
+##    data is dumped, a schema changed during the run fails it and is not cached;         ##
+##  - The schema file is listed in <DB>_index.json, --restore loads it before the data.   ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import hashlib
+import shutil
+import json
+import os
+from dumpScheduler import runParallel, allSucceeded
+from dumpChecksum import setChecksum, recordedChecksum, fileChecksum
+from dumpReport import writeAtomic
+import dumpChecksum
+
+## Objects listed in the printed diff, per kind of change ##
+diffListed = 10
+
+## Kinds of objects named after their table, in both engines ##
+tableObjects = ('table', 'index', 'foreign key', 'constraint', 'trigger')
+
+## Catalog queries of the object definitions: (kind, query), the first column names the object ##
+## (MySQL triggers are left out, the dumps run with --skip-triggers) ##
+mysqlSchemaQueries = [
+    ('table', "SELECT table_name, engine, table_collation, create_options, table_comment FROM information_schema.tables "
+              "WHERE (table_schema = %s) AND (table_type = 'BASE TABLE') ORDER BY table_name"),
+    ('table', "SELECT c.table_name, c.ordinal_position, c.column_name, c.column_type, c.is_nullable, c.column_default, c.extra, "
+              "c.character_set_name, c.collation_name, c.column_comment FROM information_schema.columns c "
+              "JOIN information_schema.tables t ON (t.table_schema = c.table_schema) AND (t.table_name = c.table_name) "
+              "WHERE (c.table_schema = %s) AND (t.table_type = 'BASE TABLE') ORDER BY c.table_name, c.ordinal_position"),
+    ('index', "SELECT CONCAT(table_name, '.', index_name), seq_in_index, column_name, non_unique, sub_part, index_type, index_comment "
+              "FROM information_schema.statistics WHERE (table_schema = %s) ORDER BY table_name, index_name, seq_in_index"),
+    ('foreign key', "SELECT CONCAT(k.table_name, '.', k.constraint_name), k.ordinal_position, k.column_name, k.referenced_table_name, "
+                    "k.referenced_column_name, r.update_rule, r.delete_rule FROM information_schema.key_column_usage k "
+                    "JOIN information_schema.referential_constraints r ON (r.constraint_schema = k.constraint_schema) "
+                    "AND (r.table_name = k.table_name) AND (r.constraint_name = k.constraint_name) "
+                    "WHERE (k.table_schema = %s) ORDER BY k.table_name, k.constraint_name, k.ordinal_position"),
+    ('view', "SELECT table_name, view_definition, check_option, security_type FROM information_schema.views "
+             "WHERE (table_schema = %s) ORDER BY table_name"),
+    ('routine', "SELECT CONCAT(routine_type, ' ', routine_name), dtd_identifier, routine_definition, is_deterministic, "
+                "sql_data_access, security_type, sql_mode, routine_comment FROM information_schema.routines "
+                "WHERE (routine_schema = %s) ORDER BY routine_type, routine_name"),
+    ('routine', "SELECT CONCAT(routine_type, ' ', specific_name), ordinal_position, parameter_mode, parameter_name, dtd_identifier "
+                "FROM information_schema.parameters WHERE (specific_schema = %s) AND (ordinal_position > 0) "
+                "ORDER BY routine_type, specific_name, ordinal_position"),
+    ('event', "SELECT event_name, event_definition, event_type, execute_at, interval_value, interval_field, sql_mode, starts, ends, "
+              "status, on_completion FROM information_schema.events WHERE (event_schema = %s) ORDER BY event_name"),
+]
+
+## The system schemas (pg_catalog, pg_toast, ...) are left out like pg_dump does ##
+userSchema = "(n.nspname !~ '^pg_') AND (n.nspname <> 'information_schema')"
+
+postgresSchemaQueries = [
+    ('schema', "SELECT n.nspname, pg_get_userbyid(n.nspowner), n.nspacl::text FROM pg_namespace n WHERE "+userSchema+" ORDER BY 1"),
+    ('extension', "SELECT extname, extversion FROM pg_extension ORDER BY 1"),
+    ('type', "SELECT n.nspname||'.'||t.typname, e.enumsortorder, e.enumlabel FROM pg_enum e JOIN pg_type t ON (t.oid = e.enumtypid) "
+             "JOIN pg_namespace n ON (n.oid = t.typnamespace) WHERE "+userSchema+" ORDER BY 1, 2"),
+    ('table', "SELECT n.nspname||'.'||c.relname, c.relkind, c.relpersistence, c.reloptions::text, pg_get_partkeydef(c.oid), "
+              "pg_get_expr(c.relpartbound, c.oid), pg_get_userbyid(c.relowner), c.relacl::text, obj_description(c.oid, 'pg_class') "
+              "FROM pg_class c JOIN pg_namespace n ON (n.oid = c.relnamespace) "
+              "WHERE (c.relkind IN ('r', 'p', 'f')) AND "+userSchema+" ORDER BY 1"),
+    ('table', "SELECT n.nspname||'.'||c.relname, a.attnum, a.attname, format_type(a.atttypid, a.atttypmod), a.attnotnull, "
+              "pg_get_expr(d.adbin, d.adrelid), a.attidentity, a.attgenerated, a.attcollation, col_description(c.oid, a.attnum) "
+              "FROM pg_attribute a JOIN pg_class c ON (c.oid = a.attrelid) JOIN pg_namespace n ON (n.oid = c.relnamespace) "
+              "LEFT JOIN pg_attrdef d ON (d.adrelid = a.attrelid) AND (d.adnum = a.attnum) "
+              "WHERE (c.relkind IN ('r', 'p', 'f')) AND (a.attnum > 0) AND NOT a.attisdropped AND "+userSchema+" ORDER BY 1, 2"),
+    ('index', "SELECT n.nspname||'.'||c.relname, pg_get_indexdef(c.oid) FROM pg_class c JOIN pg_namespace n ON (n.oid = c.relnamespace) "
+              "WHERE (c.relkind IN ('i', 'I')) AND "+userSchema+" ORDER BY 1"),
+    ('constraint', "SELECT n.nspname||'.'||r.relname||'.'||c.conname, pg_get_constraintdef(c.oid) FROM pg_constraint c "
+                   "JOIN pg_class r ON (r.oid = c.conrelid) JOIN pg_namespace n ON (n.oid = r.relnamespace) "
+                   "WHERE "+userSchema+" ORDER BY 1"),
+    ('view', "SELECT n.nspname||'.'||c.relname, c.relkind, pg_get_viewdef(c.oid), pg_get_userbyid(c.relowner), c.relacl::text "
+             "FROM pg_class c JOIN pg_namespace n ON (n.oid = c.relnamespace) "
+             "WHERE (c.relkind IN ('v', 'm')) AND "+userSchema+" ORDER BY 1"),
+    ('sequence', "SELECT n.nspname||'.'||c.relname, format_type(s.seqtypid, NULL), s.seqstart, s.seqincrement, s.seqmin, s.seqmax, "
+                 "s.seqcache, s.seqcycle FROM pg_sequence s JOIN pg_class c ON (c.oid = s.seqrelid) "
+                 "JOIN pg_namespace n ON (n.oid = c.relnamespace) WHERE "+userSchema+" ORDER BY 1"),
+    # Functions of extensions are created by CREATE EXTENSION, not by the dump
+    ('function', "SELECT n.nspname||'.'||p.proname||'('||pg_get_function_identity_arguments(p.oid)||')', pg_get_functiondef(p.oid), "
+                 "pg_get_userbyid(p.proowner), p.proacl::text FROM pg_proc p JOIN pg_namespace n ON (n.oid = p.pronamespace) "
+                 "WHERE (p.prokind IN ('f', 'p')) AND "+userSchema+" AND NOT EXISTS "
+                 "(SELECT 1 FROM pg_depend dep WHERE (dep.objid = p.oid) AND (dep.deptype = 'e')) ORDER BY 1"),
+    ('trigger', "SELECT n.nspname||'.'||c.relname||'.'||t.tgname, pg_get_triggerdef(t.oid) FROM pg_trigger t "
+                "JOIN pg_class c ON (c.oid = t.tgrelid) JOIN pg_namespace n ON (n.oid = c.relnamespace) "
+                "WHERE NOT t.tgisinternal AND "+userSchema+" ORDER BY 1"),
+]
+
+## Hash of the definition of every object of a database, from the catalog ##
+def querySchemaHashes(engine,cursor,DBName):
+    definitions = {}
+    for kind, query in (mysqlSchemaQueries if engine == 'mysql' else postgresSchemaQueries):
+        if engine == 'mysql':
+            cursor.execute(query, (DBName,))
+        else:
+            cursor.execute(query)
+        for row in cursor.fetchall():
+            definitions.setdefault(kind+' '+str(row[0]), []).append(list(row[1:]))
+    return {name: hashlib.sha256(json.dumps(rows, default=str).encode('utf8')).hexdigest()
+            for name, rows in definitions.items()}
+
+
+## Path of the schema cache of a database ##
+def schemaCachePath(path,DBName):
+    return path+DBName+'_schema.json'
+
+
+## Load the schema cache of the last run ##
+def loadSchemaCache(path,DBName):
+    try:
+        with open(schemaCachePath(path,DBName)) as fin:
+            return json.load(fin)
+    except (OSError, ValueError):
+        return None
+
+
+## Objects added, dropped and changed between two sets of hashes ##
+def schemaDiff(previous,current):
+    return {'added': sorted(name for name in current if name not in previous),
+            'dropped': sorted(name for name in previous if name not in current),
+            'changed': sorted(name for name in current if name in previous and previous[name] != current[name])}
+
+
+## Print the objects of a diff, at most diffListed of each change ##
+def printSchemaDiff(DBName,diff):
+    print('Schema of {} changed: {} added, {} dropped, {} changed.'.format(
+        DBName, len(diff['added']), len(diff['dropped']), len(diff['changed'])))
+    for change in ('added', 'dropped', 'changed'):
+        for name in diff[change][:diffListed]:
+            print('  {} {}'.format(change, name))
+        if len(diff[change]) > diffListed:
+            print('  ... {} more {}'.format(len(diff[change])-diffListed, change))
+
+
+## Compare the hashes to the cache: reuse the cached schema file, or plan a new one ##
+def planSchema(path,DBName,hashes,filename):
+    cache = loadSchemaCache(path,DBName)
+    schema = {'hashes': hashes, 'file': filename, 'reused': False, 'previous': None, 'diff': None}
+    if cache is None:
+        print('No schema cache for {}, the schema is dumped.'.format(DBName))
+        return schema
+
+    schema['previous'] = cache['file']
+    diff = schemaDiff(cache['objects'],hashes)
+    schema['diff'] = diff
+    if not any(diff.values()) and os.path.exists(path+cache['file']):
+        # The reused file keeps the checksum it was dumped with
+        setChecksum(cache['file'], cache['bytes'], cache['digest'], cache['algorithm'])
+        schema.update({'file': cache['file'], 'reused': True})
+        print('Schema of {} unchanged since {}, {} reused ({} objects).'.format(DBName, cache['dumpedAt'], cache['file'], len(hashes)))
+        return schema
+
+    if any(diff.values()):
+        printSchemaDiff(DBName,diff)
+        writeAtomic(path+DBName+'_schema_diff.json', json.dumps(
+            {'database': DBName, 'since': cache['dumpedAt'], 'comparedAt': datetime.now().isoformat(), **diff}, indent=2))
+    else:
+        print('Schema file {} of {} missing, the schema is dumped.'.format(cache['file'], DBName))
+    return schema
+
+
+## Tables the schema diff added or changed, all of them when there was no cache to compare to ##
+def schemaChangedTables(schema,tableNames,prefix=''):
+    if schema['reused']:
+        return set()
+    if schema['diff'] is None:
+        return set(tableNames)
+
+    objects = []
+    for name in schema['diff']['added']+schema['diff']['changed']:
+        for kind in tableObjects:
+            if name.startswith(kind+' '):
+                objects.append(name[len(kind)+1:])
+    # The objects of a table are named after it: table.index, table.constraint, ...
+    return {tableName for tableName in tableNames
+            if any(name == prefix+tableName or name.startswith(prefix+tableName+'.') for name in objects)}
+
+
+## Start the schema dump on its own worker, the table dumps do not wait for it ##
+def startSchemaDump(schema,dump,retries=0):
+    if schema['reused']:
+        return None
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='schemaWorker')
+    job = pool.submit(runParallel, [{'name': schema['file']}], lambda unit: dump(), 1, 'schema', retries)
+    pool.shutdown(wait=False)
+    return job
+
+
+## Wait for the schema dump and cache the hashes of the schema it wrote (hashes: read again after the data) ##
+def finishSchema(path,DBName,schema,job,hashes=None):
+    if hashes is not None and hashes != schema['hashes']:
+        printSchemaDiff(DBName,schemaDiff(schema['hashes'],hashes))
+        print('ERROR: The schema of {} changed during the run, the data-only dumps may not match it and it is not cached.'.format(DBName))
+        if job is not None:
+            job.result()
+        return False
+    if job is None:
+        return True
+    if not allSucceeded(job.result()):
+        return False
+
+    algorithm = dumpChecksum.hashAlgorithm
+    checksum = recordedChecksum(schema['file'],algorithm)
+    if checksum is None:
+        # Written by pg_dump itself (directory format)
+        checksum = fileChecksum(path+schema['file'],algorithm)
+        setChecksum(schema['file'], checksum[0], checksum[1], algorithm)
+    writeAtomic(schemaCachePath(path,DBName), json.dumps(
+        {'database': DBName, 'dumpedAt': datetime.now().isoformat(), 'file': schema['file'], 'bytes': checksum[0],
+         'digest': checksum[1], 'algorithm': algorithm, 'objects': schema['hashes']}, indent=2))
+    if schema['previous'] and schema['previous'] != schema['file']:
+        if os.path.isdir(path+schema['previous']):
+            shutil.rmtree(path+schema['previous'])
+        elif os.path.isfile(path+schema['previous']):
+            os.remove(path+schema['previous'])
+    return True
+
+
+## Fingerprints of the data-only dumps, so --incremental never mixes them with full table dumps ##
+def dataOnlyFingerprints(fingerprints):
+    return {name: None if fingerprint is None else 'data only, {}'.format(fingerprint) for name, fingerprint in fingerprints.items()}
@@ -0,0 +1,60 @@
+############################################################################################
+##           Consistent snapshot shared by the parallel dump workers (--consistent):      ##
+##                                                                                        ##
+##  - PostgreSQL: a coordinator connection exports its snapshot (pg_export_snapshot) and  ##
+##    keeps its transaction open for the whole run, every pg_dump (--snapshot) or COPY    ##
+##    worker (SET TRANSACTION SNAPSHOT) then sees exactly the same data;                  ##
+##  - MySQL: the worker connections are opened first, then a FLUSH TABLES WITH READ LOCK  ##
+##    is taken, every worker starts its transaction WITH CONSISTENT SNAPSHOT and the      ##
+##    lock is released: the global read lock is only held for a few milliseconds.         ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from datetime import datetime
+
+## Seconds FLUSH TABLES WITH READ LOCK waits for the running statements before giving up ##
+lockWaitTimeout = 60
+
+## Export the snapshot of a PostgreSQL connection, its transaction must stay open ##
+def exportPostgresSnapshot(conn,cursor):
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    cursor.execute('SELECT pg_export_snapshot()')
+    snapshotId = cursor.fetchone()[0]
+    print('Snapshot {} exported, shared by every worker.'.format(snapshotId))
+    return snapshotId
+
+
+## Make a PostgreSQL connection see an exported snapshot ##
+def joinPostgresSnapshot(conn,cursor,snapshotId):
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    cursor.execute('SET TRANSACTION SNAPSHOT %s', (snapshotId,))
+
+
+## Open MySQL connections all starting their transaction at the same point in time ##
+def openMysqlSnapshots(connect,count,opened):
+    connections = []
+    for worker in range(count+1):
+        conn, cursor = connect()
+        opened.append(conn)
+        connections.append((conn, cursor))
+    lockConn, lockCursor = connections.pop()
+
+    try:
+        lockCursor.execute('SET SESSION lock_wait_timeout = '+str(lockWaitTimeout))
+        lockCursor.execute('FLUSH TABLES WITH READ LOCK')
+    except Exception as error:
+        locked = None
+        print('WARNING: FLUSH TABLES WITH READ LOCK failed ({}), the snapshots of the workers may differ.'.format(error))
+    else:
+        locked = datetime.now()
+
+    try:
+        for conn, cursor in connections:
+            conn.start_transaction(consistent_snapshot=True, readonly=True)
+    finally:
+        if locked:
+            lockCursor.execute('UNLOCK TABLES')
+            print('Global read lock held {:.1f} ms to open {} consistent snapshot(s).'.format(
+                (datetime.now()-locked).total_seconds()*1000, len(connections)))
+    return connections
@@ -0,0 +1,328 @@
+############################################################################################
+##            Referentially-closed subset of a database (--subset):                       ##
+##                                                                                        ##
+##  - The tables come from the table catalog of the planner, the foreign keys from one    ##
+##    catalog query, giving the graph of the parent/child tables;                         ##
+##  - Root rows are chosen by a filter ("orders WHERE created_at > ...") or a sample      ##
+##    ("orders 5%"), then the graph is walked with batched key-set queries (batchSize     ##
+##    keys per IN list): the parents of every row taken are taken, so no foreign key is   ##
+##    left dangling, and the children of the root rows (and of their children) too;       ##
+##  - Only the keys (and foreign key columns) are read during the walk, the rows are read ##
+##    once at the end, by primary key batches;                                            ##
+##  - Everything is read in one consistent snapshot and written to a single               ##
+##    <DB>_subset.sql: the schema, then the rows, then (PostgreSQL) the indexes and       ##
+##    constraints, loaded back by the mysql client or psql;                               ##
+##  - A <DB>_subset.json lists the roots and the rows taken from every table.             ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from collections import deque
+from datetime import datetime
+import json
+import re
+import os
+from dumpPlanner import queryMysqlTables, queryPostgresTables
+from dumpReport import recordMetrics
+from dumpThrottle import ThrottledWriter
+from dumpChecksum import addFileChecksum
+from dumpCompress import compress, compressedName
+from dumpSnapshot import exportPostgresSnapshot
+from dumpProcess import runCommand
+import mysqlExport
+import pgExport
+
+## Keys per IN list of the key-set queries, and rows fetched at a time ##
+batchSize = 1000
+fetchChunk = 10000
+
+## Root specifications: "table WHERE condition", "table N%" or "table" ##
+rootFilter = re.compile(r'^\s*([^\s%]+)\s+WHERE\s+(.+)$', re.IGNORECASE | re.DOTALL)
+rootSample = re.compile(r'^\s*([^\s%]+)\s+(\d+(?:\.\d+)?)\s*%\s*$')
+rootTable = re.compile(r'^\s*([^\s%]+)\s*$')
+
+## Parse a root specification ##
+def parseRoot(spec):
+    for pattern, kind in ((rootFilter, 'where'), (rootSample, 'sample'), (rootTable, 'all')):
+        match = pattern.match(spec)
+        if match:
+            root = {'spec': spec, 'table': match.group(1).strip('`"'), 'kind': kind}
+            if kind == 'where':
+                root['where'] = match.group(2)
+            elif kind == 'sample':
+                root['percent'] = float(match.group(2))
+                if not 0 < root['percent'] <= 100:
+                    raise ValueError('ERROR: Invalid sample "'+spec+'", the percentage must be between 0 and 100.')
+            return root
+    raise ValueError('ERROR: Invalid subset root "'+spec+'", use "table WHERE condition", "table N%" or "table".')
+
+
+## Foreign keys of the database: child table and columns, parent table and columns ##
+def queryForeignKeys(engine,cursor,DBName):
+    if engine == 'mysql':
+        cursor.execute("SELECT table_name, constraint_name, column_name, referenced_table_name, referenced_column_name "
+                       "FROM information_schema.key_column_usage "
+                       "WHERE (table_schema = %s) AND (referenced_table_schema = %s) AND (referenced_table_name IS NOT NULL) "
+                       "ORDER BY table_name, constraint_name, ordinal_position", (DBName, DBName))
+    else:
+        cursor.execute("SELECT cl.relname, c.conname, a.attname, rcl.relname, ra.attname FROM pg_constraint c "
+                       "JOIN pg_class cl ON (cl.oid = c.conrelid) JOIN pg_namespace n ON (n.oid = cl.relnamespace) "
+                       "JOIN pg_class rcl ON (rcl.oid = c.confrelid) JOIN pg_namespace rn ON (rn.oid = rcl.relnamespace) "
+                       "CROSS JOIN LATERAL unnest(c.conkey, c.confkey) WITH ORDINALITY k(attnum, refattnum, ord) "
+                       "JOIN pg_attribute a ON (a.attrelid = c.conrelid) AND (a.attnum = k.attnum) "
+                       "JOIN pg_attribute ra ON (ra.attrelid = c.confrelid) AND (ra.attnum = k.refattnum) "
+                       "WHERE (c.contype = 'f') AND (n.nspname = 'public') AND (rn.nspname = 'public') "
+                       "ORDER BY cl.relname, c.conname, k.ord")
+    foreignKeys = {}
+    for tableName, constraintName, columnName, parentName, parentColumn in cursor.fetchall():
+        foreignKey = foreignKeys.setdefault((tableName, constraintName), {'name': constraintName, 'table': tableName, 'columns': [],
+                                                                         'parent': parentName, 'parentColumns': []})
+        foreignKey['columns'].append(columnName)
+        foreignKey['parentColumns'].append(parentColumn)
+    return list(foreignKeys.values())
+
+
+## Columns of every table, generated columns left out ##
+def queryColumns(engine,cursor,DBName):
+    if engine == 'mysql':
+        cursor.execute("SELECT table_name, column_name FROM information_schema.columns "
+                       "WHERE (table_schema = %s) AND (extra NOT LIKE %s) ORDER BY table_name, ordinal_position", (DBName, '%GENERATED%'))
+    else:
+        cursor.execute("SELECT c.relname, a.attname FROM pg_attribute a JOIN pg_class c ON (c.oid = a.attrelid) "
+                       "JOIN pg_namespace n ON (n.oid = c.relnamespace) "
+                       "WHERE (n.nspname = 'public') AND (a.attnum > 0) AND NOT a.attisdropped AND (a.attgenerated = '') "
+                       "ORDER BY c.relname, a.attnum")
+    columns = {}
+    for tableName, columnName in cursor.fetchall():
+        columns.setdefault(tableName, []).append(columnName)
+    return columns
+
+
+## Build the graph: for every table its keys, the columns read during the walk and its foreign keys ##
+def buildGraph(engine,DBName,tableInfos,columns,foreignKeys):
+    quote = mysqlExport.quoteIdent if engine == 'mysql' else pgExport.quoteIdent
+    # Partitions are read through their partitioned table
+    kinds = ('table',) if engine == 'mysql' else ('table', 'partitioned')
+    graph = {}
+    for info in tableInfos:
+        if info.kind in kinds and columns.get(info.name):
+            graph[info.name] = {'name': info.name, 'columns': columns[info.name], 'pk': list(info.pkColumns),
+                                'from': (quote(DBName) if engine == 'mysql' else 'public')+'.'+quote(info.name),
+                                'parents': [], 'children': [], 'keys': {}, 'down': set()}
+    for foreignKey in foreignKeys:
+        if foreignKey['table'] in graph and foreignKey['parent'] in graph:
+            foreignKey['requested'] = set()
+            foreignKey['requestedDown'] = set()
+            graph[foreignKey['table']]['parents'].append(foreignKey)
+            graph[foreignKey['parent']]['children'].append(foreignKey)
+
+    for table in graph.values():
+        if table['pk']:
+            # The primary key, then the columns the foreign keys need
+            needed = table['pk']+[column for foreignKey in table['parents'] for column in foreignKey['columns']]
+            needed += [column for foreignKey in table['children'] for column in foreignKey['parentColumns']]
+            table['read'] = list(dict.fromkeys(needed))
+        else:
+            # Without a primary key a row is only known by all its values
+            table['read'] = table['columns']
+        table['select'] = 'SELECT '+', '.join(quote(column) for column in table['read'])+' FROM '+table['from']
+    return graph
+
+
+## Condition matching a batch of values of some columns ##
+def keySetCondition(engine,columns,count):
+    quote = mysqlExport.quoteIdent if engine == 'mysql' else pgExport.quoteIdent
+    if len(columns) == 1:
+        return quote(columns[0])+' IN ('+', '.join(['%s']*count)+')'
+    row = '('+', '.join(['%s']*len(columns))+')'
+    return '('+', '.join(quote(column) for column in columns)+') IN ('+', '.join([row]*count)+')'
+
+
+## Take the new rows of a table, queue their parents (and children, going down from a root) ##
+def takeRows(table,rows,down,work):
+    keyLength = len(table['pk']) or len(table['read'])
+    new = []
+    newDown = []
+    for row in rows:
+        key = tuple(row[:keyLength])
+        if key not in table['keys']:
+            table['keys'][key] = tuple(row)
+            new.append(row)
+        if down and key not in table['down']:
+            table['down'].add(key)
+            newDown.append(row)
+
+    for foreignKey in table['parents']:
+        positions = [table['read'].index(column) for column in foreignKey['columns']]
+        values = {tuple(row[position] for position in positions) for row in new}
+        values = {value for value in values if None not in value and value not in foreignKey['requested']}
+        foreignKey['requested'].update(values)
+        if values:
+            work.append((foreignKey['parent'], foreignKey['parentColumns'], values, False))
+    for foreignKey in table['children']:
+        positions = [table['read'].index(column) for column in foreignKey['parentColumns']]
+        values = {tuple(row[position] for position in positions) for row in newDown}
+        values = {value for value in values if None not in value and value not in foreignKey['requestedDown']}
+        foreignKey['requestedDown'].update(values)
+        if values:
+            work.append((foreignKey['table'], foreignKey['columns'], values, True))
+
+
+## Read the rows of a query fetchChunk at a time ##
+def fetchRows(cursor,query,params=None):
+    cursor.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(fetchChunk)
+        if not rows:
+            break
+        yield from rows
+
+
+## Walk the graph from the roots with batched key-set queries ##
+def walkGraph(engine,cursor,graph,roots):
+    work = deque()
+    queries = 0
+    for root in roots:
+        table = graph[root['table']]
+        if root['kind'] == 'where':
+            query = table['select']+' WHERE '+root['where']
+        elif root['kind'] == 'sample' and engine == 'mysql':
+            query = table['select']+' WHERE RAND(0) < '+str(root['percent']/100)
+        elif root['kind'] == 'sample':
+            query = table['select']+' TABLESAMPLE BERNOULLI ('+str(root['percent'])+') REPEATABLE (0)'
+        else:
+            query = table['select']
+        takeRows(table,list(fetchRows(cursor,query)),True,work)
+        queries += 1
+        print('Root {}: {} row(s).'.format(root['spec'], len(table['keys'])))
+
+    while work:
+        tableName, columns, values, down = work.popleft()
+        table = graph[tableName]
+        values = sorted(values)
+        for start in range(0, len(values), batchSize):
+            batch = values[start:start+batchSize]
+            query = table['select']+' WHERE '+keySetCondition(engine,columns,len(batch))
+            takeRows(table,list(fetchRows(cursor,query,[value for key in batch for value in key])),down,work)
+            queries += 1
+    return queries
+
+
+## Write rows as multi-row INSERT statements ##
+def writeInserts(engine,cursor,fout,table,columns,rows):
+    quote = mysqlExport.quoteIdent if engine == 'mysql' else pgExport.quoteIdent
+    target = quote(table['name']) if engine == 'mysql' else table['from']
+    insert = ('INSERT INTO '+target+' ('+', '.join(quote(column) for column in columns)+') VALUES ').encode('utf8')
+    statement = []
+    statementBytes = 0
+    for row in rows:
+        if engine == 'mysql':
+            values = b'('+b','.join(mysqlExport.sqlValue(value) for value in row)+b')'
+        else:
+            values = cursor.mogrify('('+', '.join(['%s']*len(row))+')', row)
+        if statement and statementBytes+len(values) > mysqlExport.maxStatementBytes:
+            fout.write(insert+b',\n'.join(statement)+b';\n')
+            statement = []
+            statementBytes = 0
+        statement.append(values)
+        statementBytes += len(values)+2
+    if statement:
+        fout.write(insert+b',\n'.join(statement)+b';\n')
+
+
+## Write the rows of a table, read again by primary key batches ##
+def writeTable(engine,cursor,fout,table):
+    if not table['pk']:
+        # The rows were read whole during the walk
+        writeInserts(engine,cursor,fout,table,table['read'],table['keys'].values())
+        return len(table['keys'])
+
+    quote = mysqlExport.quoteIdent if engine == 'mysql' else pgExport.quoteIdent
+    select = ('SELECT '+', '.join(quote(column) for column in table['columns'])+' FROM '+table['from']+' WHERE ')
+    orderBy = ' ORDER BY '+', '.join(quote(column) for column in table['pk'])
+    keys = sorted(table['keys'])
+    if engine == 'postgres':
+        fout.write(('COPY '+table['from']+' ('+', '.join(quote(column) for column in table['columns'])+') FROM stdin;\n').encode('utf8'))
+    for start in range(0, len(keys), batchSize):
+        batch = keys[start:start+batchSize]
+        params = [value for key in batch for value in key]
+        query = select+keySetCondition(engine,table['pk'],len(batch))+orderBy
+        if engine == 'mysql':
+            writeInserts(engine,cursor,fout,table,table['columns'],list(fetchRows(cursor,query,params)))
+        else:
+            cursor.copy_expert('COPY ('+cursor.mogrify(query, params).decode('utf8')+') TO STDOUT', fout)
+    if engine == 'postgres':
+        fout.write(b'\\.\n\n')
+    return len(keys)
+
+
+## Append the output of pg_dump to the subset file ##
+def appendPgDump(command,filePath):
+    with open(filePath,'ab') as fout:
+        if runCommand(command,output=fout) != 0:
+            raise RuntimeError('ERROR: pg_dump could not dump the schema of the subset.')
+
+
+## Path of the subset manifest of a database ##
+def subsetManifestPath(path,DBName):
+    return path+DBName+'_subset.json'
+
+
+## Dump the referentially-closed subset of a database reached from the roots (exit code 0) ##
+def dumpSubset(connect,DBName,path,engine,rootSpecs,pg_dump=None,codec=None,level=None):
+    startTime = datetime.now()
+    roots = [parseRoot(spec) for spec in rootSpecs]
+    filename = DBName+'_subset.sql'
+    conn, cursor = connect()
+    try:
+        # The walk, the schema and the rows all see the same snapshot
+        if engine == 'mysql':
+            conn.start_transaction(consistent_snapshot=True, readonly=True)
+            tableInfos = queryMysqlTables(cursor,DBName)
+        else:
+            snapshotId = exportPostgresSnapshot(conn,cursor)
+            tableInfos = queryPostgresTables(cursor)
+        graph = buildGraph(engine,DBName,tableInfos,queryColumns(engine,cursor,DBName),queryForeignKeys(engine,cursor,DBName))
+        for root in roots:
+            if root['table'] not in graph:
+                raise ValueError('ERROR: The subset root table "'+root['table']+'" is not a table of '+DBName+'.')
+
+        queries = walkGraph(engine,cursor,graph,roots)
+        print('Subset of {} closed over the foreign keys with {} key-set queries: {} row(s) in {} table(s).'.format(
+            DBName, queries, sum(len(table['keys']) for table in graph.values()),
+            sum(1 for table in graph.values() if table['keys'])))
+
+        rowCounts = {}
+        if engine == 'postgres':
+            with open(path+filename,'wb'):
+                pass
+            appendPgDump(pg_dump+['--section=pre-data', '--snapshot='+snapshotId, DBName],path+filename)
+        with open(path+filename,'ab') as fout:
+            writer = ThrottledWriter(fout)
+            if engine == 'mysql':
+                fout.write(mysqlExport.sqlHeader.encode())
+                for table in graph.values():
+                    cursor.execute('SHOW CREATE TABLE '+table['from'])
+                    fout.write((cursor.fetchall()[0][1]+';\n\n').encode('utf8'))
+            for table in graph.values():
+                if table['keys']:
+                    rowCounts[table['name']] = writeTable(engine,cursor,writer,table)
+        if engine == 'postgres':
+            appendPgDump(pg_dump+['--section=post-data', '--snapshot='+snapshotId, DBName],path+filename)
+    finally:
+        conn.close()
+
+    recordMetrics(rows=sum(rowCounts.values()))
+    if codec:
+        compress(path=path,filename=filename,codec=codec,level=level)
+        filename = compressedName(filename,codec)
+    else:
+        addFileChecksum(path,filename)
+        recordMetrics(rawBytes=os.stat(path+filename).st_size)
+
+    manifest = {'database': DBName, 'exportedAt': startTime.isoformat(), 'roots': rootSpecs, 'file': filename,
+                'tables': [{'name': table['name'], 'columns': table['columns'], 'files': [filename], 'rows': rowCounts.get(table['name'], 0)}
+                           for table in graph.values()]}
+    with open(subsetManifestPath(path,DBName),'w') as fout:
+        json.dump(manifest, fout, indent=2)
+    return 0
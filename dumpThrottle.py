@@ -0,0 +1,169 @@
+############################################################################################
+##              Load-aware throttling of the dumps (--max-rate/--max-active/--max-lag):   ##
+##                                                                                        ##
+##  - The bytes read from the server (--stream pipes and --native exports) go through a   ##
+##    shared rate limiter of --max-rate MB/s;                                             ##
+##  - The dump units run by dumpScheduler go through a gate of at most --jobs N units,    ##
+##    lowered while the server is busy;                                                   ##
+##  - A monitor thread polls the server health every pollInterval seconds over its own    ##
+##    DBConnect connection (MySQL Threads_running and replica lag, PostgreSQL active      ##
+##    backends and replay lag): above a threshold the concurrency is halved, above twice  ##
+##    a threshold the dumps pause, when healthy again the concurrency grows back by one;  ##
+##  - Every decision is printed in the run output.                                        ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from datetime import datetime
+import threading
+import time
+
+## Seconds between two health polls ##
+pollInterval = 5
+
+## State of the throttle, shared by every worker thread ##
+throttleLock = threading.Condition()
+maxRate = None
+unitLimit = None
+maxUnits = None
+runningUnits = 0
+paused = False
+nextSendTime = 0.0
+monitorStop = threading.Event()
+monitorThread = None
+
+## Set the bandwidth and concurrency limits of the run ##
+def configureThrottle(rate=None,jobs=None):
+    global maxRate, unitLimit, maxUnits, runningUnits, paused, nextSendTime
+    with throttleLock:
+        maxRate = rate
+        maxUnits = unitLimit = jobs
+        runningUnits = 0
+        paused = False
+        nextSendTime = time.monotonic()
+        throttleLock.notify_all()
+
+
+## Wait until the bytes just read can be passed on without going over --max-rate ##
+def throttleBytes(nbytes):
+    global nextSendTime
+    if not maxRate and not paused:
+        return
+    with throttleLock:
+        while paused:
+            throttleLock.wait()
+        if not maxRate:
+            return
+        now = time.monotonic()
+        nextSendTime = max(nextSendTime, now)+nbytes/maxRate
+        wait = nextSendTime-now
+    if wait > 0:
+        time.sleep(wait)
+
+
+## File object passing every write through the rate limiter ##
+class ThrottledWriter:
+    def __init__(self,fout):
+        self.fout = fout
+
+    def write(self,data):
+        throttleBytes(len(data))
+        return self.fout.write(data)
+
+
+## Wait for a free slot before running a dump unit ##
+def acquireUnit():
+    global runningUnits
+    if unitLimit is None:
+        return
+    with throttleLock:
+        while paused or runningUnits >= unitLimit:
+            throttleLock.wait()
+        runningUnits += 1
+
+
+## Free the slot of a finished dump unit ##
+def releaseUnit():
+    global runningUnits
+    if unitLimit is None:
+        return
+    with throttleLock:
+        runningUnits = max(0, runningUnits-1)
+        throttleLock.notify_all()
+
+
+## Decide the concurrency from a health sample, returns the reason of a change ##
+def applyHealth(health,maxActive,maxLag):
+    global unitLimit, paused
+    overloads = []
+    severe = False
+    if maxActive and health.get('active') is not None and health['active'] > maxActive:
+        overloads.append('{} active {} > {}'.format(health['activeName'], health['active'], maxActive))
+        severe = severe or health['active'] > 2*maxActive
+    if maxLag and health.get('lag') is not None and health['lag'] > maxLag:
+        overloads.append('replication lag {:.0f}s > {}s'.format(health['lag'], maxLag))
+        severe = severe or health['lag'] > 2*maxLag
+
+    with throttleLock:
+        before = (paused, unitLimit)
+        if severe:
+            paused = True
+        elif overloads:
+            paused = False
+            unitLimit = max(1, unitLimit//2)
+        else:
+            paused = False
+            unitLimit = min(maxUnits, unitLimit+1)
+        throttleLock.notify_all()
+        after = (paused, unitLimit)
+
+    if before == after:
+        return None
+    reason = ', '.join(overloads) if overloads else 'server healthy'
+    if paused:
+        return '{}: pausing the dumps'.format(reason)
+    return '{}: concurrency {} -> {}{}'.format(reason, before[1], unitLimit, ', resuming the dumps' if before[0] else '')
+
+
+## Poll the server health until the run finishes ##
+def monitorHealth(connect,probe,maxActive,maxLag):
+    try:
+        conn, cursor = connect()
+    except Exception as error:
+        print('[throttle] Could not connect to monitor the server health ({}), the dumps run unthrottled by load.'.format(error))
+        return
+    try:
+        while not monitorStop.wait(pollInterval):
+            try:
+                health = probe(conn,cursor)
+            except Exception as error:
+                print('[throttle] Could not read the server health ({}), keeping the current limits.'.format(error))
+                continue
+            decision = applyHealth(health,maxActive,maxLag)
+            if decision:
+                print('[throttle] {} {}'.format(datetime.now().strftime('%H:%M:%S'), decision))
+    finally:
+        conn.close()
+
+
+## Start the throttle of a run, with a health monitor when a threshold is set ##
+def startThrottle(connect,probe,jobs=1,rate=None,maxActive=None,maxLag=None):
+    global monitorThread
+    configureThrottle(rate, max(1, int(jobs)))
+    if rate:
+        print('[throttle] Bandwidth limited to {:.2f} MB/s.'.format(rate/(1024**2)))
+    if maxActive or maxLag:
+        monitorStop.clear()
+        monitorThread = threading.Thread(target=monitorHealth, args=(connect,probe,maxActive,maxLag),
+                                         name='throttleMonitor', daemon=True)
+        monitorThread.start()
+
+
+## Stop the throttle of a run and lift every limit ##
+def stopThrottle():
+    global monitorThread
+    monitorStop.set()
+    if monitorThread is not None:
+        monitorThread.join()
+        monitorThread = None
+    configureThrottle()
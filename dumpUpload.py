@@ -0,0 +1,174 @@
+############################################################################################
+##          Streaming upload of the dumps to an S3-compatible object store (--upload):    ##
+##                                                                                        ##
+##  - The output of mysqldump/pg_dump (compressed on the fly with -c/--stream) is cut in  ##
+##    parts of partSize bytes uploaded by a multipart upload while the dump runs,         ##
+##    nothing is staged on the local drive;                                               ##
+##  - At most uploadThreads parts are uploaded at the same time, the dump waits for a     ##
+##    free slot before filling the next part, so the memory used by a file stays under    ##
+##    (uploadThreads+1) parts;                                                            ##
+##  - A dump that fails aborts its multipart upload, so no partial object is left behind; ##
+##  - The endpoint (--endpoint, e.g. a MinIO server) and the bucket/prefix come from the  ##
+##    command line, the credentials from the usual AWS environment variables or files,    ##
+##    never from the command line;                                                        ##
+##  - The run report, checksums and table index are uploaded next to the dump files.      ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import threading
+import os
+from dumpCompress import parallelCompress, compressedName, printSizes
+from dumpChecksum import HashingTee, addChecksum
+from dumpProcess import DumpProcess
+from dumpThrottle import throttleBytes
+
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+## Size of the uploaded parts (S3 needs at least 5 MB but for the last one) ##
+partSize = 16*1024**2
+
+## Parts of a file uploaded at the same time ##
+uploadThreads = 4
+
+## Bytes read from the dump pipe at a time ##
+readSize = 1024**2
+
+## Bucket, prefix and client of the run ##
+uploadTarget = {}
+
+## Set the bucket and prefix (s3://bucket/prefix) and the endpoint of the uploads ##
+def configureUpload(url,endpoint=None):
+    if boto3 is None:
+        raise RuntimeError('ERROR: The upload requires the boto3 package.')
+    if not url.startswith('s3://') or len(url) <= len('s3://'):
+        raise ValueError('ERROR: Invalid upload target "'+url+'", use s3://bucket/prefix.')
+    bucket, _, prefix = url[len('s3://'):].partition('/')
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+    uploadTarget.update({'bucket': bucket, 'prefix': prefix, 'endpoint': endpoint,
+                         'client': boto3.client('s3', endpoint_url=endpoint)})
+
+
+## Multipart upload written like a file, parts uploaded in the background ##
+class MultipartUpload:
+    def __init__(self,client,bucket,key,threads=None):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.threads = threads or uploadThreads
+        self.pool = ThreadPoolExecutor(max_workers=self.threads)
+        self.slots = threading.BoundedSemaphore(self.threads)
+        self.buffer = []
+        self.bufferSize = 0
+        self.uploadId = None
+        self.parts = []
+        self.bytes = 0
+
+    def write(self,data):
+        self.buffer.append(data)
+        self.bufferSize += len(data)
+        self.bytes += len(data)
+        if self.bufferSize >= partSize:
+            self.submitPart()
+        return len(data)
+
+    def submitPart(self):
+        body = b''.join(self.buffer)
+        self.buffer = []
+        self.bufferSize = 0
+        # Waits for a free slot: the dump is paced by the upload
+        self.slots.acquire()
+        for part in self.parts:
+            if part.done() and part.exception():
+                self.slots.release()
+                raise part.exception()
+        if self.uploadId is None:
+            self.uploadId = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+        self.parts.append(self.pool.submit(self.uploadPart, len(self.parts)+1, body))
+
+    def uploadPart(self,number,body):
+        try:
+            response = self.client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.uploadId,
+                                               PartNumber=number, Body=body)
+            return {'PartNumber': number, 'ETag': response['ETag']}
+        finally:
+            self.slots.release()
+
+    def close(self):
+        if self.uploadId is None:
+            # Smaller than a part: a single PUT
+            self.client.put_object(Bucket=self.bucket, Key=self.key, Body=b''.join(self.buffer))
+            self.pool.shutdown()
+            return
+        if self.bufferSize:
+            self.submitPart()
+        parts = [part.result() for part in self.parts]
+        self.pool.shutdown()
+        self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.uploadId,
+                                              MultipartUpload={'Parts': parts})
+
+    def abort(self):
+        for part in self.parts:
+            part.cancel()
+        self.pool.shutdown()
+        if self.uploadId is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.uploadId)
+
+
+## Key of a file in the bucket ##
+def objectKey(filename):
+    return uploadTarget['prefix']+filename
+
+
+## Run a dump command and upload its output (compressed if asked) while it runs ##
+def uploadDump(command,filename,compressed=False,codec='gzip',level=None):
+    if compressed:
+        filename = compressedName(filename,codec)
+    startTime = datetime.now()
+    upload = MultipartUpload(uploadTarget['client'],uploadTarget['bucket'],objectKey(filename))
+    tee = HashingTee(upload)
+
+    try:
+        with DumpProcess(command) as process:
+            if compressed:
+                rawBytes = parallelCompress(process, tee, codec, level, throttle=True)
+            else:
+                rawBytes = 0
+                while True:
+                    block = process.read(readSize)
+                    if not block:
+                        break
+                    tee.write(block)
+                    rawBytes += len(block)
+                    throttleBytes(len(block))
+    except BaseException:
+        upload.abort()
+        raise
+    exitCode = process.exitCode
+
+    if exitCode == 0:
+        try:
+            upload.close()
+        except BaseException:
+            upload.abort()
+            raise
+        addChecksum(filename,tee)
+        print('{} uploaded to s3://{}/{}.'.format(filename, uploadTarget['bucket'], objectKey(filename)))
+    else:
+        upload.abort()
+    printSizes(rawBytes, tee.bytes, datetime.now()-startTime)
+    return exitCode
+
+
+## Upload the small files of a run (report, checksums, table index) next to its dumps ##
+def uploadRunFiles(path,name):
+    for filename in (name+'_report.json', name+'_checksums.json', name+'_index.json'):
+        if os.path.exists(path+filename):
+            with open(path+filename,'rb') as fin:
+                uploadTarget['client'].put_object(Bucket=uploadTarget['bucket'], Key=objectKey(filename), Body=fin.read())
@@ -0,0 +1,169 @@
+############################################################################################
+##               Script to verify dump files against their checksum manifest:             ##
+##                                                                                        ##
+## Script calling example:                                                                ##
+##  - python dumpVerify.py -m c:\MySQLDump\DBName_checksums.json                          ##
+##  - python dumpVerify.py -m c:\pgDump\DBName_checksums.json --rows -h localhost         ##
+##    -db DBName -u postgres -ev postgresDBPass                                           ##
+##                                                                                        ##
+## Arguments Explanation:                                                                 ##
+##                                                                                        ##
+##  - (-m): Checksum manifest (<DB>_checksums.json) written by mysqlDump.py/postgresDump  ##
+##  - (--quick): Only check that every file exists with its size, without reading it      ##
+##    (Optional)                                                                          ##
+##  - (--rows): Also count the rows of every table in the live database and compare them  ##
+##    with the manifest (Optional, needs -h, -db, -u and -ev)                             ##
+##  - (-h): Hostname                                                                      ##
+##  - (-db): Database name                                                                ##
+##  - (-u): Database user                                                                 ##
+##  - (-ev): Name of environment variable set with Database password for the given user   ##
+##                                                                                        ##
+##  - Exact row counts (native exports) must match, catalog estimates may differ by       ##
+##    rowTolerance; the dump is never run again.                                          ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from datetime import datetime
+import json
+import sys
+import os
+from dumpChecksum import fileChecksum
+
+## Global Flags ##
+manifestFile = None
+quickFlag = False
+rowsFlag = False
+
+## Relative difference allowed between a catalog row estimate and the live count ##
+rowTolerance = 0.1
+
+## Size of a dump file, or of every file of a dump folder (pg_dump directory format) ##
+def dumpSize(filePath):
+    if os.path.isdir(filePath):
+        return sum(os.stat(os.path.join(filePath, name)).st_size for name in os.listdir(filePath))
+    return os.stat(filePath).st_size
+
+
+## Check every file (or folder, hashed like dumpChecksum does) of the manifest, returns the number of failures ##
+def verifyFiles(path,manifest):
+    failures = 0
+    for filename, entry in sorted(manifest['files'].items()):
+        filePath = path+filename
+        if not os.path.exists(filePath):
+            status = 'MISSING'
+        elif dumpSize(filePath) != entry['bytes']:
+            status = 'SIZE MISMATCH ({} bytes, expected {})'.format(dumpSize(filePath), entry['bytes'])
+        elif quickFlag:
+            status = 'OK (size)'
+        else:
+            # A file recorded with another hash (e.g. resumed from the journal) is checked with it
+            algorithm = manifest['algorithm'] if manifest['algorithm'] in entry else 'sha256'
+            size, digest = fileChecksum(filePath, algorithm)
+            status = 'OK' if digest == entry[algorithm] else 'CHECKSUM MISMATCH'
+        if not status.startswith('OK'):
+            failures += 1
+        print('{}: {}'.format(filename, status))
+    return failures
+
+
+## Count the rows of a table in the live database ##
+def countRows(engine,cursor,DBName,tableName):
+    if engine == 'mysql':
+        cursor.execute('SELECT COUNT(*) FROM `'+DBName.replace('`','``')+'`.`'+tableName.replace('`','``')+'`')
+    else:
+        cursor.execute('SELECT count(*) FROM public."'+tableName.replace('"','""')+'"')
+    return cursor.fetchall()[0][0]
+
+
+## Compare the row counts of the manifest with the live database, returns the number of failures ##
+def verifyRows(manifest,host,DBName,user,password):
+    if manifest['engine'] == 'mysql':
+        from mysqlDump import DBConnect
+    else:
+        from postgresDump import DBConnect
+    conn, cursor = DBConnect(host=host,database=DBName,user=user,password=password)
+
+    failures = 0
+    try:
+        for tableName, entry in sorted(manifest['tables'].items()):
+            liveRows = countRows(manifest['engine'],cursor,DBName,tableName)
+            dumpedRows = entry.get('rows') or 0
+            if entry.get('exact'):
+                matches = liveRows == dumpedRows
+            else:
+                matches = abs(liveRows-dumpedRows) <= rowTolerance*max(liveRows, dumpedRows)
+            if not matches:
+                failures += 1
+            print('{}: {} {} row(s), {} live row(s){}'.format(tableName, 'exported' if entry.get('exact') else 'estimated',
+                                                            dumpedRows, liveRows, '' if matches else ' MISMATCH'))
+    finally:
+        conn.close()
+    return failures
+
+
+## Verify the files (and rows) of a checksum manifest ##
+def verify(manifestFile,**kwargs):
+    with open(manifestFile) as fin:
+        manifest = json.load(fin)
+    path = os.path.dirname(os.path.abspath(manifestFile))+os.sep
+
+    print('Verifying {} file(s) of {} ({}).'.format(len(manifest['files']), manifest['database'], 'sizes only' if quickFlag else manifest['algorithm']))
+    failures = verifyFiles(path,manifest)
+    if rowsFlag:
+        failures += verifyRows(manifest,kwargs.get('host'),kwargs.get('DBName'),kwargs.get('user'),kwargs.get('password'))
+    print('{} failure(s).'.format(failures))
+    return failures == 0
+
+
+## Get initial arguments and set flags ##
+def getArguments():
+    global manifestFile
+    if '-m' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '-m':
+                manifestFile = sys.argv[idx+1]
+                break
+            else:
+                idx += 1
+
+    global quickFlag
+    if '--quick' in sys.argv:
+        quickFlag = True
+
+    global rowsFlag
+    if '--rows' in sys.argv:
+        rowsFlag = True
+
+    arguments = {}
+    for flag, name in (('-h', 'host'), ('-db', 'DBName'), ('-u', 'user'), ('-ev', 'environPassword')):
+        if flag in sys.argv:
+            idx = 0
+            for entry in sys.argv:
+                if entry == flag:
+                    arguments[name] = sys.argv[idx+1]
+                    break
+                else:
+                    idx += 1
+
+    if not manifestFile:
+        raise ValueError('Checksum manifest argument (-m) missing.')
+    if rowsFlag and not all(name in arguments for name in ('host', 'DBName', 'user', 'environPassword')):
+        raise ValueError('--rows needs the -h, -db, -u and -ev arguments.')
+    return manifestFile, arguments
+
+
+### Main ###
+if __name__ == '__main__':
+    executionTime = datetime.now()
+    manifestFile, arguments = getArguments()
+
+    if verify(manifestFile,host=arguments.get('host'),DBName=arguments.get('DBName'),user=arguments.get('user'),
+              password=os.getenv(arguments.get('environPassword') or '')):
+        print('Verification passed.')
+        print('Execution time: {}'.format(datetime.now()-executionTime))
+    else:
+        print('Verification failed.')
+        print('Execution time: {}'.format(datetime.now()-executionTime))
+        sys.exit(1)
@@ -14,10 +14,62 @@
 ##                                                                                        ##
 ##  - (-t): Dump table by table of Database (Optional)                                    ##
 ##  - (-c): Compress the dump result (Optional, takes more time to complete)              ##
+##  - (--stream): Compress the dump output while it is dumped, without staging the .sql   ##
+##    on disk (Optional)                                                                  ##
+##  - (--codec): Compression codec: gzip (default), zstd or lz4 (Optional)                ##
+##  - (--level): Compression level of the chosen codec (Optional)                         ##
 ##  - (-h): Hostname                                                                      ##
 ##  - (-db): Database name                                                                ##
 ##  - (-u): Database user                                                                 ##
 ##  - (-ev): Name of environment variable set with Database password for the given user   ##
+##  - (--jobs N): Number of tables dumped at the same time in -t mode (Optional, def. 1)  ##
+##  - (--incremental): In -t mode, only dump the tables changed since the last run        ##
+##    (Optional)                                                                          ##
+##  - (--bin-size MB): In -t mode, pack the tables smaller than MB in bins dumped by a    ##
+##    single mysqldump each, a <DB>_index.json maps every table to its file (Optional)    ##
+##  - (--prometheus FILE): Also write the run report as a Prometheus textfile (Optional)  ##
+##  - (--native): Export the database in-process, without mysqldump.exe, splitting large  ##
+##    tables in primary key ranges exported by --jobs N connections, the BLOB columns of  ##
+##    the tables with heavy rows streamed to .lob side files (Optional)                   ##
+##  - (--tsv): With --native, write LOAD DATA compatible TSV instead of INSERTs (Optional)##
+##  - (--resume): In -t mode, skip the tables already dumped by the interrupted last run, ##
+##    read from its <DB>_journal.json checkpoint journal (Optional)                       ##
+##  - (--retries N): Dump a failed table again up to N times, with backoff (Optional)     ##
+##  - (--max-rate MB): Limit the bytes read from the server to MB per second (--stream    ##
+##    and --native only, Optional)                                                        ##
+##  - (--max-active N): Halve the tables dumped at the same time while Threads_running is ##
+##    above N, pause the dumps above 2N (Optional)                                        ##
+##  - (--max-lag S): Same as --max-active, for a replica lag above S seconds (Optional)   ##
+##  - (--consistent): In -t mode, export the tables in-process (as --native) on           ##
+##    connections sharing one snapshot, opened under a brief global read lock (Optional)  ##
+##  - (--hash H): Hash of the checksums computed while the files are written: sha256      ##
+##    (default) or xxhash, saved in <DB>_checksums.json, see dumpVerify.py (Optional)     ##
+##  - (--archive): Without -t, write <DB>.dumparc, each table compressed in independent   ##
+##    frames with a trailing index, see dumpArchive.py --table (Optional)                 ##
+##  - (--repository): Store the mysqldump output in c:\MySQLDump\repository as            ##
+##    compressed content-defined chunks, each stored once across runs, with a run         ##
+##    manifest, see dumpChunkStore.py --gc/--restore (Optional, not with --incremental)   ##
+##  - (--upload URL): Upload the mysqldump output to s3://bucket/prefix while it is       ##
+##    dumped, in parallel multipart parts, instead of writing it to c:\MySQLDump; -c and  ##
+##    --stream compress it on the fly (Optional, needs boto3, AWS credentials from the    ##
+##    environment)                                                                        ##
+##  - (--endpoint URL): Endpoint of an S3-compatible store, e.g. MinIO (Optional)         ##
+##  - (--columnar F): Export every table in-process to parquet (or arrow IPC) files typed ##
+##    from the catalog, compressed with --codec, on --jobs N connections sharing one      ##
+##    snapshot, listed in <DB>_columnar.json (Optional, needs pyarrow)                    ##
+##  - (--schema-cache): In -t mode, dump the tables without their CREATE TABLE and the    ##
+##    schema apart, only when a definition hashed from the catalog changed since the      ##
+##    last run, the changes saved in <DB>_schema_diff.json (Optional)                     ##
+##  - (--subset SPEC): Dump to <DB>_subset.sql only the rows reached from the roots       ##
+##    ("orders WHERE created_at > ...", "orders 5%" or "orders", repeatable) and the      ##
+##    rows they need over the foreign keys, in one snapshot (Optional, not with -t)       ##
+##  - (--timeout MIN / --stall MIN): Kill a mysqldump/mysql run longer than MIN minutes,  ##
+##    or whose pipes stayed idle for MIN minutes (Optional)                               ##
+##  - (--fail-fast): Cancel the run when a unit fails: the running dumps are killed and   ##
+##    the units not started yet are skipped (Optional)                                    ##
+##  - (--restore): Load the -t dump files (or the --native export) of c:\MySQLDump back   ##
+##    into the -db database, --jobs N files at the same time, the secondary keys and      ##
+##    foreign keys built after the data (Optional)                                        ##
 ##                                                                                        ##
 ##  Dump File(s) Location(s) and created folders:                                         ##
 ##                                                                                        ##
@@ -40,18 +92,58 @@
 
 ## Imports ##
 import sys
-import pandas as pd
 import mysql
 from mysql.connector import (connection)
 from mysql.connector import errorcode
 import os
-import gzip
-import shutil
 from datetime import datetime
+from dumpScheduler import runParallel, allSucceeded
+from dumpReport import startRun, finishRun, recordMetrics, writeReport, writePrometheus, printSummary
+from dumpCompress import compress, streamCompress, compressedName
+from dumpManifest import loadManifest, saveManifest, splitUnchanged, updateManifest, saveTableIndex
+from mysqlExport import exportDB, restoreExport, exportManifestPath
+from dumpPlanner import queryMysqlTables, makePlan, packBins, unpackResults
+from dumpJournal import openJournal, splitFinished, runJournaled, finishJournal
+from dumpThrottle import startThrottle, stopThrottle
+from dumpArchive import streamArchive
+from dumpRestore import restoreMysql
+from dumpChunkStore import startRepository, storeDump, saveRunManifest
+from dumpUpload import configureUpload, uploadDump, uploadRunFiles
+from dumpColumnar import exportColumnar, columnarManifestPath, columnarFormats, columnarCodecs
+from dumpSchema import querySchemaHashes, planSchema, schemaChangedTables, startSchemaDump, finishSchema, dataOnlyFingerprints
+from dumpSubset import dumpSubset, subsetManifestPath
+from dumpProcess import configureProcesses
+from dumpChecksum import streamDump, startChecksums, saveChecksums, setHashAlgorithm, exportedTables, plannedTables
 
 ## Global Flags ##
 compressFlag = False
+streamFlag = False
+codec = 'gzip'
+level = None
 environPassword = 'MySQLDBPass'
+jobs = 1
+incrementalFlag = False
+binSize = None
+prometheusFile = None
+nativeFlag = False
+tsvFlag = False
+resumeFlag = False
+retries = 0
+maxRate = None
+maxActive = None
+maxLag = None
+consistentFlag = False
+archiveFlag = False
+restoreFlag = False
+repositoryFlag = False
+uploadUrl = None
+columnarFormat = None
+schemaCacheFlag = False
+subsetRoots = []
+timeoutMinutes = None
+stallMinutes = None
+failFastFlag = False
+endpoint = None
 
 ## Connect to Postgres DB
 def DBConnect(**kwargs):
@@ -98,25 +190,89 @@ def DBConnect(**kwargs):
         return conn, cursor
 
 
-## List all table names ##
+## Read the catalog of the tables to dump ##
+def queryTables(conn,cursor,DBName):
+    try:
+        tables = queryMysqlTables(cursor,DBName)
+    except:
+        conn.rollback()
+        raise RuntimeError('ERROR: Error in SQL execution while quering the table catalog.')
+    else:
+        conn.commit()
+        return tables
+
+
+## Hash the definition of every object of the schema ##
+def querySchema(conn,cursor,DBName):
+    try:
+        hashes = querySchemaHashes('mysql',cursor,DBName)
+    except:
+        conn.rollback()
+        raise RuntimeError('ERROR: Error in SQL execution while quering the schema catalog.')
+    else:
+        conn.commit()
+        return hashes
+
+
+## List all table names and sizes (pandas is only loaded when this is called) ##
 def queryTableList(conn,cursor,DBName):
-    query = ("SELECT table_name FROM information_schema.tables "
-            "WHERE (table_schema = '"+DBName+"') "
-            "ORDER BY table_name")
-    
+    import pandas as pd
+    try:
+        tables = queryTables(conn,cursor,DBName)
+    except RuntimeError:
+        return 'Error in SQL execution while quering tableList'
+    return pd.DataFrame([[table.name, table.size] for table in tables], columns=['Table Name','Size'])
+
+
+## Get the fingerprint of each table, changed whenever the table data changes ##
+def queryTableFingerprints(conn,cursor,DBName):
+    query = ("SELECT table_name, create_time, update_time FROM information_schema.tables "
+            "WHERE (table_schema = '"+DBName+"') AND (table_type = 'BASE TABLE')")
+
     try:
         cursor.execute(query)
-        try:
-            tableList = pd.DataFrame(cursor.fetchall())
-            tableList.columns = ['Table Name']
-        except:
-            tableList = None
+        fingerprints = {}
+        noUpdateTime = []
+        for tableName, createTime, updateTime in cursor.fetchall():
+            if updateTime:
+                fingerprints[tableName] = 'created {} updated {}'.format(createTime, updateTime)
+            else:
+                # UPDATE_TIME is not kept by every engine/server restart, use the checksum instead
+                noUpdateTime.append(tableName)
+                fingerprints[tableName] = createTime
+
+        if noUpdateTime:
+            cursor.execute('CHECKSUM TABLE '+', '.join('`'+DBName+'`.`'+tableName+'`' for tableName in noUpdateTime))
+            for fullName, checksum in cursor.fetchall():
+                tableName = fullName.split('.',1)[1]
+                if checksum is None:
+                    fingerprints[tableName] = None
+                else:
+                    fingerprints[tableName] = 'created {} checksum {}'.format(fingerprints[tableName], checksum)
     except:
         conn.rollback()
-        return 'Error in SQL execution while quering tableList'
+        raise RuntimeError('ERROR: Error in SQL execution while quering the table fingerprints.')
     else:
         conn.commit()
-        return tableList
+        return fingerprints
+
+
+## Read the server load: running threads and replica lag ##
+def queryServerHealth(conn,cursor):
+    cursor.execute("SHOW GLOBAL STATUS LIKE 'Threads_running'")
+    # The thread running this query is not counted
+    active = int(cursor.fetchall()[0][1])-1
+    try:
+        cursor.execute('SHOW REPLICA STATUS')
+    except mysql.connector.Error:
+        # Servers older than MySQL 8.0.22
+        cursor.execute('SHOW SLAVE STATUS')
+    rows = cursor.fetchall()
+    lag = None
+    if rows:
+        status = dict(zip([column[0] for column in cursor.description], rows[0]))
+        lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+    return {'activeName': 'Threads_running', 'active': active, 'lag': lag}
 
 
 ## Set/Create pgpass.conf ##
@@ -148,32 +304,84 @@ def clearMycnf():
         return None
 
 
-## Compress data ##
-def compress(path,filename):
-    compressedFile = filename+'.tar.gz'
-    compressedFile = compressedFile.replace('.sql','')
+## Command of a MySQL client tool, run without a shell ##
+def mysqlCommand(tool,path):
+    return [tool, '--defaults-file='+os.path.join(path,'my.cnf'), '--default-character-set=utf8', '--protocol=tcp']
 
-    with open(path+filename, "rb") as fin, gzip.open(path+compressedFile, "wb") as fout:
-        # Reads the file by chunks to avoid exhausting memory
-        shutil.copyfileobj(fin, fout)
-    
-    ## File Sizes in MB
-    uncompressedSize = os.stat(path+filename).st_size/(1024**2)
-    compressedSize = os.stat(path+compressedFile).st_size/(1024**2)
+## Run a dump command and write or compress its output ##
+def runDump(mysqldump,path,filename):
+    if repositoryFlag:
+        return storeDump(mysqldump,path,filename)
+    if uploadUrl:
+        return uploadDump(mysqldump,filename,streamFlag or compressFlag,codec,level)
+    if streamFlag:
+        return streamCompress(mysqldump,path,filename,codec,level)
+
+    # The output is hashed while it is written
+    exitCode = streamDump(mysqldump,path,filename)
+    if exitCode == 0 and compressFlag:
+        compress(path=path,filename=filename,codec=codec,level=level)
+    elif exitCode == 0:
+        recordMetrics(rawBytes=os.stat(path+filename).st_size)
+    return exitCode
+
+## Name of the file written by a dump ##
+def dumpFileName(filename):
+    if repositoryFlag:
+        return filename
+    if streamFlag or compressFlag:
+        return compressedName(filename,codec)
+    return filename
 
-    print("Uncompressed size: {0:.2f} Mb".format(uncompressedSize))
-    print("Compressed size: {0:.2f} Mb".format(compressedSize))
+## Name of the file of a table or bin, bins are named after the run so older bins are never overwritten ##
+def unitFileName(DBName,unit,runId):
+    if 'tables' in unit:
+        return DBName+'_bin_'+runId+'_'+str(unit['bin'])+'.sql'
+    return DBName+'_tb_'+unit['name']+'.sql'
+
+## Dump a table, or a bin of tables with a single mysqldump ##
+def dumpTables(path,DBName,tableNames,filename):
+    mysqldump = mysqlCommand('mysqldump',path)+['--column-statistics=0', '--skip-triggers']
+    if schemaCacheFlag:
+        # The tables are created by the schema file
+        mysqldump += ['--no-create-info']
+    mysqldump += [DBName]+list(tableNames)
+    return runDump(mysqldump,'c:\\MySQLDump\\',filename)
+
+## Dump the schema alone: tables, views, routines and events ##
+def dumpSchemaFile(path,DBName,filename):
+    mysqldump = mysqlCommand('mysqldump',path)+['--column-statistics=0', '--skip-triggers', '--no-data', '--routines', '--events', DBName]
+    return runDump(mysqldump,'c:\\MySQLDump\\',filename)
+
+## Write the run report ##
+def saveReport(name,success):
+    report = finishRun(name,success)
+    writeReport(report,'c:\\MySQLDump\\'+name+'_report.json')
+    if prometheusFile:
+        writePrometheus(report,prometheusFile)
+    printSummary(report)
 
 ## Backup MySQL DB ##
 def backupDB(host,DBName,user,password,**kwargs):
     global compressFlag
+    success = True
+    startRun()
+    startChecksums()
+    if repositoryFlag:
+        startRepository('c:\\MySQLDump\\',DBName,codec,level)
     if 'mode' in kwargs:
         mode = kwargs.get('mode')
         if mode == 'byTable':
             ## Connect ##
             conn, cursor = DBConnect(user= user,database=DBName,password=password,host=host)
             ## Get table list in DB ##
-            tableList = queryTableList(conn, cursor,DBName=DBName)
+            tables = queryTables(conn, cursor,DBName=DBName)
+            if incrementalFlag:
+                fingerprints = queryTableFingerprints(conn, cursor,DBName=DBName)
+                if schemaCacheFlag:
+                    fingerprints = dataOnlyFingerprints(fingerprints)
+            if schemaCacheFlag:
+                schemaHashes = querySchema(conn, cursor,DBName=DBName)
             conn.close()
     else:
         mode="all"
@@ -182,30 +390,129 @@ def backupDB(host,DBName,user,password,**kwargs):
         if setMycnf(host,user,password):
             if not os.path.isdir('c:\MySQLDump\\'):
                 os.mkdir('c:\MySQLDump\\')
-            if mode == 'all':
+            if maxRate or maxActive or maxLag:
+                startThrottle(lambda: DBConnect(user= user,database=DBName,password=password,host=host),queryServerHealth,
+                              jobs=jobs,rate=maxRate,maxActive=maxActive,maxLag=maxLag)
+            if subsetRoots:
+                results = runParallel([{'name': DBName}], lambda unit: dumpSubset(lambda: DBConnect(user= user,database=DBName,password=password,host=host),DBName,'c:\\MySQLDump\\','mysql',subsetRoots,
+                                      codec=codec if compressFlag or streamFlag else None,level=level), unitName='subset')
+                success = allSucceeded(results)
+                checksumTables = exportedTables(subsetManifestPath('c:\\MySQLDump\\',DBName))
+            elif columnarFormat:
+                success = exportColumnar(lambda: DBConnect(user= user,database=DBName,password=password,host=host),DBName,'c:\\MySQLDump\\','mysql',
+                                         jobs=jobs,columnarFormat=columnarFormat,codec=codec)
+                checksumTables = exportedTables(columnarManifestPath('c:\\MySQLDump\\',DBName))
+            elif mode == 'byTable' and consistentFlag:
+                # Separate mysqldump processes cannot share a snapshot, the worker connections of the native exporter can
+                print('Dumping the tables of {} in-process on one shared snapshot (--consistent).'.format(DBName))
+                success = exportDB(lambda: DBConnect(user= user,database=DBName,password=password,host=host),DBName,'c:\\MySQLDump\\',jobs=jobs,tsv=tsvFlag)
+                checksumTables = exportedTables('c:\\MySQLDump\\'+DBName+'_export.json')
+            elif mode == 'all' and nativeFlag:
+                success = exportDB(lambda: DBConnect(user= user,database=DBName,password=password,host=host),DBName,'c:\\MySQLDump\\',jobs=jobs,tsv=tsvFlag)
+                checksumTables = exportedTables('c:\\MySQLDump\\'+DBName+'_export.json')
+            elif mode == 'all' and archiveFlag:
                 path=os.getcwd()
-                mysqldump = 'mysqldump.exe --defaults-file="'+path+'\my.cnf" --default-character-set=utf8 --protocol=tcp --column-statistics=0 --skip-triggers "'+DBName+'" > c:\MySQLDump\\'+DBName+'.sql'
-                os.system('"cmd.exe"' and mysqldump)
-
-                if compressFlag:
-                    compress(path='c:\MySQLDump\\',filename=DBName+'.sql')
+                mysqldump = mysqlCommand('mysqldump',path)+['--column-statistics=0', '--skip-triggers', DBName]
+                results = runParallel([{'name': DBName}], lambda unit: streamArchive(mysqldump,'c:\\MySQLDump\\',DBName,'mysql',codec,level,database=DBName), unitName='database', retries=retries)
+                success = allSucceeded(results)
+                checksumTables = {}
+            elif mode == 'all':
+                path=os.getcwd()
+                mysqldump = mysqlCommand('mysqldump',path)+['--column-statistics=0', '--skip-triggers', DBName]
+                results = runParallel([{'name': DBName}], lambda unit: runDump(mysqldump,'c:\MySQLDump\\',DBName+'.sql'), unitName='database', retries=retries)
+                success = allSucceeded(results)
+                checksumTables = {}
             elif mode ==  'byTable':
-                for idx in tableList.index:
-                    path=os.getcwd()
-                    mysqldump = 'mysqldump.exe --defaults-file="'+path+'\my.cnf" --default-character-set=utf8 --protocol=tcp --column-statistics=0 --skip-triggers "'+DBName+'" "'+tableList.iloc[idx][0]+'"> c:\MySQLDump\\'+DBName+'_tb_'+tableList.iloc[idx][0]+'.sql'
-                    os.system('"cmd.exe"' and mysqldump)
-                    if compressFlag:
-                        compress(path='c:\MySQLDump\\',filename=DBName+'_tb_'+tableList.iloc[idx][0]+'.sql')
+                path=os.getcwd()
+                runId = datetime.now().strftime('%Y%m%d%H%M%S')
+                units = makePlan(tables)
+                for unit in units:
+                    unit['file'] = dumpFileName(unitFileName(DBName,unit,runId))
+                schema = None
+                if schemaCacheFlag:
+                    schema = planSchema('c:\\MySQLDump\\',DBName,schemaHashes,dumpFileName(DBName+'_schema_'+runId+'.sql'))
+                if incrementalFlag:
+                    manifest = loadManifest('c:\\MySQLDump\\',DBName)
+                    # The data-only files of the tables the schema changed would not load into it
+                    units, unchanged = splitUnchanged(manifest,units,fingerprints,'c:\\MySQLDump\\',
+                                                      schemaChangedTables(schema,fingerprints) if schema else ())
+                journal = openJournal('c:\\MySQLDump\\',DBName,resume=resumeFlag)
+                finished = []
+                if resumeFlag:
+                    units, finished = splitFinished(journal,units,'c:\\MySQLDump\\')
+                if binSize:
+                    units = packBins(units,binSize)
+                    for unit in units:
+                        unit['file'] = dumpFileName(unitFileName(DBName,unit,runId))
+                if schema:
+                    # The schema dump runs alongside the table dumps, it shares no snapshot with them and is checked after them
+                    schemaJob = startSchemaDump(schema,lambda: dumpSchemaFile(path,DBName,DBName+'_schema_'+runId+'.sql'),retries)
+                results = runParallel(units, lambda unit: runJournaled('c:\\MySQLDump\\',journal,unit,
+                                      lambda: dumpTables(path,DBName,unit.get('tables',[unit['name']]),unitFileName(DBName,unit,runId))),
+                                      jobs=jobs, retries=retries)
+                success = allSucceeded(results)
+                if schema:
+                    # The schema dump ends before the catalog is read again
+                    if schemaJob:
+                        schemaJob.result()
+                    conn, cursor = DBConnect(user= user,database=DBName,password=password,host=host)
+                    schemaHashes = querySchema(conn, cursor,DBName=DBName)
+                    conn.close()
+                    success = finishSchema('c:\\MySQLDump\\',DBName,schema,schemaJob,schemaHashes) and success
+                finishJournal('c:\\MySQLDump\\',journal,success)
+                units, results = unpackResults(units,results)
+                # Tables dumped by the interrupted run count as dumped by this one
+                units += finished
+                results += [{'name': unit['name'], 'success': True} for unit in finished]
+                if incrementalFlag:
+                    saveManifest('c:\\MySQLDump\\',DBName,updateManifest(manifest,units,results,fingerprints))
+                    saveTableIndex('c:\\MySQLDump\\',DBName,{name: entry['file'] for name, entry in manifest['tables'].items()},schema and schema['file'])
+                else:
+                    saveTableIndex('c:\\MySQLDump\\',DBName,{unit['name']: unit['file'] for unit in units},schema and schema['file'])
+                checksumTables = plannedTables(units)
             else:
                 raise ValueError('ERROR: Invalid mode provided in backupDB function.')
         else:
             raise RuntimeError('ERROR: We could not Set/Create the my.cnf, review the code.')
+        stopThrottle()
+        if repositoryFlag:
+            # The files only exist as chunks, the run manifest holds their checksums
+            saveRunManifest()
+        else:
+            saveChecksums('c:\\MySQLDump\\',DBName,checksumTables,'mysql')
+        saveReport(DBName,success)
+        if uploadUrl:
+            uploadRunFiles('c:\\MySQLDump\\',DBName)
         if clearMycnf():
-            return True
+            return success
         else:
             raise RuntimeError('ERROR: We could not clear the my.cnf content, review the code.')
-    except:
-        raise RuntimeError('ERROR: We could not proced with the backup process, review the code.')
+    except Exception as error:
+        stopThrottle()
+        clearMycnf()
+        raise RuntimeError('ERROR: We could not proced with the backup process, review the code. ({})'.format(error)) from error
+
+## Restore a native export or the per-table dump files ##
+def restoreDB(host,DBName,user,password,**kwargs):
+    startRun()
+    try:
+        if setMycnf(host,user,password):
+            path=os.getcwd()
+            mysql = mysqlCommand('mysql',path)+[DBName]
+            if os.path.exists(exportManifestPath('c:\\MySQLDump\\',DBName)):
+                success = restoreExport(lambda: DBConnect(user= user,database=DBName,password=password,host=host),mysql,DBName,'c:\\MySQLDump\\',jobs=jobs)
+            else:
+                success = restoreMysql(mysql,'c:\\MySQLDump\\',DBName,jobs=jobs)
+        else:
+            raise RuntimeError('ERROR: We could not Set/Create the my.cnf, review the code.')
+        saveReport(DBName+'_restore',success)
+        if clearMycnf():
+            return success
+        else:
+            raise RuntimeError('ERROR: We could not clear the my.cnf content, review the code.')
+    except Exception as error:
+        clearMycnf()
+        raise RuntimeError('ERROR: We could not proced with the restore process, review the code. ({})'.format(error)) from error
 
 ## Get initial arguments and set flags ##
 def getArguments():
@@ -231,6 +538,229 @@ def getArguments():
     if '-c' in sys.argv:
         compressFlag = True
 
+    # Stream the dump output into the compressor
+    global streamFlag
+    if '--stream' in sys.argv:
+        streamFlag = True
+
+    # Compression codec and level
+    global codec
+    if '--codec' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--codec':
+                codec = sys.argv[idx+1]
+                break
+            else:
+                idx += 1
+
+    global level
+    if '--level' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--level':
+                level = int(sys.argv[idx+1])
+                break
+            else:
+                idx += 1
+
+    # Native export
+    global nativeFlag
+    if '--native' in sys.argv:
+        nativeFlag = True
+
+    global tsvFlag
+    if '--tsv' in sys.argv:
+        tsvFlag = True
+
+    # Resume the interrupted last run
+    global resumeFlag
+    if '--resume' in sys.argv:
+        resumeFlag = True
+
+    # Retries of a failed dump unit
+    global retries
+    if '--retries' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--retries':
+                retries = int(sys.argv[idx+1])
+                break
+            else:
+                idx += 1
+
+    # Throttling
+    global maxRate
+    if '--max-rate' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--max-rate':
+                maxRate = float(sys.argv[idx+1])*1024**2
+                break
+            else:
+                idx += 1
+
+    global maxActive
+    if '--max-active' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--max-active':
+                maxActive = int(sys.argv[idx+1])
+                break
+            else:
+                idx += 1
+
+    global maxLag
+    if '--max-lag' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--max-lag':
+                maxLag = float(sys.argv[idx+1])
+                break
+            else:
+                idx += 1
+
+    # Share one snapshot between the parallel dumps
+    global consistentFlag
+    if '--consistent' in sys.argv:
+        consistentFlag = True
+
+    # Seekable archive of the whole dump
+    global archiveFlag
+    if '--archive' in sys.argv:
+        archiveFlag = True
+
+    # Restore the per-table dump files
+    global restoreFlag
+    if '--restore' in sys.argv:
+        restoreFlag = True
+
+    # Hash of the in-flight checksums
+    if '--hash' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--hash':
+                setHashAlgorithm(sys.argv[idx+1])
+                break
+            else:
+                idx += 1
+
+    # Only dump the tables changed since the last run
+    global incrementalFlag
+    if '--incremental' in sys.argv:
+        incrementalFlag = True
+
+    # Deduplicated chunk repository
+    global repositoryFlag
+    if '--repository' in sys.argv:
+        if incrementalFlag:
+            raise ValueError('--repository already stores the unchanged tables once, it can not be used with --incremental.')
+        if nativeFlag or archiveFlag or consistentFlag:
+            raise ValueError('--repository stores the mysqldump output, it can not be used with --native, --consistent or --archive.')
+        repositoryFlag = True
+
+    # Data-only table dumps, the schema dumped when it changed
+    global schemaCacheFlag
+    if '--schema-cache' in sys.argv:
+        if mode != 'byTable':
+            raise ValueError('--schema-cache only applies to the -t mode.')
+        if nativeFlag or archiveFlag or consistentFlag or repositoryFlag:
+            raise ValueError('--schema-cache keeps the schema file on disk, it can not be used with --native, --consistent, --archive or --repository.')
+        schemaCacheFlag = True
+
+    # Streaming upload to an S3-compatible store
+    global endpoint
+    if '--endpoint' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--endpoint':
+                endpoint = sys.argv[idx+1]
+                break
+            else:
+                idx += 1
+
+    global uploadUrl
+    if '--upload' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--upload':
+                uploadUrl = sys.argv[idx+1]
+                break
+            else:
+                idx += 1
+        if nativeFlag or archiveFlag or consistentFlag or repositoryFlag or schemaCacheFlag:
+            raise ValueError('--upload streams the mysqldump output, it can not be used with --native, --consistent, --archive, --repository or --schema-cache.')
+        if incrementalFlag or resumeFlag:
+            # Both look for the files of the last run on the local drive
+            raise ValueError('--upload keeps no local file, it can not be used with --incremental or --resume.')
+        configureUpload(uploadUrl,endpoint)
+
+    # Columnar export
+    global columnarFormat
+    if '--columnar' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--columnar':
+                columnarFormat = sys.argv[idx+1]
+                break
+            else:
+                idx += 1
+        if columnarFormat not in columnarFormats:
+            raise ValueError('Invalid columnar format, use one of: '+', '.join(columnarFormats)+'.')
+        if nativeFlag or archiveFlag or incrementalFlag or repositoryFlag or uploadUrl or schemaCacheFlag:
+            raise ValueError('--columnar is an export mode of its own, it can not be used with --native, --archive, --incremental, --repository, --upload or --schema-cache.')
+        # Arrow IPC has no gzip, the gzip default of the SQL dumps becomes zstd
+        if '--codec' not in sys.argv:
+            codec = 'zstd'
+        elif codec not in columnarCodecs[columnarFormat]:
+            raise ValueError('--columnar '+columnarFormat+' can not be compressed with '+codec+', use one of: '+', '.join(columnarCodecs[columnarFormat])+'.')
+
+    # Referentially-closed subset
+    global subsetRoots
+    if '--subset' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--subset':
+                subsetRoots.append(sys.argv[idx+1])
+            idx += 1
+        if mode == 'byTable':
+            raise ValueError('--subset dumps the whole database to a single file, it can not be used with -t.')
+        if nativeFlag or archiveFlag or repositoryFlag or uploadUrl or columnarFormat:
+            raise ValueError('--subset is an export mode of its own, it can not be used with --native, --archive, --repository, --upload or --columnar.')
+
+    # Prometheus textfile
+    global prometheusFile
+    if '--prometheus' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--prometheus':
+                prometheusFile = sys.argv[idx+1]
+                break
+            else:
+                idx += 1
+
+    # Pack small tables in bins
+    global binSize
+    if '--bin-size' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--bin-size':
+                binSize = float(sys.argv[idx+1])*1024**2
+                break
+            else:
+                idx += 1
+
+    # Parallel jobs
+    global jobs
+    if '--jobs' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--jobs':
+                jobs = int(sys.argv[idx+1])
+                break
+            else:
+                idx += 1
+
     # host
     host = None
     if '-h' in sys.argv:
@@ -277,6 +807,28 @@ def getArguments():
             else:
                 idx += 1
     
+    # Limits of the dump tools and cancellation of the run on the first failure
+    global timeoutMinutes, stallMinutes, failFastFlag
+    if '--timeout' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--timeout':
+                timeoutMinutes = float(sys.argv[idx+1])
+                break
+            else:
+                idx += 1
+    if '--stall' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--stall':
+                stallMinutes = float(sys.argv[idx+1])
+                break
+            else:
+                idx += 1
+    if '--fail-fast' in sys.argv:
+        failFastFlag = True
+    configureProcesses(timeout=timeoutMinutes and timeoutMinutes*60,stall=stallMinutes and stallMinutes*60,cancelOnFailure=failFastFlag)
+
     if not (DBName or host or user):
         raise ValueError('Database Name and/or host arguments missing.')
     else:
@@ -289,8 +841,20 @@ if __name__=='__main__':
     ## get arguments ##
     mode, host, port, DBName, user, environPassword = getArguments()
 
+    ## Run Restore ##
+    if restoreFlag:
+        if restoreDB(host=host,port=port,DBName=DBName,user=user,password=os.getenv(environPassword)):
+            print('Restore finished.')
+            executionTime = datetime.now()-executionTime
+            print('Execution time: {}'.format(executionTime))
+        else:
+            print('The restore could not be done.')
+            executionTime = datetime.now()-executionTime
+            print('Execution time: {}'.format(executionTime))
+            sys.exit(1)
+
     ## Run Backup ##
-    if backupDB(host=host,port=port,DBName=DBName,user=user,password=os.getenv(environPassword),mode=mode):
+    elif backupDB(host=host,port=port,DBName=DBName,user=user,password=os.getenv(environPassword),mode=mode):
         print('Backup finished, you can find your files on c:\MySQLDump directory.')
         executionTime = datetime.now()-executionTime
         print('Execution time: {}'.format(executionTime))
@@ -298,4 +862,5 @@ if __name__=='__main__':
         print('The backup could not be done.')
         executionTime = datetime.now()-executionTime
         print('Execution time: {}'.format(executionTime))
+        sys.exit(1)
 
@@ -0,0 +1,386 @@
+############################################################################################
+##                       Native MySQL exporter (--native):                                ##
+##                                                                                        ##
+##  - Exports the database in-process over mysql.connector, without mysqldump.exe;        ##
+##  - Rows are read in primary key order with an unbuffered cursor, fetchChunk rows at    ##
+##    a time, and written as batched multi-row INSERT statements (or LOAD DATA            ##
+##    compatible TSV with --tsv), so memory stays bounded whatever the table size;        ##
+##  - Large tables with an integer primary key are split in primary key ranges, exported  ##
+##    at the same time on --jobs N connections, all opened on the same snapshot by        ##
+##    dumpSnapshot (brief FLUSH TABLES WITH READ LOCK fan-out);                           ##
+##  - The rows written go through the dumpThrottle rate limiter (--max-rate) and are      ##
+##    hashed by dumpChecksum while they are written;                                      ##
+##  - The BLOB columns of the tables with heavy rows are streamed to .lob side files by   ##
+##    dumpLob, the rows keep a reference to their values;                                 ##
+##  - The schema (SHOW CREATE TABLE) goes to <DB>_schema.sql, the routines, views,        ##
+##    triggers and events (SHOW CREATE ...) to <DB>_schema_post.sql, loaded after the     ##
+##    data so the triggers do not fire on the restored rows;                              ##
+##  - A <DB>_export.json lists every file written and the number of rows exported from    ##
+##    each table, restoreExport() loads them back, the data files in parallel.            ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from datetime import datetime, timedelta
+from decimal import Decimal
+import queue
+import json
+import math
+import os
+from dumpScheduler import runParallel, allSucceeded
+from dumpPlanner import queryMysqlTables, makePlan
+from dumpReport import recordMetrics
+from dumpThrottle import ThrottledWriter
+from dumpSnapshot import openMysqlSnapshots
+from dumpChecksum import HashingTee, addChecksum, addFileChecksum
+from dumpRestore import pipeInto
+from dumpLob import markLobColumns, lobManifest, lobQuery, LobReferences, sideFileName, exportSideFile, restoreLobs
+
+## Rows fetched at a time and maximum size of each INSERT statement ##
+fetchChunk = 1000
+maxStatementBytes = 1024**2
+
+## Header of the SQL data files ##
+sqlHeader = ("SET NAMES utf8mb4;\n"
+             "SET FOREIGN_KEY_CHECKS=0;\n"
+             "SET UNIQUE_CHECKS=0;\n"
+             "SET SQL_MODE='NO_AUTO_VALUE_ON_ZERO';\n")
+
+## Quote an identifier ##
+def quoteIdent(name):
+    return '`'+name.replace('`','``')+'`'
+
+
+## Path of the export manifest of a database ##
+def exportManifestPath(path,DBName):
+    return path+DBName+'_export.json'
+
+
+## Text of a value, as MySQL reads it back ##
+def valueText(value):
+    if isinstance(value, timedelta):
+        seconds = int(value.total_seconds())
+        sign = '-' if seconds < 0 else ''
+        seconds = abs(seconds)
+        return '{}{:02d}:{:02d}:{:02d}.{:06d}'.format(sign, seconds//3600, seconds//60%60, seconds%60, abs(value).microseconds)
+    if isinstance(value, set):
+        return ','.join(sorted(value))
+    return str(value)
+
+
+## Literal of a value in an INSERT statement ##
+def sqlValue(value):
+    if value is None:
+        return b'NULL'
+    if isinstance(value, bool):
+        return b'1' if value else b'0'
+    if isinstance(value, (int, float, Decimal)):
+        return str(value).encode()
+    if isinstance(value, (bytes, bytearray)):
+        return b"X'"+bytes(value).hex().encode()+b"'" if value else b"''"
+    text = valueText(value)
+    for char, escaped in (('\\','\\\\'), ("'","\\'"), ('\n','\\n'), ('\r','\\r'), ('\x00','\\0'), ('\x1a','\\Z')):
+        text = text.replace(char, escaped)
+    return b"'"+text.encode('utf8')+b"'"
+
+
+## Field of a value in a LOAD DATA compatible TSV line ##
+def tsvValue(value):
+    if value is None:
+        return b'\\N'
+    if isinstance(value, bool):
+        return b'1' if value else b'0'
+    if isinstance(value, (bytes, bytearray)):
+        field = bytes(value)
+    else:
+        field = valueText(value).encode('utf8')
+    for char, escaped in ((b'\\',b'\\\\'), (b'\t',b'\\t'), (b'\n',b'\\n'), (b'\r',b'\\r'), (b'\x00',b'\\0')):
+        field = field.replace(char, escaped)
+    return field
+
+
+## Plan the tables to export and list their columns ##
+def queryExportTables(conn,cursor,DBName):
+    plan = makePlan(queryMysqlTables(cursor,DBName), kinds=('table',))
+    cursor.execute("SELECT table_name, column_name, extra FROM information_schema.columns "
+                   "WHERE (table_schema = %s) "
+                   "ORDER BY table_name, ordinal_position", (DBName,))
+    columns = {}
+    for tableName, columnName, extra in cursor.fetchall():
+        # Generated columns are computed again on restore
+        if 'GENERATED' not in (extra or '').upper():
+            columns.setdefault(tableName, []).append(columnName)
+    for unit in plan:
+        unit['columns'] = columns.get(unit['name'], [])
+    return plan
+
+
+## Split a table in primary key ranges or partitions, one export unit per chunk ##
+def splitTable(cursor,DBName,table,extension):
+    chunks = table['chunks']
+    pkColumns = table['table'].pkColumns
+    tableName = quoteIdent(DBName)+'.'+quoteIdent(table['name'])
+    fromTable = ' FROM '+tableName
+    select = 'SELECT '+', '.join(quoteIdent(column) for column in table['columns'])
+    orderBy = ' ORDER BY '+', '.join(quoteIdent(column) for column in pkColumns) if pkColumns else ''
+    if table['splitBy'] is None:
+        return [{'name': table['name'], 'table': table['name'], 'size': table['size'],
+                 'query': select+fromTable+orderBy, 'from': tableName, 'where': None,
+                 'file': DBName+'_tb_'+table['name']+extension}]
+
+    units = []
+    if table['splitBy'] == 'partition':
+        for chunk, partition in enumerate(table['table'].partitions):
+            units.append({'name': '{} [{}]'.format(table['name'], partition), 'table': table['name'],
+                          'size': table['size']/chunks,
+                          'query': select+fromTable+' PARTITION ('+quoteIdent(partition)+')'+orderBy,
+                          'from': tableName+' PARTITION ('+quoteIdent(partition)+')', 'where': None,
+                          'file': DBName+'_tb_'+table['name']+'.'+str(chunk+1)+extension})
+        return units
+
+    pkColumn = quoteIdent(pkColumns[0])
+    cursor.execute('SELECT MIN('+pkColumn+'), MAX('+pkColumn+')'+fromTable)
+    minKey, maxKey = cursor.fetchall()[0]
+    if minKey is None:
+        chunks = 1
+        minKey = maxKey = 0
+    step = math.ceil((maxKey-minKey+1)/chunks)
+
+    for chunk in range(chunks):
+        lowKey = minKey+chunk*step
+        highKey = lowKey+step-1
+        where = pkColumn+' BETWEEN '+str(lowKey)+' AND '+str(highKey)
+        units.append({'name': '{} [{}/{}]'.format(table['name'], chunk+1, chunks), 'table': table['name'],
+                      'size': table['size']/chunks,
+                      'query': select+fromTable+' WHERE '+where+orderBy, 'from': tableName, 'where': where,
+                      'file': DBName+'_tb_'+table['name']+'.'+str(chunk+1)+extension})
+    return units
+
+
+## Write the rows of a unit as multi-row INSERT statements ##
+def writeInserts(cursor,fout,table):
+    insert = ('INSERT INTO '+quoteIdent(table['name'])+' ('
+              +', '.join(quoteIdent(column) for column in table['columns'])+') VALUES ').encode('utf8')
+    fout.write(sqlHeader.encode())
+    statement = []
+    statementBytes = 0
+    rowCount = 0
+    while True:
+        rows = cursor.fetchmany(fetchChunk)
+        if not rows:
+            break
+        rowCount += len(rows)
+        for row in rows:
+            values = b'('+b','.join(sqlValue(value) for value in row)+b')'
+            if statement and statementBytes+len(values) > maxStatementBytes:
+                fout.write(insert+b',\n'.join(statement)+b';\n')
+                statement = []
+                statementBytes = 0
+            statement.append(values)
+            statementBytes += len(values)+2
+    if statement:
+        fout.write(insert+b',\n'.join(statement)+b';\n')
+    return rowCount
+
+
+## Write the rows of a unit as LOAD DATA compatible TSV ##
+def writeTsv(cursor,fout):
+    rowCount = 0
+    while True:
+        rows = cursor.fetchmany(fetchChunk)
+        if not rows:
+            break
+        rowCount += len(rows)
+        fout.write(b''.join(b'\t'.join(tsvValue(value) for value in row)+b'\n' for row in rows))
+    return rowCount
+
+
+## Give a worker connection back to the pool, without the rows a failed unit left unread ##
+def releaseConnection(connections,conn,cursor):
+    try:
+        # An unbuffered result left unread would put the next unit out of sync
+        conn.consume_results()
+    except Exception:
+        # A broken connection fails the next unit with its own error
+        pass
+    connections.put((conn, cursor))
+
+
+## Export the data of a single unit on a connection of the pool ##
+def exportUnit(connections,path,tsv,tables,unit):
+    conn, cursor = connections.get()
+    table = tables[unit['table']]
+    try:
+        cursor.execute(unit['query'])
+        # The out-of-line values are replaced by their reference in the side file
+        rows = LobReferences(cursor,table,sideFileName(unit['file'])) if table['lobColumns'] else cursor
+        with open(path+unit['file'],'wb') as fout:
+            tee = HashingTee(fout)
+            if tsv:
+                rowCount = writeTsv(rows,ThrottledWriter(tee))
+            else:
+                rowCount = writeInserts(rows,ThrottledWriter(tee),table)
+        addChecksum(unit['file'],tee)
+        sideBytes = exportSideFile('mysql',quoteIdent,cursor,path,table,unit) if table['lobColumns'] else 0
+        recordMetrics(rows=rowCount, rawBytes=tee.bytes+sideBytes)
+    finally:
+        releaseConnection(connections,conn,cursor)
+    return 0
+
+
+## Views of a database, each one after the views it reads (view_table_usage, MySQL 8.0.13+) ##
+def orderedViews(cursor,DBName):
+    cursor.execute("SELECT table_name FROM information_schema.views WHERE (table_schema = %s) ORDER BY table_name", (DBName,))
+    dependencies = {name: set() for name, in cursor.fetchall()}
+    try:
+        cursor.execute("SELECT view_name, table_name FROM information_schema.view_table_usage "
+                       "WHERE (view_schema = %s) AND (table_schema = %s)", (DBName, DBName))
+        for viewName, tableName in cursor.fetchall():
+            if viewName in dependencies and tableName in dependencies:
+                dependencies[viewName].add(tableName)
+    except Exception:
+        # Older servers: the views are created in name order
+        pass
+
+    ordered = []
+    while dependencies:
+        ready = sorted(name for name, used in dependencies.items() if not used-set(ordered)) or sorted(dependencies)
+        ordered += ready
+        for name in ready:
+            del dependencies[name]
+    return ordered
+
+
+## Write a routine, trigger or event statement in its own sql_mode ##
+def writeRoutine(fout,name,sqlMode,statement):
+    if statement is None:
+        raise RuntimeError('ERROR: The definition of '+name+' can not be read by this user, the export would be incomplete.')
+    fout.write("SET SESSION sql_mode = '"+sqlMode+"';\nDELIMITER ;;\n"+statement+";;\nDELIMITER ;\n\n")
+
+
+## Write the routines, views, triggers and events of a database, loaded after the data ##
+def writeObjects(cursor,DBName,filePath):
+    database = quoteIdent(DBName)
+    with open(filePath,'w',encoding='utf8') as fout:
+        fout.write(sqlHeader)
+        cursor.execute("SELECT routine_type, routine_name FROM information_schema.routines WHERE (routine_schema = %s) "
+                       "ORDER BY routine_type, routine_name", (DBName,))
+        for routineType, name in cursor.fetchall():
+            cursor.execute('SHOW CREATE '+routineType+' '+database+'.'+quoteIdent(name))
+            row = cursor.fetchall()[0]
+            writeRoutine(fout,routineType+' '+name,row[1],row[2])
+
+        for name in orderedViews(cursor,DBName):
+            cursor.execute('SHOW CREATE VIEW '+database+'.'+quoteIdent(name))
+            fout.write(cursor.fetchall()[0][1]+';\n\n')
+
+        cursor.execute("SELECT trigger_name FROM information_schema.triggers WHERE (trigger_schema = %s) "
+                       "ORDER BY event_object_table, action_timing, event_manipulation, action_order", (DBName,))
+        for name, in cursor.fetchall():
+            cursor.execute('SHOW CREATE TRIGGER '+database+'.'+quoteIdent(name))
+            row = cursor.fetchall()[0]
+            writeRoutine(fout,'TRIGGER '+name,row[1],row[2])
+
+        cursor.execute("SELECT event_name FROM information_schema.events WHERE (event_schema = %s) ORDER BY event_name", (DBName,))
+        for name, in cursor.fetchall():
+            cursor.execute('SHOW CREATE EVENT '+database+'.'+quoteIdent(name))
+            row = cursor.fetchall()[0]
+            fout.write("SET SESSION time_zone = '"+row[2]+"';\n")
+            writeRoutine(fout,'EVENT '+name,row[1],row[3])
+
+
+## Open the pool of worker connections, all on the same consistent snapshot ##
+def openSnapshots(connect,jobs,opened):
+    connections = queue.Queue()
+    for connection in openMysqlSnapshots(connect,jobs,opened):
+        connections.put(connection)
+    return connections
+
+
+## Export a database: schema with SHOW CREATE TABLE, data with the worker connections ##
+def exportDB(connect,DBName,path,jobs=1,tsv=False):
+    startTime = datetime.now()
+    extension = '.tsv' if tsv else '.sql'
+    jobs = max(1, int(jobs))
+    opened = []
+    try:
+        connections = openSnapshots(connect,jobs,opened)
+        conn, cursor = connections.get()
+
+        ## Schema ##
+        tables = queryExportTables(conn,cursor,DBName)
+        with open(path+DBName+'_schema.sql','w',encoding='utf8') as fout:
+            fout.write(sqlHeader)
+            for table in tables:
+                cursor.execute('SHOW CREATE TABLE '+quoteIdent(DBName)+'.'+quoteIdent(table['name']))
+                fout.write(cursor.fetchall()[0][1]+';\n\n')
+        addFileChecksum(path,DBName+'_schema.sql')
+        writeObjects(cursor,DBName,path+DBName+'_schema_post.sql')
+        addFileChecksum(path,DBName+'_schema_post.sql')
+
+        markLobColumns('mysql',cursor,DBName,tables)
+        units = []
+        for table in tables:
+            tableUnits = splitTable(cursor,DBName,table,extension)
+            if table['lobColumns']:
+                for unit in tableUnits:
+                    unit['query'] = lobQuery('mysql',quoteIdent,table,unit)
+            units += tableUnits
+        connections.put((conn, cursor))
+
+        ## Data ##
+        tablesByName = {table['name']: table for table in tables}
+        results = runParallel(units, lambda unit: exportUnit(connections,path,tsv,tablesByName,unit), jobs=jobs)
+        success = allSucceeded(results)
+        rowCounts = {result['name']: result.get('rows') for result in results if result['success']}
+    finally:
+        for workerConn in opened:
+            workerConn.close()
+
+    manifest = {'database': DBName, 'exportedAt': startTime.isoformat(), 'format': 'tsv' if tsv else 'sql',
+                'schema': DBName+'_schema.sql', 'postSchema': DBName+'_schema_post.sql',
+                'tables': [dict({'name': table['name'], 'columns': table['columns'],
+                                 'files': [unit['file'] for unit in units if unit['table'] == table['name']],
+                                 'rows': sum(rowCounts.get(unit['name']) or 0 for unit in units if unit['table'] == table['name'])},
+                                **lobManifest(table,units,quoteIdent(table['name'])))
+                           for table in tables]}
+    with open(exportManifestPath(path,DBName),'w') as fout:
+        json.dump(manifest, fout, indent=2)
+    return success
+
+
+## Statement loading a TSV data file with LOAD DATA LOCAL INFILE ##
+def loadDataStatement(path,table,filename):
+    filePath = (path+filename).replace('\\','/').replace("'","\\'")
+    return (sqlHeader+"LOAD DATA LOCAL INFILE '"+filePath+"' INTO TABLE "+quoteIdent(table['name'])+" CHARACTER SET utf8mb4 ("
+            +', '.join(quoteIdent(column) for column in table['columns'])+");\n").encode('utf8')
+
+
+## Restore an export: schema, data files in parallel, the out-of-line values, then the routines, views, triggers and events ##
+def restoreExport(connect,mysql,DBName,path,jobs=1):
+    with open(exportManifestPath(path,DBName)) as fin:
+        manifest = json.load(fin)
+
+    if pipeInto(mysql,path+manifest['schema']) != 0:
+        raise RuntimeError('ERROR: mysql could not load the schema of '+DBName+'.')
+
+    units = []
+    for table in manifest['tables']:
+        for filename in table['files']:
+            units.append({'name': filename, 'table': table, 'file': filename, 'size': os.stat(path+filename).st_size})
+    if manifest['format'] == 'tsv':
+        # The database name stays the last argument
+        loader = mysql[:-1]+['--local-infile=1']+mysql[-1:]
+        results = runParallel(units, lambda unit: pipeInto(loader,header=loadDataStatement(path,unit['table'],unit['file'])),
+                              jobs=jobs, unitName='data file')
+    else:
+        results = runParallel(units, lambda unit: pipeInto(mysql,path+unit['file']), jobs=jobs, unitName='data file')
+    if not allSucceeded(results):
+        return False
+    if not restoreLobs(connect,'mysql',quoteIdent,path,manifest['tables'],jobs=jobs):
+        return False
+
+    # Exports written before the post-data schema have none
+    if manifest.get('postSchema') and pipeInto(mysql,path+manifest['postSchema']) != 0:
+        raise RuntimeError('ERROR: mysql could not load the routines, views, triggers and events of '+DBName+'.')
+    return True
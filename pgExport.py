@@ -0,0 +1,232 @@
+############################################################################################
+##                 Native PostgreSQL exporter/importer (--native/--restore):              ##
+##                                                                                        ##
+##  - The schema is written by pg_dump in two files: pre-data (tables, types, ...) and    ##
+##    post-data (indexes, constraints, triggers), loaded before and after the data;       ##
+##  - The data of each table is streamed in-process with COPY ... TO STDOUT, large        ##
+##    tables with an integer primary key are split in primary key ranges exported at      ##
+##    the same time on separate connections;                                              ##
+##  - The COPY data written goes through the dumpThrottle rate limiter (--max-rate) and   ##
+##    is hashed by dumpChecksum while it is written;                                      ##
+##  - Every connection shares one exported snapshot (pg_export_snapshot), so all the      ##
+##    data files are consistent with each other and with the schema;                      ##
+##  - The bytea columns of the tables with heavy rows and the large objects are streamed  ##
+##    to .lob side files by dumpLob, the rows keep a reference to their values;           ##
+##  - The sequence values go to <DB>_sequences.sql, replayed after the data;              ##
+##  - A <DB>_export.json lists the schema and data files and the rows exported from each  ##
+##    table, restoreExport() loads them back, the data files in parallel with COPY ...    ##
+##    FROM STDIN.                                                                         ##
+##                                                                                        ##
+############################################################################################
+
+## Imports ##
+from datetime import datetime
+import threading
+import json
+import math
+import os
+from dumpScheduler import runParallel, allSucceeded
+from dumpPlanner import queryPostgresTables, makePlan
+from dumpReport import recordMetrics
+from dumpThrottle import ThrottledWriter
+from dumpSnapshot import exportPostgresSnapshot, joinPostgresSnapshot
+from dumpChecksum import HashingTee, addChecksum, addFileChecksum
+from dumpProcess import runCommand
+from dumpLob import markLobColumns, lobManifest, lobQuery, exportSideFile, exportLargeObjects, restoreLobs, restoreLargeObjects
+
+## Quote an identifier ##
+def quoteIdent(name):
+    return '"'+name.replace('"','""')+'"'
+
+
+## Path of the export manifest of a database ##
+def exportManifestPath(path,DBName):
+    return path+DBName+'_export.json'
+
+
+## Plan the tables to export and list their columns ##
+def queryExportTables(conn,cursor):
+    # Partitioned tables are exported through their partitions only, they hold no rows of their own
+    plan = makePlan(queryPostgresTables(cursor), kinds=('table','partition'))
+    query = ("SELECT c.relname, a.attname FROM pg_attribute a "
+            "JOIN pg_class c ON (c.oid = a.attrelid) "
+            "JOIN pg_namespace n ON (n.oid = c.relnamespace) "
+            "WHERE (n.nspname = 'public') AND (a.attnum > 0) AND NOT a.attisdropped AND (a.attgenerated = '') "
+            "ORDER BY c.relname, a.attnum")
+
+    cursor.execute(query)
+    columns = {}
+    for tableName, columnName in cursor.fetchall():
+        columns.setdefault(tableName, []).append(columnName)
+    for unit in plan:
+        unit['columns'] = columns.get(unit['name'], [])
+    return plan
+
+
+## Split a table in primary key ranges, one export unit per range ##
+def splitTable(cursor,DBName,table,extension='.copy'):
+    chunks = table['chunks']
+    # The rows of the inheritance children are exported with the children themselves
+    tableName = 'ONLY public.'+quoteIdent(table['name'])
+    select = 'SELECT '+', '.join(quoteIdent(column) for column in table['columns'])+' FROM '+tableName
+    if table['splitBy'] != 'pk':
+        return [{'name': table['name'], 'table': table['name'], 'size': table['size'],
+                 'query': select, 'from': tableName, 'where': None, 'file': DBName+'_tb_'+table['name']+extension}]
+
+    pkColumn = quoteIdent(table['table'].pkColumns[0])
+    cursor.execute('SELECT min('+pkColumn+'), max('+pkColumn+') FROM '+tableName)
+    minKey, maxKey = cursor.fetchone()
+    if minKey is None:
+        chunks = 1
+        minKey = maxKey = 0
+    step = math.ceil((maxKey-minKey+1)/chunks)
+
+    units = []
+    for chunk in range(chunks):
+        lowKey = minKey+chunk*step
+        highKey = lowKey+step-1
+        where = pkColumn+' BETWEEN '+str(lowKey)+' AND '+str(highKey)
+        units.append({'name': '{} [{}/{}]'.format(table['name'], chunk+1, chunks), 'table': table['name'],
+                      'size': table['size']/chunks,
+                      'query': select+' WHERE '+where, 'from': tableName, 'where': where,
+                      'file': DBName+'_tb_'+table['name']+'.'+str(chunk+1)+extension})
+    return units
+
+
+## Keep one connection per worker thread, all sharing the same snapshot ##
+def workerConnection(connect,workers,opened,snapshotId):
+    if not hasattr(workers, 'conn'):
+        workers.conn, workers.cursor = connect()
+        joinPostgresSnapshot(workers.conn,workers.cursor,snapshotId)
+        opened.append(workers.conn)
+    return workers.cursor
+
+
+## Export the data of a single unit with COPY ... TO STDOUT ##
+def exportUnit(connect,workers,opened,snapshotId,path,tables,unit):
+    cursor = workerConnection(connect,workers,opened,snapshotId)
+    table = tables[unit['table']]
+    with open(path+unit['file'],'wb') as fout:
+        tee = HashingTee(fout)
+        cursor.copy_expert('COPY ('+unit['query']+') TO STDOUT', ThrottledWriter(tee))
+        rowCount = cursor.rowcount
+    addChecksum(unit['file'],tee)
+    sideBytes = exportSideFile('postgres',quoteIdent,cursor,path,table,unit) if table['lobColumns'] else 0
+    recordMetrics(rows=rowCount, rawBytes=tee.bytes+sideBytes)
+    return 0
+
+
+## Write the setval() of every used sequence, replayed after the data ##
+def writeSequences(cursor,path,filename):
+    cursor.execute("SELECT schemaname, sequencename, last_value FROM pg_sequences "
+                   "WHERE (schemaname NOT IN ('pg_catalog', 'information_schema')) AND (last_value IS NOT NULL) "
+                   "ORDER BY schemaname, sequencename")
+    sequences = cursor.fetchall()
+    with open(path+filename,'w',encoding='utf8') as fout:
+        for schemaName, sequenceName, lastValue in sequences:
+            name = (quoteIdent(schemaName)+'.'+quoteIdent(sequenceName)).replace("'","''")
+            fout.write("SELECT pg_catalog.setval('"+name+"', "+str(lastValue)+", true);\n")
+    addFileChecksum(path,filename)
+    print('{} sequence value(s) exported.'.format(len(sequences)))
+
+
+## Export a database: schema with pg_dump, data with COPY on the shared snapshot ##
+def exportDB(connect,pg_dump,DBName,path,jobs=1):
+    startTime = datetime.now()
+    conn, cursor = connect()
+    workers = threading.local()
+    opened = []
+    try:
+        snapshotId = exportPostgresSnapshot(conn,cursor)
+        print('Exporting {} on snapshot {}.'.format(DBName, snapshotId))
+
+        ## Schema ##
+        schemaFiles = {'preData': DBName+'_schema_pre.sql', 'postData': DBName+'_schema_post.sql'}
+        for section, filename in (('pre-data', schemaFiles['preData']), ('post-data', schemaFiles['postData'])):
+            if runCommand(pg_dump+['--section='+section, '--snapshot='+snapshotId, '-f', path+filename, DBName]) != 0:
+                raise RuntimeError('ERROR: pg_dump could not dump the '+section+' schema of '+DBName+'.')
+            addFileChecksum(path,filename)
+
+        # pg_dump writes the sequence values in the data section, read them on the snapshot connection
+        schemaFiles['sequences'] = DBName+'_sequences.sql'
+        writeSequences(cursor,path,schemaFiles['sequences'])
+
+        ## Data ##
+        tables = queryExportTables(conn,cursor)
+        markLobColumns('postgres',cursor,DBName,tables)
+        units = []
+        for table in tables:
+            tableUnits = splitTable(cursor,DBName,table)
+            if table['lobColumns']:
+                for unit in tableUnits:
+                    unit['query'] = lobQuery('postgres',quoteIdent,table,unit)
+            units += tableUnits
+        tablesByName = {table['name']: table for table in tables}
+        results = runParallel(units, lambda unit: exportUnit(connect,workers,opened,snapshotId,path,tablesByName,unit), jobs=jobs)
+        success = allSucceeded(results)
+        rowCounts = {result['name']: result.get('rows') for result in results if result['success']}
+
+        # The data of the large objects is not in pg_dump's pre-data
+        largeObjects = None
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM pg_largeobject_metadata)')
+        if cursor.fetchone()[0]:
+            largeObjects = {'file': DBName+'_largeobjects.lob'}
+            largeObjects['objects'] = exportLargeObjects(cursor,path,largeObjects['file'])
+    finally:
+        for workerConn in opened:
+            workerConn.close()
+        conn.close()
+
+    manifest = {'database': DBName, 'snapshot': snapshotId, 'exportedAt': startTime.isoformat(),
+                'schema': schemaFiles, 'largeObjects': largeObjects,
+                'tables': [dict({'name': table['name'], 'columns': table['columns'],
+                                 'files': [unit['file'] for unit in units if unit['table'] == table['name']],
+                                 'rows': sum(rowCounts.get(unit['name']) or 0 for unit in units if unit['table'] == table['name'])},
+                                **lobManifest(table,units,'ONLY public.'+quoteIdent(table['name'])))
+                           for table in tables]}
+    with open(exportManifestPath(path,DBName),'w') as fout:
+        json.dump(manifest, fout, indent=2)
+    return success
+
+
+## Load the data of a single file with COPY ... FROM STDIN ##
+def restoreUnit(connect,path,unit):
+    conn, cursor = connect()
+    try:
+        with open(path+unit['file'],'rb') as fin:
+            cursor.copy_expert('COPY public.'+quoteIdent(unit['table'])+' ('+', '.join(quoteIdent(column) for column in unit['columns'])+') FROM STDIN', fin)
+        conn.commit()
+    finally:
+        conn.close()
+    return 0
+
+
+## Restore an export: pre-data schema, data and out-of-line values in parallel, then post-data schema ##
+def restoreExport(connect,psql,DBName,path,jobs=1):
+    with open(exportManifestPath(path,DBName)) as fin:
+        manifest = json.load(fin)
+
+    if runCommand(psql+['-v', 'ON_ERROR_STOP=1', '-f', path+manifest['schema']['preData'], DBName]) != 0:
+        raise RuntimeError('ERROR: psql could not load the pre-data schema of '+DBName+'.')
+
+    units = []
+    for table in manifest['tables']:
+        for filename in table['files']:
+            units.append({'name': filename, 'table': table['name'], 'columns': table['columns'],
+                          'file': filename, 'size': os.stat(path+filename).st_size})
+    results = runParallel(units, lambda unit: restoreUnit(connect,path,unit), jobs=jobs, unitName='data file')
+    if not allSucceeded(results):
+        return False
+    if not restoreLobs(connect,'postgres',quoteIdent,path,manifest['tables'],jobs=jobs,indexKeys=True):
+        return False
+    if manifest.get('largeObjects') and not restoreLargeObjects(connect,path,manifest['largeObjects'],jobs=jobs):
+        return False
+
+    # The sequences continue after the restored keys
+    if manifest['schema'].get('sequences'):
+        if runCommand(psql+['-v', 'ON_ERROR_STOP=1', '-f', path+manifest['schema']['sequences'], DBName]) != 0:
+            raise RuntimeError('ERROR: psql could not set the sequences of '+DBName+'.')
+
+    if runCommand(psql+['-v', 'ON_ERROR_STOP=1', '-f', path+manifest['schema']['postData'], DBName]) != 0:
+        raise RuntimeError('ERROR: psql could not load the post-data schema of '+DBName+'.')
+    return True
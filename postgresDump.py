@@ -13,12 +13,69 @@
 ## Arguments Explanation:                                                                          ##
 ##                                                                                                 ##
 ##  - (-t): Dump table by table of Database (Optional)                                             ##
+##  - (-c): Compress the dump result (Optional, takes more time to complete)                       ##
+##  - (--stream): Compress the dump output while it is dumped, without staging the dump on disk    ##
+##    (Optional)                                                                                   ##
+##  - (--codec): Compression codec: gzip (default), zstd or lz4 (Optional)                         ##
+##  - (--level): Compression level of the chosen codec (Optional)                                  ##
 ##  - (-h): Hostname                                                                               ##
 ##  - (-db): Database name                                                                         ##
 ##  - (-u): Database user                                                                          ##
 ##  - (-ev): Name of environment variable set with Database password for the given user            ##
 ##  - (-s): Dump all databases found on the server                                                 ##
 ##  - (-sn): Server Name                                                                           ##
+##  - (--format F): pg_dump format: tar (default), custom or directory (Optional). The directory   ##
+##    format runs pg_dump with --jobs N workers. With -s, the globals are dumped once with         ##
+##    pg_dumpall --globals-only and each database is dumped to its own restorable file/folder,     ##
+##    --jobs N databases at the same time.                                                         ##
+##  - (--jobs N): Number of tables (-t), databases (-s) or pg_dump workers dumped at the same      ##
+##    time (Optional, default 1)                                                                   ##
+##  - (--incremental): In -t mode, only dump the tables changed since the last run (Optional)      ##
+##  - (--bin-size MB): In -t mode, pack the tables smaller than MB in bins dumped by a single      ##
+##    pg_dump each, a <DB>_index.json maps every table to its file (Optional)                      ##
+##  - (--prometheus FILE): Also write the run report as a Prometheus textfile (Optional)           ##
+##  - (--native): Export the database in-process with COPY, splitting large tables in primary      ##
+##    key ranges exported by --jobs N connections on one shared snapshot, the bytea columns of the ##
+##    tables with heavy rows and the large objects streamed to .lob side files (Optional)          ##
+##  - (--restore): Load the dump of -db from c:\pgDump back into the database: a --native export   ##
+##    (data files on --jobs N connections), a custom/directory dump (pg_restore -j N) or the -t    ##
+##    files (--jobs N files at the same time, indexes and foreign keys built after the data)       ##
+##    (Optional)                                                                                   ##
+##  - (--resume): In -t mode, skip the tables already dumped by the interrupted last run, read     ##
+##    from its <DB>_journal.json checkpoint journal (Optional)                                     ##
+##  - (--retries N): Dump a failed table/database again up to N times, with backoff (Optional)     ##
+##  - (--max-rate MB): Limit the bytes read from the server to MB per second (--stream and         ##
+##    --native only, Optional)                                                                     ##
+##  - (--max-active N): Halve the tables/databases dumped at the same time while more than N       ##
+##    backends are active, pause the dumps above 2N (Optional)                                     ##
+##  - (--max-lag S): Same as --max-active, for a replication replay lag above S seconds (Optional) ##
+##  - (--consistent): In -t mode, every pg_dump runs on one snapshot exported by a coordinator     ##
+##    connection, so the tables dumped in parallel are consistent with each other (Optional)       ##
+##  - (--hash H): Hash of the checksums computed while the files are written: sha256 (default)     ##
+##    or xxhash, saved in <DB>_checksums.json, see dumpVerify.py (Optional)                        ##
+##  - (--archive): Without -t (or with -s and no --format), write a plain dump as <DB>.dumparc,    ##
+##    each table compressed in independent frames with a trailing index, see dumpArchive.py        ##
+##    --table (Optional)                                                                           ##
+##  - (--repository): Store the pg_dump output in c:\pgDump\repository as compressed               ##
+##    content-defined chunks, each stored once across runs, with a run manifest, see               ##
+##    dumpChunkStore.py --gc/--restore (Optional, tar/custom formats, not with --incremental)      ##
+##  - (--upload URL): Upload the pg_dump output to s3://bucket/prefix while it is dumped, in       ##
+##    parallel multipart parts, instead of writing it to c:\pgDump; -c and --stream compress it    ##
+##    on the fly (Optional, tar/custom formats, needs boto3, AWS credentials from the environment) ##
+##  - (--endpoint URL): Endpoint of an S3-compatible store, e.g. MinIO (Optional)                  ##
+##  - (--columnar F): Export every table in-process to parquet (or arrow IPC) files typed from     ##
+##    the catalog, compressed with --codec, on --jobs N connections sharing one snapshot, listed   ##
+##    in <DB>_columnar.json (Optional, not with -s, needs pyarrow)                                 ##
+##  - (--schema-cache): In -t mode, dump the table data only (pg_dump -a) and the schema apart     ##
+##    (pg_dump -s), only when a definition hashed from the catalog changed since the last run,     ##
+##    the changes saved in <DB>_schema_diff.json (Optional)                                        ##
+##  - (--subset SPEC): Dump to <DB>_subset.sql only the rows reached from the roots ("orders WHERE ##
+##    created_at > ...", "orders 5%" or "orders", repeatable) and the rows they need over the      ##
+##    foreign keys, in one snapshot, restorable with psql -f (Optional, not with -t or -s)         ##
+##  - (--timeout MIN / --stall MIN): Kill a pg_dump/pg_restore/psql run longer than MIN minutes,   ##
+##    or whose pipes stayed idle for MIN minutes (Optional)                                        ##
+##  - (--fail-fast): Cancel the run when a unit fails: the running dumps are killed and the units  ##
+##    not started yet are skipped (Optional)                                                       ##
 ##                                                                                                 ##
 ##  Dump File(s) Location(s) and created folders:                                                  ##
 ##                                                                                                 ##
@@ -44,18 +101,64 @@
 ## Imports ##
 from datetime import datetime
 import sys
-import pandas as pd
 import psycopg2
 import os
+from dumpScheduler import runParallel, allSucceeded
+from dumpReport import startRun, finishRun, recordMetrics, writeReport, writePrometheus, printSummary
+from dumpCompress import compress, streamCompress, compressedName, codecExtensions
+from dumpManifest import loadManifest, saveManifest, splitUnchanged, updateManifest, saveTableIndex
+from pgExport import exportDB, restoreExport, exportManifestPath
+from dumpPlanner import queryPostgresTables, makePlan, packBins, unpackResults
+from dumpJournal import openJournal, splitFinished, runJournaled, finishJournal
+from dumpThrottle import startThrottle, stopThrottle
+from dumpSnapshot import exportPostgresSnapshot
+from dumpArchive import streamArchive
+from dumpRestore import restorePostgres, pgRestoreFile
+from dumpChunkStore import startRepository, storeDump, saveRunManifest
+from dumpUpload import configureUpload, uploadDump, uploadRunFiles
+from dumpColumnar import exportColumnar, columnarManifestPath, columnarFormats, columnarCodecs
+from dumpSchema import querySchemaHashes, planSchema, schemaChangedTables, startSchemaDump, finishSchema, dataOnlyFingerprints
+from dumpSubset import dumpSubset, subsetManifestPath
+from dumpProcess import configureProcesses, runCommand
+from dumpChecksum import streamDump, startChecksums, saveChecksums, setHashAlgorithm, exportedTables, plannedTables
 
 ## Global Flags ##
 compressFlag = False
+streamFlag = False
+codec = 'gzip'
+level = None
 environPassword = 'postgresDBPass'
 host = 'localhost'
 database="DBName"
 port="5432"
 serverDump = False
 serverName = 'ServerName'
+jobs = 1
+incrementalFlag = False
+binSize = None
+prometheusFile = None
+dumpFormat = None
+nativeFlag = False
+restoreFlag = False
+resumeFlag = False
+retries = 0
+maxRate = None
+maxActive = None
+maxLag = None
+consistentFlag = False
+archiveFlag = False
+repositoryFlag = False
+uploadUrl = None
+columnarFormat = None
+schemaCacheFlag = False
+subsetRoots = []
+timeoutMinutes = None
+stallMinutes = None
+failFastFlag = False
+endpoint = None
+
+## pg_dump format code and file extension ##
+dumpFormats = {'tar': ('t', '.tar'), 'custom': ('c', '.dump'), 'directory': ('d', '')}
 
 ## Connect to Postgres DB
 def DBConnect(**kwargs):
@@ -97,25 +200,90 @@ def DBConnect(**kwargs):
         return conn, cursor
 
 
-## List all table names ##
+## Read the catalog of the tables to dump ##
+def queryTables(conn,cursor):
+    try:
+        tables = queryPostgresTables(cursor)
+    except:
+        conn.rollback()
+        raise RuntimeError('ERROR: Error in SQL execution while quering the table catalog.')
+    else:
+        conn.commit()
+        return tables
+
+
+## Hash the definition of every object of the schema ##
+def querySchema(conn,cursor,DBName):
+    try:
+        hashes = querySchemaHashes('postgres',cursor,DBName)
+    except:
+        conn.rollback()
+        raise RuntimeError('ERROR: Error in SQL execution while quering the schema catalog.')
+    else:
+        conn.commit()
+        return hashes
+
+
+## List all table names and sizes (pandas is only loaded when this is called) ##
 def queryTableList(conn,cursor):
-    query = ("SELECT table_name FROM information_schema.tables "
-            "WHERE (table_schema = 'public') "
-            "ORDER BY table_name")
-    
+    import pandas as pd
+    try:
+        tables = queryTables(conn,cursor)
+    except RuntimeError:
+        return 'Error in SQL execution while quering tableList'
+    return pd.DataFrame([[table.name, table.size] for table in tables], columns=['Table Name','Size'])
+
+
+## Get the fingerprint of each table, changed whenever the table data changes ##
+def queryTableFingerprints(conn,cursor):
+    query = ("SELECT c.relname, c.relfilenode, s.n_tup_ins, s.n_tup_upd, s.n_tup_del "
+            "FROM pg_class c "
+            "JOIN pg_namespace n ON (n.oid = c.relnamespace) "
+            "JOIN pg_stat_user_tables s ON (s.relid = c.oid) "
+            "WHERE (n.nspname = 'public')")
+
     try:
         cursor.execute(query)
-        try:
-            tableList = pd.DataFrame(cursor.fetchall())
-            tableList.columns = ['Table Name']
-        except:
-            tableList = None
+        fingerprints = {}
+        for tableName, relfilenode, inserted, updated, deleted in cursor.fetchall():
+            fingerprints[tableName] = 'relfilenode {} ins {} upd {} del {}'.format(relfilenode, inserted, updated, deleted)
     except:
         conn.rollback()
-        return 'Error in SQL execution while quering tableList'
+        raise RuntimeError('ERROR: Error in SQL execution while quering the table fingerprints.')
     else:
         conn.commit()
-        return tableList
+        return fingerprints
+
+
+## List all database names and sizes ##
+def queryDatabaseList(conn,cursor):
+    query = ("SELECT datname, pg_database_size(datname) FROM pg_database "
+            "WHERE datallowconn AND NOT datistemplate "
+            "ORDER BY datname")
+
+    try:
+        cursor.execute(query)
+        databaseList = cursor.fetchall()
+    except:
+        conn.rollback()
+        raise RuntimeError('ERROR: Error in SQL execution while quering the database list.')
+    else:
+        conn.commit()
+        return databaseList
+
+
+## Read the server load: active backends and replication replay lag ##
+def queryServerHealth(conn,cursor):
+    query = ("SELECT (SELECT count(*) FROM pg_stat_activity "
+            " WHERE (state = 'active') AND (backend_type = 'client backend') AND (pid <> pg_backend_pid())), "
+            "CASE WHEN pg_is_in_recovery() THEN EXTRACT(EPOCH FROM now()-pg_last_xact_replay_timestamp()) "
+            "ELSE (SELECT EXTRACT(EPOCH FROM max(replay_lag)) FROM pg_stat_replication) END")
+
+    cursor.execute(query)
+    active, lag = cursor.fetchone()
+    # The statistics are a snapshot of the transaction, each poll needs a new one
+    conn.commit()
+    return {'activeName': 'backends', 'active': active, 'lag': float(lag) if lag is not None else None}
 
 
 ## Set/Create pgpass.conf ##
@@ -157,9 +325,120 @@ def clearPgpass():
     except:
         return None
 
+
+## Command of a PostgreSQL client tool, run without a shell ##
+def pgCommand(tool,host,port,user):
+    return [tool, '-h', host, '-p', port, '-U', user]
+
+
+## Run a dump command and write or compress its output ##
+def runDump(pg_dump,path,filename):
+    if repositoryFlag:
+        return storeDump(pg_dump,path,filename)
+    if uploadUrl:
+        return uploadDump(pg_dump,filename,streamFlag or compressFlag,codec,level)
+    if streamFlag:
+        return streamCompress(pg_dump,path,filename,codec,level)
+
+    # The output is hashed while it is written
+    exitCode = streamDump(pg_dump,path,filename)
+    if exitCode == 0 and compressFlag:
+        compress(path=path,filename=filename,codec=codec,level=level)
+    elif exitCode == 0:
+        recordMetrics(rawBytes=os.stat(path+filename).st_size)
+    return exitCode
+
+
+## Run pg_dump in the chosen format ##
+def runPgDump(pg_dump,DBName,path,name,parallelJobs=1):
+    formatCode, extension = dumpFormats[dumpFormat or 'tar']
+    if dumpFormat == 'directory':
+        # The directory format is written by pg_dump itself, using its own parallel workers
+        exitCode = runCommand(pg_dump+['-F', 'd', '-j', str(parallelJobs), '-f', path+name, DBName])
+        if exitCode == 0:
+            recordMetrics(compressedBytes=sum(entry.stat().st_size for entry in os.scandir(path+name) if entry.is_file()))
+        return exitCode
+    return runDump(pg_dump+['-F', formatCode, DBName],path,name+extension)
+
+
+## Name of the file written by a dump ##
+def dumpFileName(name):
+    formatCode, extension = dumpFormats[dumpFormat or 'tar']
+    if dumpFormat == 'directory':
+        return name
+    if repositoryFlag:
+        return name+extension
+    if streamFlag or compressFlag:
+        return compressedName(name+extension,codec)
+    return name+extension
+
+
+## File of a whole database dump: directory, tar or custom format, compressed or not ##
+def wholeDatabaseFile(path,DBName):
+    if os.path.isdir(path+DBName):
+        return DBName
+    for formatCode, extension in (dumpFormats['tar'], dumpFormats['custom']):
+        for suffix in ['']+list(codecExtensions.values()):
+            if os.path.isfile(path+DBName+extension+suffix):
+                return DBName+extension+suffix
+    return None
+
+
+## Name of the file of a table or bin, bins are named after the run so older bins are never overwritten ##
+def unitFileName(DBName,unit,runId):
+    if 'tables' in unit:
+        return DBName+'_bin_'+runId+'_'+str(unit['bin'])
+    return DBName+'_tb_'+unit['name']
+
+
+## Dump a table, or a bin of tables with a single pg_dump ##
+def dumpTables(host,port,user,DBName,tableNames,name,snapshotId=None):
+    pg_dump = pgCommand('pg_dump',host,port,user)
+    for tableName in tableNames:
+        pg_dump += ['--table', 'public.'+tableName]
+    if schemaCacheFlag:
+        # The tables, indexes and constraints are created by the schema file
+        pg_dump += ['-a']
+    if snapshotId:
+        pg_dump += ['--snapshot='+snapshotId]
+    return runPgDump(pg_dump,DBName,'c:\\pgDump\\',name)
+
+
+## Dump the schema alone ##
+def dumpSchemaFile(host,port,user,DBName,name,snapshotId=None):
+    pg_dump = pgCommand('pg_dump',host,port,user)+['-s']
+    if snapshotId:
+        pg_dump += ['--snapshot='+snapshotId]
+    return runPgDump(pg_dump,DBName,'c:\\pgDump\\',name)
+
+
+## Dump a whole server: globals once, then each database in parallel ##
+def dumpServer(host,port,user,serverName,databaseList):
+    pg_dumpall = pgCommand('pg_dumpall',host,port,user)+['--globals-only']
+    results = runParallel([{'name': 'globals'}], lambda unit: runDump(pg_dumpall,'c:\\pgDump\\',serverName+'_globals.sql'), unitName='globals', retries=retries)
+    success = allSucceeded(results)
+
+    pg_dump = pgCommand('pg_dump',host,port,user)
+    units = [{'name': databaseName, 'size': size} for databaseName, size in databaseList]
+    results = runParallel(units, lambda unit: runPgDump(pg_dump,unit['name'],'c:\\pgDump\\',serverName+'_db_'+unit['name']),
+                          jobs=jobs, unitName='database', retries=retries)
+    return allSucceeded(results) and success
+
+
+## Write the run report ##
+def saveReport(name,success):
+    report = finishRun(name,success)
+    writeReport(report,'c:\\pgDump\\'+name+'_report.json')
+    if prometheusFile:
+        writePrometheus(report,prometheusFile)
+    printSummary(report)
+
     
 ## List all table names ##
 def backupDB(host,port,user,password,**kwargs):
+    global serverDump
+    startRun()
+    startChecksums()
     if 'DBName' in kwargs:
         DBName = kwargs.get('DBName')
     elif 'serverName' in kwargs:
@@ -167,16 +446,32 @@ def backupDB(host,port,user,password,**kwargs):
         DBName='*'
     else:
         raise RuntimeError('ERROR: Database Name or Server Name must be provided to backupDB function.')
+    if repositoryFlag:
+        startRepository('c:\\pgDump\\',serverName if serverDump else DBName,codec,level)
+    success = True
     if 'mode' in kwargs:
         mode = kwargs.get('mode')
         if mode == 'byTable':
             ## Connect ##
             conn, cursor = DBConnect(host=host,user= user,database=DBName,password=password)
             ## Get table list in DB ##
-            tableList = queryTableList(conn, cursor)
+            tables = queryTables(conn, cursor)
+            if incrementalFlag:
+                fingerprints = queryTableFingerprints(conn, cursor)
+                if schemaCacheFlag:
+                    fingerprints = dataOnlyFingerprints(fingerprints)
+            if schemaCacheFlag:
+                schemaHashes = querySchema(conn, cursor, DBName)
             conn.close()
     else:
         mode="all"
+
+    if serverDump and dumpFormat:
+        ## Connect ##
+        conn, cursor = DBConnect(host=host,user= user,database='postgres',password=password)
+        ## Get database list in server ##
+        databaseList = queryDatabaseList(conn, cursor)
+        conn.close()
     
     
     
@@ -184,30 +479,167 @@ def backupDB(host,port,user,password,**kwargs):
         if setPGPass(DBName,user,password,host=host):
             if not os.path.isdir('c:\pgDump\\'):
                 os.mkdir('c:\pgDump\\')
-            global serverDump
+            if maxRate or maxActive or maxLag:
+                startThrottle(lambda: DBConnect(host=host,user= user,database='postgres' if serverDump else DBName,password=password),
+                              queryServerHealth,jobs=jobs,rate=maxRate,maxActive=maxActive,maxLag=maxLag)
 
             if not serverDump:
-                if mode == 'all':
-                    pg_dump = '"pg_dump -h '+host+' -p '+port+' -U '+user+' -F t '+DBName+' > c:\pgDump\\'+DBName+'.tar"'
-                    os.system('"cmd.exe"' and pg_dump)
+                if subsetRoots:
+                    pg_dump = pgCommand('pg_dump',host,port,user)
+                    results = runParallel([{'name': DBName}], lambda unit: dumpSubset(lambda: DBConnect(host=host,user= user,database=DBName,password=password),DBName,'c:\\pgDump\\','postgres',subsetRoots,
+                                          pg_dump=pg_dump,codec=codec if compressFlag or streamFlag else None,level=level), unitName='subset')
+                    success = allSucceeded(results)
+                    checksumTables = exportedTables(subsetManifestPath('c:\\pgDump\\',DBName))
+
+                elif columnarFormat:
+                    success = exportColumnar(lambda: DBConnect(host=host,user= user,database=DBName,password=password),DBName,'c:\\pgDump\\','postgres',
+                                             jobs=jobs,columnarFormat=columnarFormat,codec=codec)
+                    checksumTables = exportedTables(columnarManifestPath('c:\\pgDump\\',DBName))
+
+                elif mode == 'all' and nativeFlag:
+                    pg_dump = pgCommand('pg_dump',host,port,user)
+                    success = exportDB(lambda: DBConnect(host=host,user= user,database=DBName,password=password),pg_dump,DBName,'c:\\pgDump\\',jobs=jobs)
+                    checksumTables = exportedTables('c:\\pgDump\\'+DBName+'_export.json')
+
+                elif mode == 'all' and archiveFlag:
+                    pg_dump = pgCommand('pg_dump',host,port,user)+['-F', 'p', DBName]
+                    results = runParallel([{'name': DBName}], lambda unit: streamArchive(pg_dump,'c:\\pgDump\\',DBName,'postgres',codec,level,database=DBName), unitName='database', retries=retries)
+                    success = allSucceeded(results)
+                    checksumTables = {}
+
+                elif mode == 'all':
+                    pg_dump = pgCommand('pg_dump',host,port,user)
+                    results = runParallel([{'name': DBName}], lambda unit: runPgDump(pg_dump,DBName,'c:\pgDump\\',DBName,parallelJobs=jobs), unitName='database', retries=retries)
+                    success = allSucceeded(results)
+                    checksumTables = {}
 
                 elif mode ==  'byTable':
-                    for idx in tableList.index:
-                        pg_dump = '"pg_dump -h '+host+' -p '+port+' -U '+user+' -F t --table public.'+tableList.iloc[idx][0]+' '+DBName+' > c:\pgDump\\'+DBName+'_tb_'+tableList.iloc[idx][0]+'.tar"'
-                        os.system('"cmd.exe"' and pg_dump)
+                    runId = datetime.now().strftime('%Y%m%d%H%M%S')
+                    units = makePlan(tables)
+                    for unit in units:
+                        unit['file'] = dumpFileName(unitFileName(DBName,unit,runId))
+                    schema = None
+                    schemaSuccess = True
+                    if schemaCacheFlag:
+                        schema = planSchema('c:\\pgDump\\',DBName,schemaHashes,dumpFileName(DBName+'_schema_'+runId))
+                    if incrementalFlag:
+                        manifest = loadManifest('c:\\pgDump\\',DBName)
+                        # The data-only files of the tables the schema changed would not load into it
+                        units, unchanged = splitUnchanged(manifest,units,fingerprints,'c:\\pgDump\\',
+                                                          schemaChangedTables(schema,fingerprints,'public.') if schema else ())
+                    journal = openJournal('c:\\pgDump\\',DBName,resume=resumeFlag)
+                    finished = []
+                    if resumeFlag:
+                        units, finished = splitFinished(journal,units,'c:\\pgDump\\')
+                        if consistentFlag and finished:
+                            print('WARNING: the tables dumped by the interrupted run were dumped on another snapshot.')
+                    if binSize:
+                        units = packBins(units,binSize)
+                        for unit in units:
+                            unit['file'] = dumpFileName(unitFileName(DBName,unit,runId))
+                    snapshotId = None
+                    if consistentFlag:
+                        # The coordinator transaction stays open until every table is dumped
+                        snapshotConn, snapshotCursor = DBConnect(host=host,user= user,database=DBName,password=password)
+                        snapshotId = exportPostgresSnapshot(snapshotConn,snapshotCursor)
+                    try:
+                        if schema:
+                            schemaJob = startSchemaDump(schema,lambda: dumpSchemaFile(host,port,user,DBName,DBName+'_schema_'+runId,snapshotId),retries)
+                        results = runParallel(units, lambda unit: runJournaled('c:\\pgDump\\',journal,unit,
+                                              lambda: dumpTables(host,port,user,DBName,unit.get('tables',[unit['name']]),unitFileName(DBName,unit,runId),snapshotId)),
+                                              jobs=jobs, retries=retries)
+                        if schema and snapshotId:
+                            # The schema dump may still be on the snapshot
+                            schemaSuccess = finishSchema('c:\\pgDump\\',DBName,schema,schemaJob)
+                        elif schema:
+                            # Without --consistent the schema is checked against the catalog once its dump ended too
+                            if schemaJob:
+                                schemaJob.result()
+                            conn, cursor = DBConnect(host=host,user= user,database=DBName,password=password)
+                            schemaHashes = querySchema(conn, cursor, DBName)
+                            conn.close()
+                            schemaSuccess = finishSchema('c:\\pgDump\\',DBName,schema,schemaJob,schemaHashes)
+                    finally:
+                        if snapshotId:
+                            snapshotConn.close()
+                    success = allSucceeded(results) and schemaSuccess
+                    finishJournal('c:\\pgDump\\',journal,success)
+                    units, results = unpackResults(units,results)
+                    # Tables dumped by the interrupted run count as dumped by this one
+                    units += finished
+                    results += [{'name': unit['name'], 'success': True} for unit in finished]
+                    if incrementalFlag:
+                        saveManifest('c:\\pgDump\\',DBName,updateManifest(manifest,units,results,fingerprints))
+                        saveTableIndex('c:\\pgDump\\',DBName,{name: entry['file'] for name, entry in manifest['tables'].items()},schema and schema['file'])
+                    else:
+                        saveTableIndex('c:\\pgDump\\',DBName,{unit['name']: unit['file'] for unit in units},schema and schema['file'])
+                    checksumTables = plannedTables(units)
                 else:
                     raise ValueError('ERROR: Invalid mode provided in backupDB function.')
+            elif dumpFormat:
+                success = dumpServer(host,port,user,serverName,databaseList)
+                checksumTables = {}
+            elif archiveFlag:
+                pg_dumpall = pgCommand('pg_dumpall',host,port,user)
+                results = runParallel([{'name': serverName}], lambda unit: streamArchive(pg_dumpall,'c:\\pgDump\\',serverName,'postgres',codec,level), unitName='server', retries=retries)
+                success = allSucceeded(results)
+                checksumTables = {}
             else:
-                pg_dumpall = '"pg_dumpall -h '+host+' -p '+port+' -U '+user+' > c:\pgDump\\'+serverName+'.dump"'
-                os.system('"cmd.exe"' and pg_dumpall)
+                pg_dumpall = pgCommand('pg_dumpall',host,port,user)
+                results = runParallel([{'name': serverName}], lambda unit: runDump(pg_dumpall,'c:\pgDump\\',serverName+'.dump'), unitName='server', retries=retries)
+                success = allSucceeded(results)
+                checksumTables = {}
         else:
             raise RuntimeError('ERROR: We could not Set/Create the pgpass.conf, review the code.')
+        stopThrottle()
+        if repositoryFlag:
+            # The files only exist as chunks, the run manifest holds their checksums
+            saveRunManifest()
+        else:
+            saveChecksums('c:\\pgDump\\',serverName if serverDump else DBName,checksumTables,'postgres')
+        saveReport(serverName if serverDump else DBName,success)
+        if uploadUrl:
+            uploadRunFiles('c:\\pgDump\\',serverName if serverDump else DBName)
         if clearPgpass():
-            return True
+            return success
         else:
             raise RuntimeError('ERROR: We could not clear the pgpass.conf content, review the code.')
-    except:
-        raise RuntimeError('ERROR: We could not proced with the backup process, review the code.')
+    except Exception as error:
+        stopThrottle()
+        clearPgpass()
+        raise RuntimeError('ERROR: We could not proced with the backup process, review the code. ({})'.format(error)) from error
+
+
+## Restore a native export, a custom/directory dump or the per-table dump files ##
+def restoreDB(host,port,user,password,DBName):
+    path = 'c:\\pgDump\\'
+    startRun()
+    try:
+        if setPGPass(DBName,user,password,host=host):
+            psql = pgCommand('psql',host,port,user)
+            pg_restore = pgCommand('pg_restore',host,port,user)
+            if os.path.exists(exportManifestPath(path,DBName)):
+                success = restoreExport(lambda: DBConnect(host=host,user= user,database=DBName,password=password),psql,DBName,path,jobs=jobs)
+            elif wholeDatabaseFile(path,DBName):
+                filename = wholeDatabaseFile(path,DBName)
+                restore = pg_restore+['--exit-on-error', '-d', DBName]
+                if os.path.isdir(path+filename) or filename.endswith('.dump'):
+                    # The directory and custom formats read from a file are restored by pg_restore's own workers
+                    restore += ['-j', str(jobs)]
+                results = runParallel([{'name': DBName}], lambda unit: pgRestoreFile(restore,path+filename), unitName='database')
+                success = allSucceeded(results)
+            else:
+                success = restorePostgres(pg_restore,path,DBName,jobs=jobs)
+        else:
+            raise RuntimeError('ERROR: We could not Set/Create the pgpass.conf, review the code.')
+        saveReport(DBName+'_restore',success)
+        if clearPgpass():
+            return success
+        else:
+            raise RuntimeError('ERROR: We could not clear the pgpass.conf content, review the code.')
+    except Exception as error:
+        clearPgpass()
+        raise RuntimeError('ERROR: We could not proced with the restore process, review the code. ({})'.format(error)) from error
 
 
 ## Get initial arguments and set flags ##
@@ -235,6 +667,75 @@ def getArguments():
     else:
         mode = 'all'
 
+    # pg_dump format
+    global dumpFormat
+    if '--format' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--format':
+                dumpFormat = sys.argv[idx+1]
+                break
+            else:
+                idx += 1
+        if dumpFormat not in dumpFormats:
+            raise ValueError('Invalid format, use one of: '+', '.join(dumpFormats)+'.')
+
+    # Native export and restore
+    global nativeFlag
+    if '--native' in sys.argv:
+        nativeFlag = True
+
+    global restoreFlag
+    if '--restore' in sys.argv:
+        restoreFlag = True
+
+    # Resume the interrupted last run
+    global resumeFlag
+    if '--resume' in sys.argv:
+        resumeFlag = True
+
+    # Retries of a failed dump unit
+    global retries
+    if '--retries' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--retries':
+                retries = int(sys.argv[idx+1])
+                break
+            else:
+                idx += 1
+
+    # Compress result
+    global compressFlag
+    if '-c' in sys.argv:
+        compressFlag = True
+
+    # Stream the dump output into the compressor
+    global streamFlag
+    if '--stream' in sys.argv:
+        streamFlag = True
+
+    # Compression codec and level
+    global codec
+    if '--codec' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--codec':
+                codec = sys.argv[idx+1]
+                break
+            else:
+                idx += 1
+
+    global level
+    if '--level' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--level':
+                level = int(sys.argv[idx+1])
+                break
+            else:
+                idx += 1
+
     # host
     global host
     host = None
@@ -292,6 +793,197 @@ def getArguments():
             else:
                 idx += 1
 
+    # Throttling
+    global maxRate
+    if '--max-rate' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--max-rate':
+                maxRate = float(sys.argv[idx+1])*1024**2
+                break
+            else:
+                idx += 1
+
+    global maxActive
+    if '--max-active' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--max-active':
+                maxActive = int(sys.argv[idx+1])
+                break
+            else:
+                idx += 1
+
+    global maxLag
+    if '--max-lag' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--max-lag':
+                maxLag = float(sys.argv[idx+1])
+                break
+            else:
+                idx += 1
+
+    # Share one snapshot between the parallel dumps
+    global consistentFlag
+    if '--consistent' in sys.argv:
+        consistentFlag = True
+
+    # Seekable archive of the whole dump
+    global archiveFlag
+    if '--archive' in sys.argv:
+        archiveFlag = True
+
+    # Hash of the in-flight checksums
+    if '--hash' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--hash':
+                setHashAlgorithm(sys.argv[idx+1])
+                break
+            else:
+                idx += 1
+
+    # Only dump the tables changed since the last run
+    global incrementalFlag
+    if '--incremental' in sys.argv:
+        incrementalFlag = True
+
+    # Deduplicated chunk repository
+    global repositoryFlag
+    if '--repository' in sys.argv:
+        if incrementalFlag:
+            raise ValueError('--repository already stores the unchanged tables once, it can not be used with --incremental.')
+        if nativeFlag or archiveFlag:
+            raise ValueError('--repository stores the pg_dump output, it can not be used with --native or --archive.')
+        if dumpFormat == 'directory':
+            raise ValueError('--repository needs the tar or custom format, pg_dump writes the directory format itself.')
+        repositoryFlag = True
+
+    # Data-only table dumps, the schema dumped when it changed
+    global schemaCacheFlag
+    if '--schema-cache' in sys.argv:
+        if mode != 'byTable' or serverDump:
+            raise ValueError('--schema-cache only applies to the -t mode.')
+        if nativeFlag or archiveFlag or repositoryFlag:
+            raise ValueError('--schema-cache keeps the schema file on disk, it can not be used with --native, --archive or --repository.')
+        schemaCacheFlag = True
+
+    # Streaming upload to an S3-compatible store
+    global endpoint
+    if '--endpoint' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--endpoint':
+                endpoint = sys.argv[idx+1]
+                break
+            else:
+                idx += 1
+
+    global uploadUrl
+    if '--upload' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--upload':
+                uploadUrl = sys.argv[idx+1]
+                break
+            else:
+                idx += 1
+        if nativeFlag or archiveFlag or repositoryFlag or schemaCacheFlag or dumpFormat == 'directory':
+            raise ValueError('--upload streams the pg_dump output, it can not be used with --native, --archive, --repository, --schema-cache or the directory format.')
+        if incrementalFlag or resumeFlag:
+            # Both look for the files of the last run on the local drive
+            raise ValueError('--upload keeps no local file, it can not be used with --incremental or --resume.')
+        configureUpload(uploadUrl,endpoint)
+
+    # Columnar export
+    global columnarFormat
+    if '--columnar' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--columnar':
+                columnarFormat = sys.argv[idx+1]
+                break
+            else:
+                idx += 1
+        if columnarFormat not in columnarFormats:
+            raise ValueError('Invalid columnar format, use one of: '+', '.join(columnarFormats)+'.')
+        if nativeFlag or archiveFlag or incrementalFlag or repositoryFlag or uploadUrl or schemaCacheFlag or serverDump:
+            raise ValueError('--columnar is an export mode of its own, it can not be used with -s, --native, --archive, --incremental, --repository, --upload or --schema-cache.')
+        # Arrow IPC has no gzip, the gzip default of the SQL dumps becomes zstd
+        if '--codec' not in sys.argv:
+            codec = 'zstd'
+        elif codec not in columnarCodecs[columnarFormat]:
+            raise ValueError('--columnar '+columnarFormat+' can not be compressed with '+codec+', use one of: '+', '.join(columnarCodecs[columnarFormat])+'.')
+
+    # Referentially-closed subset
+    global subsetRoots
+    if '--subset' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--subset':
+                subsetRoots.append(sys.argv[idx+1])
+            idx += 1
+        if mode == 'byTable' or serverDump:
+            raise ValueError('--subset dumps the whole database to a single file, it can not be used with -t or -s.')
+        if nativeFlag or archiveFlag or repositoryFlag or uploadUrl or columnarFormat:
+            raise ValueError('--subset is an export mode of its own, it can not be used with --native, --archive, --repository, --upload or --columnar.')
+
+    # Limits of the dump tools and cancellation of the run on the first failure
+    global timeoutMinutes, stallMinutes, failFastFlag
+    if '--timeout' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--timeout':
+                timeoutMinutes = float(sys.argv[idx+1])
+                break
+            else:
+                idx += 1
+    if '--stall' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--stall':
+                stallMinutes = float(sys.argv[idx+1])
+                break
+            else:
+                idx += 1
+    if '--fail-fast' in sys.argv:
+        failFastFlag = True
+    configureProcesses(timeout=timeoutMinutes and timeoutMinutes*60,stall=stallMinutes and stallMinutes*60,cancelOnFailure=failFastFlag)
+
+    # Prometheus textfile
+    global prometheusFile
+    if '--prometheus' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--prometheus':
+                prometheusFile = sys.argv[idx+1]
+                break
+            else:
+                idx += 1
+
+    # Pack small tables in bins
+    global binSize
+    if '--bin-size' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--bin-size':
+                binSize = float(sys.argv[idx+1])*1024**2
+                break
+            else:
+                idx += 1
+
+    # Parallel jobs
+    global jobs
+    if '--jobs' in sys.argv:
+        idx = 0
+        for entry in sys.argv:
+            if entry == '--jobs':
+                jobs = int(sys.argv[idx+1])
+                break
+            else:
+                idx += 1
+
     if serverDump:
         if not (serverName or host or user):
             raise ValueError('Server Name and/or host and or user arguments missing.')
@@ -321,6 +1013,17 @@ if __name__ == '__main__':
             print('The backup could not be done.')
             executionTime = datetime.now()-executionTime
             print('Execution time: {}'.format(executionTime))
+            sys.exit(1)
+    elif restoreFlag:
+        if restoreDB(DBName=DBName,host=host,port=port,user=user,password=os.getenv(environPassword)):
+            print('Restore finished.')
+            executionTime = datetime.now()-executionTime
+            print('Execution time: {}'.format(executionTime))
+        else:
+            print('The restore could not be done.')
+            executionTime = datetime.now()-executionTime
+            print('Execution time: {}'.format(executionTime))
+            sys.exit(1)
     else:
         if backupDB(DBName=DBName,host=host,port=port,user=user,password=os.getenv(environPassword),mode = mode):
             print('Backup finished, you can find your files on c:\pgDump directory.')
@@ -330,3 +1033,4 @@ if __name__ == '__main__':
             print('The backup could not be done.')
             executionTime = datetime.now()-executionTime
             print('Execution time: {}'.format(executionTime))
+            sys.exit(1)